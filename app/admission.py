@@ -0,0 +1,245 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.settings import settings
+
+# /chat runs at most CHAT_MAX_ACTIVE pipelines at once per API process; the
+# rest wait in a bounded queue with one lane per priority. A request whose
+# expected wait is already too long is refused up front rather than left to
+# time out inside the LLM client, so the requests that are admitted finish
+# in about the time they would on an idle server.
+LANES = ("high", "normal", "low")  # served in this order, FIFO within a lane
+# Share of CHAT_MAX_QUEUED a lane may fill: under load the low lane is shed first.
+LANE_SHARE = {"high": 1.0, "normal": 0.75, "low": 0.5}
+SERVICE_TIME_ALPHA = 0.2  # weight of the latest pipeline duration in the running average
+
+
+class Rejected(Exception):
+    """A request that was not admitted, with the seconds to wait before retrying."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """Bounded, prioritized admission to a limited number of slots.
+
+    A request is refused with 429 when its lane is full or its estimated wait
+    exceeds max_wait, and with 503 when it did wait max_wait without getting
+    a slot (the estimate was wrong). The estimate is the running average
+    pipeline duration times the requests ahead, divided by the slots.
+    """
+
+    def __init__(self, max_active: int, max_queued: int, max_wait: float, service_time: float = 5.0):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.service_time = service_time  # seconds, until the first pipeline finishes
+        self.active = 0
+        self.waiters: Dict[str, deque] = {lane: deque() for lane in LANES}
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def queued(self, up_to: str = LANES[-1]) -> int:
+        # Requests in lane up_to and the lanes served before it.
+        return sum(len(self.waiters[lane]) for lane in LANES[:LANES.index(up_to) + 1])
+
+    def estimate_wait(self, ahead: int) -> float:
+        if self.active < self.max_active and not ahead:
+            return 0.0
+        return (ahead // self.max_active + 1) * self.service_time
+
+    def _reject(self, status_code: int, detail: str, retry_after: float) -> Rejected:
+        self.rejected += 1
+        return Rejected(status_code, detail, retry_after)
+
+    async def acquire(self, lane: str):
+        if lane not in self.waiters:
+            raise ValueError(f"Unknown priority '{lane}', expected one of {LANES}")
+        ahead = self.queued(lane)
+        if self.active < self.max_active and not ahead:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queued() >= self.max_queued * LANE_SHARE[lane]:
+            raise self._reject(429, "Too many chat requests queued", self.estimate_wait(self.queued()))
+        wait = self.estimate_wait(ahead)
+        if wait > self.max_wait:
+            raise self._reject(429, f"Chat requests are queued for about {wait:.0f} seconds", wait)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiters[lane].append(future)
+        # release() hands its slot over by resolving the future, the timer fails it.
+        timer = loop.call_later(self.max_wait, self._expire, lane, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The client went away; a slot handed over meanwhile goes to the next
+            # request. A future failed by _expire holds no slot.
+            if future in self.waiters[lane]:
+                self.waiters[lane].remove(future)
+            elif future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+        self.admitted += 1
+
+    def _expire(self, lane: str, future: asyncio.Future):
+        if future.done():
+            return
+        self.waiters[lane].remove(future)
+        self.timed_out += 1
+        future.set_exception(self._reject(503, f"No chat slot became free within {self.max_wait:.0f} seconds", self.estimate_wait(self.queued(lane))))
+
+    def release(self):
+        for lane in LANES:
+            while self.waiters[lane]:
+                future = self.waiters[lane].popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.active -= 1
+
+    def observe(self, seconds: float):
+        self.service_time += SERVICE_TIME_ALPHA * (seconds - self.service_time)
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        await self.acquire(lane)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued(),
+            **{f"queued_{lane}": len(self.waiters[lane]) for lane in LANES},
+            "service_time": round(self.service_time, 3),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class Flight:
+    """One run of an event stream, replayed to every caller that joined it."""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.callers = 0
+        self.admitted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        self.abandoned = False  # every caller left, the run is being cancelled
+        self._changed = asyncio.Event()
+
+    def admit(self):
+        if not self.admitted.done():
+            self.admitted.set_result(None)
+
+    def publish(self, event: Any):
+        self.events.append(event)
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.finished = True
+        if not self.admitted.done():
+            if error is None:
+                self.admitted.cancel()
+            else:
+                # Rejected (or failed) before it was admitted. Retrieved here so
+                # the exception is not logged as unhandled when no caller waits.
+                self.admitted.set_exception(error)
+                self.admitted.exception()
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[Any]:
+        # From the first event, whenever the caller joined. Leaving the last
+        # caller of an unfinished flight cancels its run.
+        try:
+            position = 0
+            while True:
+                while position < len(self.events):
+                    yield self.events[position]
+                    position += 1
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.leave()
+
+    def leave(self):
+        self.callers -= 1
+        if self.callers <= 0 and not self.finished and self.task is not None:
+            self.abandoned = True
+            self.task.cancel()
+
+
+class SingleFlight:
+    """Runs identical concurrent requests once.
+
+    join() with the key of a flight still running returns that flight; its
+    events so far are replayed and the rest arrive as they happen. A key of
+    None always starts a new flight.
+    """
+
+    def __init__(self):
+        self.flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, key: Optional[str], run: Callable[[Flight], Awaitable[None]]) -> Flight:
+        flight = self.flights.get(key) if key is not None else None
+        if flight is not None and not flight.abandoned:
+            self.joined += 1
+        else:
+            flight = Flight()
+            self.started += 1
+            if key is not None:
+                self.flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, run))
+        flight.callers += 1
+        return flight
+
+    async def _run(self, key: Optional[str], flight: Flight, run: Callable[[Flight], Awaitable[None]]):
+        try:
+            await run(flight)
+        except asyncio.CancelledError:
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            # Later requests start a new flight (and see cached answers, if any).
+            if key is not None and self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self.flights), "started": self.started, "joined": self.joined}
+
+
+chat_admission = AdmissionController(settings.CHAT_MAX_ACTIVE, settings.CHAT_MAX_QUEUED, settings.CHAT_MAX_QUEUE_WAIT)
+chat_flights = SingleFlight()
@@ -0,0 +1,256 @@
+import hashlib
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+import numpy as np
+import redis.asyncio as redis
+
+from app.settings import settings
+
+
+def normalize(text: str) -> str:
+    # all-MiniLM-L6-v2 uses an uncased tokenizer, so case folding does not change the vector.
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.casefold().split())
+
+
+class EmbeddingCache:
+    """Two-level query embedding cache: a bounded in-process LRU in front of Redis."""
+
+    def __init__(self, model_name: str, max_size: int, ttl: int, redis_url: Optional[str] = None):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis = redis.from_url(redis_url) if redis_url else None
+        self._local: OrderedDict[str, tuple[float, List[float]]] = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.redis_errors = 0
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model_name}\0{normalize(text)}".encode()).hexdigest()
+        return f"embcache:{digest}"
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return vector
+
+    def _set_local(self, key: str, vector: List[float]):
+        self._local[key] = (time.monotonic() + self.ttl, vector)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, text: str) -> Optional[List[float]]:
+        key = self.key(text)
+        vector = self._get_local(key)
+        if vector is not None:
+            self.local_hits += 1
+            return vector
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(key)
+            except redis.RedisError:
+                # The cache is an optimization, never fail a request because Redis is down.
+                self.redis_errors += 1
+                raw = None
+            if raw is not None:
+                vector = array("f", raw).tolist()
+                self._set_local(key, vector)
+                self.redis_hits += 1
+                return vector
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, vector: List[float]):
+        key = self.key(text)
+        self._set_local(key, vector)
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, array("f", vector).tobytes(), ex=self.ttl)
+            except redis.RedisError:
+                self.redis_errors += 1
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._local),
+            "max_size": self.max_size,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "redis_errors": self.redis_errors,
+            "hit_rate": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+
+@dataclass
+class CachedAnswer:
+    scope: str  # search options the answer was produced with
+    vector: np.ndarray  # query embedding, unit length
+    response: dict
+    chunk_ids: frozenset
+    source_ids: frozenset
+    collections: frozenset
+    expires_at: float
+
+
+class AnswerCache:
+    """Answers of earlier queries, reused for a query whose embedding is at
+    least `threshold` cosine-similar to a cached one under the same options.
+
+    In-process, LRU-bounded with a TTL. Entries remember the chunks and
+    sources they were generated from, so a source change (see
+    app.events.source_event) only drops the answers that used it.
+    """
+
+    def __init__(self, threshold: float, max_size: int, ttl: int, log_size: int = 1000):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._next_id = 0
+        # Invalidations by version, to check answers that were generated while they arrived.
+        self.version = 0
+        self._log: deque[tuple[int, dict]] = deque(maxlen=log_size)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.stale = 0
+        self.invalidated = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope: str, vector: List[float]) -> Optional[tuple[dict, float]]:
+        # The cached response and its similarity, or None.
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry.expires_at < now]:
+            del self._entries[key]
+            self.expired += 1
+        candidates = [(key, entry) for key, entry in self._entries.items() if entry.scope == scope]
+        if candidates:
+            similarities = np.stack([entry.vector for _, entry in candidates]) @ self._unit(vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                key, entry = candidates[best]
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.response, float(similarities[best])
+        self.misses += 1
+        return None
+
+    def put(self, scope: str, vector: List[float], response: dict, docs: Iterable, collections: Iterable[str], version: int):
+        # version is self.version from before retrieval. An answer built from
+        # chunks that were invalidated in the meantime is not stored.
+        docs = list(docs)
+        entry = CachedAnswer(
+            scope=scope,
+            vector=self._unit(vector),
+            response=response,
+            chunk_ids=frozenset(doc.id for doc in docs),
+            source_ids=frozenset(doc.source_id for doc in docs),
+            collections=frozenset(collections),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        if version < self.version:
+            missed = [event for v, event in self._log if v > version]
+            if len(missed) < self.version - version or any(self._affects(event, entry) for event in missed):
+                self.stale += 1
+                return
+        self._entries[self._next_id] = entry
+        self._next_id += 1
+        self.stores += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _affects(event: dict, entry: CachedAnswer) -> bool:
+        if event["source_id"] is None:
+            return event["collection"] in entry.collections
+        if event["source_id"] not in entry.source_ids:
+            return False
+        # New chunks of a source the answer used may change it; removed ones only if it used them.
+        return event["deleted"] or event["added"] > 0 or not entry.chunk_ids.isdisjoint(event["removed"])
+
+    def invalidate(self, event: dict) -> int:
+        self.version += 1
+        self._log.append((self.version, event))
+        stale = [key for key, entry in self._entries.items() if self._affects(event, entry)]
+        for key in stale:
+            del self._entries[key]
+        self.invalidated += len(stale)
+        return len(stale)
+
+    def clear(self):
+        self.version += 1
+        # Any answer generated before now may miss an invalidation.
+        self._log.clear()
+        self.invalidated += len(self._entries)
+        self._entries.clear()
+
+    async def follow(self, hub):
+        # Applies the source events of every worker and API process. When the
+        # subscription is dropped invalidations may have been missed, so the
+        # cache starts over.
+        while True:
+            async with hub.subscribe() as queue:
+                while (message := await queue.get()) is not None:
+                    if message["event"] != "source":
+                        continue
+                    try:
+                        self.invalidate(message["data"])
+                    except Exception as e:
+                        print(f"Could not apply source event {message['data']}: {e!r}")
+                        break
+            self.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "stale": self.stale,
+            "invalidated": self.invalidated,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache(
+    model_name=settings.EMBEDDING_MODEL,
+    max_size=settings.EMBED_CACHE_SIZE,
+    ttl=settings.EMBED_CACHE_TTL,
+    redis_url=settings.REDIS_URL if settings.EMBED_CACHE_REDIS else None,
+)
+
+answer_cache = AnswerCache(
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+    max_size=settings.ANSWER_CACHE_SIZE,
+    ttl=settings.ANSWER_CACHE_TTL,
+)
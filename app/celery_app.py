@@ -0,0 +1,27 @@
+from celery import Celery
+from app.settings import settings
+
+# The API only enqueues tasks by name, so it imports this module and never
+# app.worker (and the worker's database engine and models).
+celery_app = Celery(
+    "worker",
+    broker=settings.REDIS_URL,
+    backend=settings.REDIS_URL,
+    include=["app.worker"],
+)
+
+# Each ingestion stage has its own queue (see app.pipeline), so workers can
+# be sized per stage: many threads for fetch, a process per core for parse
+# and embed. Everything else runs on the default "celery" queue.
+INGEST_QUEUES = {
+    "app.worker.scrape_url": "fetch",
+    "app.worker.scrape_batch": "fetch",
+    "app.worker.crawl_page": "fetch",
+    "app.worker.ingest_file": "parse",
+    "app.worker.parse_document": "parse",
+    "app.worker.embed_chunks": "embed",
+    "app.worker.write_batch": "write",
+}
+celery_app.conf.task_routes = {task: {"queue": queue} for task, queue in INGEST_QUEUES.items()}
+# Stage tasks can be long; a process should not hold tasks another one could start.
+celery_app.conf.worker_prefetch_multiplier = 1
@@ -0,0 +1,147 @@
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from app.models import Document
+from app.settings import settings
+
+# Turns retrieved chunks into prompt context: chunks of the same source that
+# overlap or follow each other are merged back into one passage, passages
+# whose text is already in the context are dropped, and the rest is packed
+# in relevance order until the token budget is spent.
+
+
+@dataclass
+class Passage:
+    text: str
+    source: str
+    source_id: Optional[int]
+    start: Optional[int]
+    end: Optional[int]
+    last_ordinal: Optional[int]
+    rank: int  # best retrieval rank among the merged chunks
+    chunk_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class PackedContext:
+    text: str
+    passages: List[Passage]
+    tokens: int
+    merged: int  # chunks folded into another passage
+    dropped: int  # passages skipped as near-duplicates
+    truncated: bool
+    over_budget: int  # passages that did not fit
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.passages)} passages, ~{self.tokens} tokens "
+            f"({self.merged} merged, {self.dropped} duplicates dropped, {self.over_budget} over budget)"
+        )
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / settings.CONTEXT_CHARS_PER_TOKEN)
+
+
+def _next_ordinal(current: Passage, p: Passage) -> bool:
+    # Consecutive chunks the splitter could not overlap (split at a separator).
+    return current.last_ordinal is not None and p.last_ordinal == current.last_ordinal + 1
+
+
+def merge_chunks(docs: Sequence[Document]) -> List[Passage]:
+    passages = [
+        Passage(doc.content, doc.source, doc.source_id, doc.start_offset, doc.end_offset, doc.ordinal, rank, [doc.id])
+        for rank, doc in enumerate(docs)
+    ]
+    # Chunks stored before positions were recorded are used as they are.
+    merged = [p for p in passages if p.start is None or p.source_id is None]
+    positioned = sorted(
+        (p for p in passages if p.start is not None and p.source_id is not None),
+        key=lambda p: (p.source_id, p.start),
+    )
+
+    current = None
+    for p in positioned:
+        follows = (
+            current is not None
+            and p.source_id == current.source_id
+            and (p.start <= current.end or _next_ordinal(current, p))
+        )
+        if not follows:
+            if current is not None:
+                merged.append(current)
+            current = p
+            continue
+        if p.end > current.end:
+            if p.start <= current.end:
+                # Offsets index the same extracted text, so the overlap can be cut exactly.
+                current.text += p.text[current.end - p.start:]
+            else:
+                current.text += "\n" + p.text
+            current.end = p.end
+            current.last_ordinal = p.last_ordinal
+        current.rank = min(current.rank, p.rank)
+        current.chunk_ids += p.chunk_ids
+    if current is not None:
+        merged.append(current)
+    return sorted(merged, key=lambda p: p.rank)
+
+
+def shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def drop_near_duplicates(passages: List[Passage], threshold: float) -> List[Passage]:
+    # A passage is dropped when at least `threshold` of its word shingles are
+    # already in the context, e.g. the same boilerplate on several pages.
+    kept, seen = [], set()
+    for passage in passages:
+        words = shingles(passage.text)
+        if words and len(words & seen) / len(words) >= threshold:
+            continue
+        kept.append(passage)
+        seen |= words
+    return kept
+
+
+def truncate(text: str, tokens: int) -> str:
+    limit = int(tokens * settings.CONTEXT_CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+
+def build_context(docs: Sequence[Document], budget: Optional[int] = None, threshold: Optional[float] = None) -> PackedContext:
+    budget = settings.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    threshold = settings.CONTEXT_DEDUP_THRESHOLD if threshold is None else threshold
+
+    merged = merge_chunks(docs)
+    unique = drop_near_duplicates(merged, threshold)
+
+    packed, used, truncated, over_budget = [], 0, False, 0
+    for passage in unique:
+        tokens = estimate_tokens(passage.text)
+        if budget and used + tokens > budget:
+            if packed:
+                # Keep looking, a smaller, less relevant passage may still fit.
+                over_budget += 1
+                continue
+            # The best passage alone is over budget: keep its beginning.
+            passage.text = truncate(passage.text, budget)
+            tokens = estimate_tokens(passage.text)
+            truncated = True
+        packed.append(passage)
+        used += tokens
+
+    return PackedContext(
+        text="\n\n".join(p.text for p in packed),
+        passages=packed,
+        tokens=used,
+        merged=len(docs) - len(merged),
+        dropped=len(merged) - len(unique),
+        truncated=truncated,
+        over_budget=over_budget,
+    )
@@ -0,0 +1,168 @@
+import json
+import time
+import xml.etree.ElementTree as ET
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urldefrag, urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+import redis
+
+from app.fetcher import USER_AGENT, host_of, http
+from app.models import DEFAULT_COLLECTION
+from app.settings import settings
+
+# All crawl state lives in Redis so any worker can pick up any page:
+#   crawl:<id>:config    hash  seed host, max depth/pages
+#   crawl:<id>:frontier  list  JSON [url, depth] waiting to be dispatched
+#   crawl:<id>:seen      set   every URL ever queued
+#   crawl:<id>:queued    int   pages accepted so far (capped by max_pages)
+#   crawl:<id>:inflight  int   pages dispatched but not finished
+#   crawl:<id>:done / :failed  int
+#   crawl:host:<host>    politeness lock, expires after the host delay
+store = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+_robots: dict[str, Tuple[float, Optional[RobotFileParser]]] = {}
+
+
+def key(crawl_id: str, name: str) -> str:
+    return f"crawl:{crawl_id}:{name}"
+
+
+def normalize_url(url: str) -> str:
+    return urldefrag(url.strip())[0]
+
+
+def is_same_site(url: str, host: str) -> bool:
+    parts = urlsplit(url)
+    return parts.scheme in ("http", "https") and parts.netloc.lower() == host
+
+
+def resolve_links(hrefs: Iterable[str], base_url: str) -> List[str]:
+    # hrefs as collected by extract.HTMLTextExtractor while the page is parsed.
+    return [normalize_url(urljoin(base_url, href)) for href in hrefs]
+
+
+def sitemap_urls(url: str, depth: int = 0) -> List[str]:
+    response = http.get(url, timeout=settings.FETCH_TIMEOUT)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+    ns = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+    locs = [loc.text.strip() for loc in root.iter(f"{ns}loc") if loc.text]
+    if root.tag == f"{ns}sitemapindex":
+        # A sitemap index points at further sitemaps; follow one level.
+        return [page for sitemap in locs for page in sitemap_urls(sitemap, depth + 1)] if depth == 0 else []
+    return locs
+
+
+def robots_for(url: str) -> Optional[RobotFileParser]:
+    host = host_of(url)
+    cached = _robots.get(host)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    parser = RobotFileParser()
+    try:
+        response = http.get(f"{urlsplit(url).scheme}://{host}/robots.txt", timeout=settings.FETCH_TIMEOUT)
+        parser.parse(response.text.splitlines() if response.status_code == 200 else [])
+    except Exception:
+        parser = None  # unreachable robots.txt: treat as allow-all
+    _robots[host] = (time.monotonic() + 3600, parser)
+    return parser
+
+
+def allowed(url: str) -> bool:
+    if not settings.CRAWL_RESPECT_ROBOTS:
+        return True
+    parser = robots_for(url)
+    return parser is None or parser.can_fetch(USER_AGENT, url)
+
+
+def host_delay(url: str) -> float:
+    delay = settings.CRAWL_HOST_DELAY
+    parser = robots_for(url) if settings.CRAWL_RESPECT_ROBOTS else None
+    if parser is not None and parser.crawl_delay(USER_AGENT):
+        delay = max(delay, float(parser.crawl_delay(USER_AGENT)))
+    return delay
+
+
+def acquire_host_slot(url: str) -> Optional[float]:
+    # Returns None when the page may be fetched now, otherwise the seconds to wait.
+    delay = host_delay(url)
+    lock = f"crawl:host:{host_of(url)}"
+    if store.set(lock, 1, nx=True, px=max(1, int(delay * 1000))):
+        return None
+    return max(store.pttl(lock), 100) / 1000
+
+
+def init(crawl_id: str, host: str, max_depth: int, max_pages: int, collection: str = DEFAULT_COLLECTION):
+    store.hset(key(crawl_id, "config"), mapping={
+        "host": host, "max_depth": max_depth, "max_pages": max_pages, "collection": collection,
+    })
+    store.expire(key(crawl_id, "config"), settings.CRAWL_TTL)
+    for name in ("queued", "inflight", "done", "failed"):
+        store.set(key(crawl_id, name), 0, ex=settings.CRAWL_TTL)
+
+
+def config(crawl_id: str) -> dict:
+    raw = store.hgetall(key(crawl_id, "config"))
+    return {
+        "host": raw["host"],
+        "max_depth": int(raw["max_depth"]),
+        "max_pages": int(raw["max_pages"]),
+        "collection": raw.get("collection", DEFAULT_COLLECTION),  # crawls started before collections
+    }
+
+
+def enqueue(crawl_id: str, urls: Iterable[str], depth: int) -> int:
+    conf = config(crawl_id)
+    if depth > conf["max_depth"]:
+        return 0
+    added = 0
+    for url in urls:
+        if not is_same_site(url, conf["host"]):
+            continue
+        if not store.sadd(key(crawl_id, "seen"), url):
+            continue
+        if store.incr(key(crawl_id, "queued")) > conf["max_pages"]:
+            break
+        store.rpush(key(crawl_id, "frontier"), json.dumps([url, depth]))
+        added += 1
+    for name in ("seen", "frontier"):
+        store.expire(key(crawl_id, name), settings.CRAWL_TTL)
+    return added
+
+
+def take(crawl_id: str) -> List[Tuple[str, int]]:
+    # Claims frontier entries up to the per-crawl concurrency limit.
+    # The slot is reserved before popping so concurrent workers never exceed it.
+    taken = []
+    while True:
+        if store.incr(key(crawl_id, "inflight")) > settings.CRAWL_CONCURRENCY:
+            store.decr(key(crawl_id, "inflight"))
+            break
+        raw = store.lpop(key(crawl_id, "frontier"))
+        if raw is None:
+            store.decr(key(crawl_id, "inflight"))
+            break
+        url, depth = json.loads(raw)
+        taken.append((url, depth))
+    return taken
+
+
+def finish_page(crawl_id: str, ok: bool) -> bool:
+    # Returns True when this was the last page of the crawl.
+    store.incr(key(crawl_id, "done" if ok else "failed"))
+    inflight = store.decr(key(crawl_id, "inflight"))
+    return inflight <= 0 and store.llen(key(crawl_id, "frontier")) == 0
+
+
+def progress(crawl_id: str) -> Optional[dict]:
+    if not store.exists(key(crawl_id, "config")):
+        return None  # expired or never started
+    counts = {
+        name: int(store.get(key(crawl_id, name)) or 0)
+        for name in ("queued", "inflight", "done", "failed")
+    }
+    # queued overshoots by one for every rejected URL once max_pages is reached
+    counts["queued"] = min(counts["queued"], config(crawl_id)["max_pages"])
+    counts["frontier"] = store.llen(key(crawl_id, "frontier"))
+    return counts
@@ -3,18 +3,114 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
 from sqlmodel import SQLModel
 from app.settings import settings
+from app import partitions, vector_index
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True, future=True)
+engine = create_async_engine(settings.DATABASE_URL, echo=settings.SQL_ECHO, future=True)
+
+async_session = sessionmaker(
+    engine, class_=AsyncSession, expire_on_commit=False
+)
+
+# create_all only creates missing tables, so columns added to existing
+# tables are applied here. Every statement must be idempotent.
+SCHEMA_PATCHES = [
+    "ALTER TABLE job ADD COLUMN IF NOT EXISTS kind VARCHAR NOT NULL DEFAULT 'scrape'",
+    "ALTER TABLE job ADD COLUMN IF NOT EXISTS parent_id VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_job_parent_id ON job (parent_id)",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS content_hash VARCHAR",
+    "DROP INDEX IF EXISTS ix_document_source_hash",
+    f"ALTER TABLE document ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{settings.TEXT_SEARCH_CONFIG}', content)) STORED",
+    # Source stats and real timestamps
+    "ALTER TABLE source ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'PENDING'",
+    "ALTER TABLE source ADD COLUMN IF NOT EXISTS chunk_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE source ADD COLUMN IF NOT EXISTS bytes BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE source ADD COLUMN IF NOT EXISTS last_ingested_at TIMESTAMP",
+    """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'job' AND column_name = 'created_at') <> 'timestamp without time zone' THEN
+            ALTER TABLE job
+                ALTER COLUMN created_at TYPE TIMESTAMP USING created_at::timestamp,
+                ALTER COLUMN finished_at TYPE TIMESTAMP USING finished_at::timestamp;
+            ALTER TABLE source ALTER COLUMN last_fetched_at TYPE TIMESTAMP USING last_fetched_at::timestamp;
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_job_top_level_created_at ON job (created_at) WHERE parent_id IS NULL",
+    # Collections: a URL is unique within its collection.
+    "ALTER TABLE source ADD COLUMN IF NOT EXISTS collection VARCHAR NOT NULL DEFAULT 'default'",
+    "ALTER TABLE source DROP CONSTRAINT IF EXISTS source_url_key",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_source_collection_url ON source (collection, url)",
+    # Link existing chunks to source rows once, when the foreign key is
+    # introduced. Chunks stored before collections existed are in the default one.
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'document' AND column_name = 'source_id') THEN
+            ALTER TABLE document ADD COLUMN source_id INTEGER REFERENCES source (id) ON DELETE CASCADE;
+            INSERT INTO source (collection, url, status, chunk_count, bytes, last_ingested_at)
+                SELECT 'default', source, 'ACTIVE', count(*), sum(octet_length(content)), now() AT TIME ZONE 'utc'
+                FROM document GROUP BY source
+                ON CONFLICT (collection, url) DO UPDATE SET
+                    status = 'ACTIVE',
+                    chunk_count = EXCLUDED.chunk_count,
+                    bytes = EXCLUDED.bytes,
+                    last_ingested_at = EXCLUDED.last_ingested_at;
+            UPDATE document d SET source_id = s.id FROM source s WHERE s.collection = 'default' AND d.source = s.url;
+        END IF;
+    END $$
+    """,
+    # Chunk positions; NULL for chunks stored before they were recorded.
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS ordinal INTEGER",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS start_offset INTEGER",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS end_offset INTEGER",
+    # An unpartitioned document table becomes the partition of the default
+    # collection. Its indexes are renamed out of the way, and the indexes
+    # created on the new parent below adopt them instead of rebuilding. The
+    # primary key on id alone is replaced by the parent's (id, collection).
+    """
+    DO $$
+    DECLARE
+        idx record;
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'document'::regclass) = 'r' THEN
+            ALTER TABLE document RENAME TO document__default;
+            EXECUTE format('ALTER TABLE document__default DROP CONSTRAINT %I', (
+                SELECT conname FROM pg_constraint WHERE conrelid = 'document__default'::regclass AND contype = 'p'
+            ));
+            FOR idx IN SELECT indexname FROM pg_indexes
+                       WHERE schemaname = current_schema() AND tablename = 'document__default' LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.indexname, 'document__default_' || idx.indexname);
+            END LOOP;
+            ALTER TABLE document__default ADD COLUMN collection VARCHAR NOT NULL DEFAULT 'default';
+            CREATE TABLE document (LIKE document__default INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)
+                PARTITION BY LIST (collection);
+            ALTER SEQUENCE document_id_seq OWNED BY document.id;
+            ALTER TABLE document ADD PRIMARY KEY (id, collection);
+            ALTER TABLE document ADD FOREIGN KEY (source_id) REFERENCES source (id) ON DELETE CASCADE;
+            ALTER TABLE document ATTACH PARTITION document__default FOR VALUES IN ('default');
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_content_tsv ON document USING gin (content_tsv)",
+    "CREATE INDEX IF NOT EXISTS ix_document_source_id ON document (source_id)",
+    "CREATE INDEX IF NOT EXISTS ix_document_source_id_hash ON document (source_id, content_hash)",
+    "INSERT INTO collection (name, created_at) VALUES ('default', now() AT TIME ZONE 'utc') ON CONFLICT DO NOTHING",
+    partitions.default_partition_patch(),
+]
 
 async def init_db():
     async with engine.begin() as conn:
         # await conn.run_sync(SQLModel.metadata.drop_all)
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         await conn.run_sync(SQLModel.metadata.create_all)
+        for statement in SCHEMA_PATCHES:
+            await conn.execute(text(statement))
+        await vector_index.ensure_index(conn)
 
 async def get_session() -> AsyncSession:
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
     async with async_session() as session:
         yield session
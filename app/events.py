@@ -0,0 +1,152 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Iterable, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from app.settings import settings
+
+# Job status changes and ingestion progress go out on one Redis pub/sub
+# channel. Each API process holds a single subscription and fans the events
+# out to its /jobs/stream clients, so open UIs no longer poll Postgres.
+#   {"event": "job", "data": <job row>}                 status changed
+#   {"event": "progress", "data": {"id", "stage", ...}}  fetched | chunked | embedded | written
+CHANNEL = "pulse:jobs"
+# Changes to stored chunks, for the answer cache of every API process.
+#   {"event": "source", "data": {"source_id", "collection", "added", "removed", "deleted"}}
+#   source_id is None when a whole collection was deleted.
+SOURCES_CHANNEL = "pulse:sources"
+
+_client = redis.Redis.from_url(settings.REDIS_URL)
+_async_client = aioredis.from_url(settings.REDIS_URL)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _message(event: str, data: dict) -> str:
+    return json.dumps({"event": event, "data": data}, default=_json_default)
+
+
+def job_event(job) -> dict:
+    return {
+        "id": job.id,
+        "url": job.url,
+        "kind": job.kind,
+        "parent_id": job.parent_id,
+        "status": job.status,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "result": job.result,
+    }
+
+
+def source_event(source_id: Optional[int], collection: str, added: int = 0, removed: Iterable[int] = (), deleted: bool = False) -> dict:
+    # removed lists the ids of deleted chunks, deleted means the whole source (or collection) is gone.
+    return {"source_id": source_id, "collection": collection, "added": added, "removed": list(removed), "deleted": deleted}
+
+
+def publish(event: str, data: dict, channel: str = CHANNEL):
+    # Progress is informational, never fail a task because Redis is down.
+    try:
+        _client.publish(channel, _message(event, data))
+    except redis.RedisError as e:
+        print(f"Could not publish {event} event: {e}")
+
+
+def progress(job_id: str, stage: str, **data):
+    publish("progress", {"id": job_id, "stage": stage, **data})
+
+
+async def apublish(event: str, data: dict, channel: str = CHANNEL):
+    try:
+        await _async_client.publish(channel, _message(event, data))
+    except redis.RedisError as e:
+        print(f"Could not publish {event} event: {e}")
+
+
+class EventHub:
+    """Fans one Redis subscription out to in-process subscriber queues.
+
+    A subscriber that falls more than max_pending events behind is dropped:
+    its queue receives None and the client reconnects for a fresh snapshot.
+    All subscribers are dropped the same way when the subscription is lost,
+    as events may have been missed.
+    """
+
+    def __init__(self, redis_url: str, max_pending: int, channel: str = CHANNEL):
+        self.redis_url = redis_url
+        self.max_pending = max_pending
+        self.channel = channel
+        self.queues: set[asyncio.Queue] = set()
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def deliver(self, message: dict):
+        for queue in list(self.queues):
+            if queue.qsize() >= self.max_pending:
+                self.queues.discard(queue)
+                queue.put_nowait(None)
+                self.dropped += 1
+            else:
+                queue.put_nowait(message)
+
+    def drop_all(self):
+        for queue in list(self.queues):
+            self.queues.discard(queue)
+            queue.put_nowait(None)
+            self.dropped += 1
+
+    async def _listen(self):
+        while True:
+            subscribed = False
+            try:
+                async with aioredis.from_url(self.redis_url).pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    subscribed = True
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.receive(message["data"])
+            except Exception as e:
+                # Not only Redis errors: a listener that ended silently would leave
+                # every subscriber (and the answer caches) waiting forever.
+                print(f"Subscription to {self.channel} lost: {e!r}")
+                if subscribed:
+                    self.drop_all()
+                await asyncio.sleep(1)
+
+    def receive(self, data: bytes):
+        # Anyone can publish on the channel; a malformed message is skipped.
+        try:
+            message = json.loads(data)
+            if not isinstance(message, dict) or "event" not in message or "data" not in message:
+                raise ValueError("not an event")
+        except ValueError as e:
+            print(f"Skipping malformed message on {self.channel}: {e}")
+            return
+        self.deliver(message)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        # The subscription starts with the first client, not at import time.
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        queue: asyncio.Queue = asyncio.Queue()
+        self.queues.add(queue)
+        try:
+            yield queue
+        finally:
+            self.queues.discard(queue)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self.queues), "dropped": self.dropped}
+
+
+job_events = EventHub(settings.REDIS_URL, settings.JOB_EVENTS_MAX_PENDING)
+source_events = EventHub(settings.REDIS_URL, settings.JOB_EVENTS_MAX_PENDING, SOURCES_CHANNEL)
@@ -0,0 +1,194 @@
+import codecs
+import os
+import re
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, List, Optional
+
+# Text extraction that works on a body arriving in blocks (an HTTP response
+# read from the socket, an uploaded file read from disk) and yields text as it
+# goes, so a document is never held in memory as a whole.
+
+READ_SIZE = 64 * 1024  # bytes per block read from a response or file
+MAX_LINE = 64 * 1024  # longer lines are cut, a minified page can be a single line
+SKIP_TAGS = {"script", "style"}
+
+# Upload extensions and Content-Types by extraction kind.
+FILE_TYPES = {
+    ".html": "html", ".htm": "html",
+    ".txt": "text",
+    ".md": "markdown", ".markdown": "markdown",
+    ".pdf": "pdf",
+}
+CONTENT_TYPES = {
+    "text/plain": "text",
+    "text/markdown": "markdown",
+    "application/pdf": "pdf",
+}
+
+_meta_charset = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+def kind_for_filename(filename: str) -> Optional[str]:
+    return FILE_TYPES.get(os.path.splitext(filename)[1].lower())
+
+
+def kind_for_content_type(content_type: str) -> str:
+    # Anything that is not known to be something else is parsed as HTML, as before.
+    return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower(), "html")
+
+
+def charset_of(content_type: str) -> Optional[str]:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset" and value.strip():
+            return value.strip().strip('"')
+    return None
+
+
+def decode(blocks: Iterable[bytes], encoding: Optional[str] = None, sniff: bool = False) -> Iterator[str]:
+    # Multi-byte characters may be split across blocks, hence the incremental decoder.
+    # With sniff, a <meta charset> in the first block wins over the default.
+    decoder = None
+    for block in blocks:
+        if decoder is None:
+            match = _meta_charset.search(block[:1024]) if sniff and not encoding else None
+            decoder = _decoder(encoding or (match and match.group(1).decode("ascii")))
+        text = decoder.decode(block)
+        if text:
+            yield text
+    if decoder is not None:
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+
+def _decoder(encoding: Optional[str]):
+    try:
+        return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+def split_lines(text: str) -> tuple[List[str], str]:
+    # Complete lines and the unterminated rest, with the line breaks of str.splitlines.
+    lines = (text + ".").splitlines()
+    return lines[:-1], lines[-1][:-1]
+
+
+def cut_line(line: str) -> Iterator[str]:
+    # Cuts depend only on the text, not on how it arrived, so re-ingesting
+    # the same page gives the same chunks.
+    while len(line) > MAX_LINE:
+        cut = line.rfind("  ", 0, MAX_LINE)
+        cut = cut if cut > 0 else MAX_LINE
+        yield line[:cut]
+        line = line[cut:]
+    yield line
+
+
+def clean_line(line: str) -> Iterator[str]:
+    # Strip, break on double spaces, drop empty phrases.
+    for part in cut_line(line):
+        for phrase in part.split("  "):
+            phrase = phrase.strip()
+            if phrase:
+                yield phrase
+
+
+class HTMLTextExtractor(HTMLParser):
+    """Visible text of an HTML document fed in pieces, as cleaned phrases.
+
+    Same output as BeautifulSoup's get_text() minus <script> and <style>,
+    split into lines and on double spaces. Only the current line is buffered.
+    """
+
+    def __init__(self, links: Optional[list] = None):
+        super().__init__(convert_charrefs=True)
+        self.links = links  # receives every <a href> when given
+        self.skip = 0
+        self.line = ""
+        self.phrases: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip += 1
+        elif tag == "a" and self.links is not None:
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        lines, self.line = split_lines(self.line + data)
+        for line in lines:
+            self.phrases.extend(clean_line(line))
+        if len(self.line) > MAX_LINE:
+            *parts, self.line = cut_line(self.line)
+            for part in parts:
+                self.phrases.extend(clean_line(part))
+
+    def flush(self) -> List[str]:
+        phrases, self.phrases = self.phrases, []
+        return phrases
+
+    def close(self):
+        super().close()
+        self.phrases.extend(clean_line(self.line))
+        self.line = ""
+
+
+def _joined(phrases: Iterable[str]) -> Iterator[str]:
+    first = True
+    for phrase in phrases:
+        yield phrase if first else "\n" + phrase
+        first = False
+
+
+def html_text(blocks: Iterable[bytes], encoding: Optional[str] = None, links: Optional[list] = None) -> Iterator[str]:
+    def phrases():
+        parser = HTMLTextExtractor(links)
+        for text in decode(blocks, encoding, sniff=True):
+            parser.feed(text)
+            yield from parser.flush()
+        parser.close()
+        yield from parser.flush()
+
+    return _joined(phrases())
+
+
+def pdf_text(path: str) -> Iterator[str]:
+    # pypdf parses a page when it is accessed, so pages are extracted one at a time.
+    from pypdf import PdfReader
+
+    def phrases():
+        for page in PdfReader(path).pages:
+            for line in (page.extract_text() or "").splitlines():
+                yield from clean_line(line)
+
+    return _joined(phrases())
+
+
+def read_blocks(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while block := f.read(READ_SIZE):
+            yield block
+
+
+def text_from(blocks: Iterable[bytes], kind: str, encoding: Optional[str] = None, links: Optional[list] = None) -> Iterator[str]:
+    if kind == "html":
+        return html_text(blocks, encoding, links)
+    if kind in ("text", "markdown"):
+        # Kept as is: blank lines and indentation are what the splitter splits on.
+        return decode(blocks, encoding)
+    raise ValueError(f"Unknown document kind '{kind}'")
+
+
+def file_text(path: str, kind: str, encoding: Optional[str] = None, links: Optional[list] = None) -> Iterator[str]:
+    # A PDF is read from the end (cross-reference table), so it is parsed from
+    # the spooled file; everything else is streamed through text_from.
+    return pdf_text(path) if kind == "pdf" else text_from(read_blocks(path), kind, encoding, links)
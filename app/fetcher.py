@@ -0,0 +1,105 @@
+import asyncio
+import os
+import random
+from collections import defaultdict
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Union
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+from app.extract import READ_SIZE
+from app.metrics import INGEST_STAGE_SECONDS, span
+from app.settings import settings
+
+USER_AGENT = "PulseBot/1.0 (+https://github.com/Jurasz-Jan/pulse-engine)"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Shared keep-alive session for single-URL tasks.
+http = requests.Session()
+http.headers["User-Agent"] = USER_AGENT
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def backoff_delay(attempt: int) -> float:
+    # Exponential backoff with jitter: base, 2*base, 4*base, ...
+    return min(settings.FETCH_BACKOFF * (2 ** attempt) * (0.5 + random.random() / 2), settings.FETCH_MAX_BACKOFF)
+
+
+def retry_delay(retry_after: str, attempt: int) -> float:
+    # A server's Retry-After is honoured up to FETCH_MAX_BACKOFF, so it cannot park a worker for hours.
+    if retry_after.isdigit():
+        return min(float(retry_after), settings.FETCH_MAX_BACKOFF)
+    return backoff_delay(attempt)
+
+
+@dataclass
+class Fetched:
+    # A batch response. Its body was streamed to path, except for a 304.
+    status_code: int
+    headers: httpx.Headers
+    path: Optional[str] = None
+
+
+async def _fetch_one(
+    client: httpx.AsyncClient, host_limit: asyncio.Semaphore, url: str, headers: dict, spool: Callable[[], str],
+) -> Fetched:
+    for attempt in range(settings.FETCH_RETRIES + 1):
+        path = None
+        try:
+            async with host_limit:
+                with span(INGEST_STAGE_SECONDS, "fetch"):
+                    async with client.stream("GET", url, headers=headers) as response:
+                        retry = response.status_code in RETRY_STATUSES and attempt < settings.FETCH_RETRIES
+                        if not retry:
+                            if response.status_code != 304:
+                                response.raise_for_status()
+                                # Block by block, so a batch holds no bodies in memory.
+                                path = spool()
+                                with open(path, "wb") as f:
+                                    async for block in response.aiter_bytes(READ_SIZE):
+                                        f.write(block)
+                            return Fetched(response.status_code, response.headers, path)
+            await asyncio.sleep(retry_delay(response.headers.get("Retry-After", ""), attempt))
+        except BaseException as e:
+            if path is not None:
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+            if not isinstance(e, httpx.TransportError) or attempt == settings.FETCH_RETRIES:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+async def fetch_all(
+    urls: Iterable[str],
+    spool: Callable[[], str],
+    headers: Optional[Dict[str, dict]] = None,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> Dict[str, Union[Fetched, Exception]]:
+    # One pooled client for the whole batch; the global connection limit caps
+    # total concurrency and a semaphore per host keeps us polite to each site.
+    # Each body is written to a new path from spool, which the caller owns.
+    limits = httpx.Limits(
+        max_connections=settings.FETCH_CONCURRENCY,
+        max_keepalive_connections=settings.FETCH_CONCURRENCY,
+    )
+    host_limits = defaultdict(lambda: asyncio.Semaphore(settings.FETCH_PER_HOST))
+    urls = list(dict.fromkeys(urls))
+
+    async with httpx.AsyncClient(
+        limits=limits,
+        timeout=settings.FETCH_TIMEOUT,
+        follow_redirects=True,
+        headers={"User-Agent": USER_AGENT},
+        transport=transport,
+    ) as client:
+        results = await asyncio.gather(
+            *(_fetch_one(client, host_limits[host_of(url)], url, (headers or {}).get(url, {}), spool) for url in urls),
+            return_exceptions=True,
+        )
+    return dict(zip(urls, results))
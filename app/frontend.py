@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import json
+import threading
 import time
 
 # Configuration
@@ -8,52 +9,91 @@ API_URL = "http://web:8000"
 
 st.set_page_config(page_title="Pulse - AI Knowledge Engine", layout="wide")
 
+def follow_jobs(jobs: dict):
+    # Applies /jobs/stream events to `jobs` (id -> job). Reconnecting after
+    # any error also resyncs, the stream starts with a snapshot.
+    while True:
+        try:
+            with requests.get(f"{API_URL}/jobs/stream", stream=True, timeout=(5, 60)) as res:
+                res.raise_for_status()
+                event = None
+                for line in res.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[len("data: "):])
+                        if event == "jobs":
+                            jobs.clear()
+                            jobs.update({job["id"]: job for job in data})
+                        elif event == "job" and data.get("parent_id") is None:
+                            jobs[data["id"]] = {**jobs.get(data["id"], {}), **data}
+                        elif event == "progress" and data["id"] in jobs:
+                            jobs[data["id"]]["progress"] = data
+        except Exception as e:
+            print(f"Job stream interrupted: {e}")
+        time.sleep(2)
+
+@st.cache_resource
+def job_feed() -> dict:
+    # One subscription per Streamlit server, shared by every browser session.
+    jobs = {}
+    threading.Thread(target=follow_jobs, args=(jobs,), daemon=True).start()
+    return jobs
+
+def progress_text(progress: dict) -> str:
+    if progress["stage"] == "fetched":
+        return f"Fetched ({progress.get('content_type') or 'unknown type'})"
+    if progress["stage"] == "chunked":
+        return f"Split {progress['chunks']} chunks"
+    if progress["stage"] == "embedded":
+        return f"Embedded {progress['embedded']} new of {progress['chunks']} chunks"
+    return f"Written: {progress['added']} new, {progress['unchanged']} unchanged, {progress['removed']} removed"
+
+@st.fragment(run_every=1)
+def job_history():
+    # Re-renders from the shared feed, no request to the API.
+    jobs = sorted(list(job_feed().values()), key=lambda job: job["created_at"], reverse=True)[:50]
+    if not jobs:
+        st.info("No jobs found")
+    for job in jobs:
+        status_color = "🟢" if job['status'] == "COMPLETED" else "🔴" if job['status'] == "FAILED" else "md"
+        if job['status'] == "PENDING": status_color = "⚪"
+        if job['status'] == "PROCESSING": status_color = "aaa"
+
+        with st.expander(f"{status_color} {job['url'][:30]}...", expanded=False):
+            st.write(f"**Status:** {job['status']}")
+            if job['status'] == "PROCESSING" and job.get('progress'):
+                st.write(progress_text(job['progress']))
+            st.write(f"**Created:** {job['created_at']}")
+            if job['finished_at']:
+                st.write(f"**Finished:** {job['finished_at']}")
+            if job['result']:
+                st.caption(f"Result: {job['result']}")
+
 st.title("Pulse 🧠")
 st.caption("Local Document-based Knowledge Engine")
 
 # Sidebar - Ingestion
 with st.sidebar:
     st.header("Job History")
-    if st.button("Refresh Jobs"):
-        st.session_state.last_refresh = time.time()
-        
-    try:
-        jobs_res = requests.get(f"{API_URL}/jobs")
-        if jobs_res.status_code == 200:
-            jobs = jobs_res.json()
-            if jobs:
-                # Simple display
-                for job in jobs:
-                    status_color = "🟢" if job['status'] == "COMPLETED" else "🔴" if job['status'] == "FAILED" else "md"
-                    if job['status'] == "PENDING": status_color = "⚪"
-                    if job['status'] == "PROCESSING": status_color = "aaa"
-                    
-                    with st.expander(f"{status_color} {job['url'][:30]}...", expanded=False):
-                        st.write(f"**Status:** {job['status']}")
-                        st.write(f"**Created:** {job['created_at']}")
-                        if job['finished_at']:
-                            st.write(f"**Finished:** {job['finished_at']}")
-                        if job['result']:
-                            st.caption(f"Result: {job['result']}")
-            else:
-                st.info("No jobs found")
-        else:
-            st.error("Could not fetch jobs")
-    except Exception as e:
-         st.warning(f"Worker unavailable? {e}")
+    # Updated live from /jobs/stream instead of polling /jobs.
+    job_history()
     st.divider()
 
+    # Ingestion goes to this collection and chat searches only it.
+    collection = st.text_input("Collection", value="default", help="Lowercase letters, digits and underscores")
+
     url_input = st.text_input("Ingest URL", placeholder="https://example.com")
     
     if st.button("Scrape & Embed"):
         if url_input:
             with st.spinner("Dispatching scraper..."):
                 try:
-                    res = requests.post(f"{API_URL}/scrape", json={"url": url_input})
+                    res = requests.post(f"{API_URL}/scrape", json={"url": url_input, "collection": collection})
                     if res.status_code == 200:
                         data = res.json()
                         st.success(f"Task Started! ID: {data['task_id']}")
-                        st.info("Ingestion runs in the background. Please wait a moment and click 'Refresh Sources' below to see the new document.")
+                        st.info("Ingestion runs in the background and its progress shows up under Job History. Click 'Refresh Sources' below once it completes.")
                         
                         # Invalidate cache so the user sees the new source (eventually)
                         if "sources" in st.session_state:
@@ -63,6 +103,22 @@ with st.sidebar:
                 except Exception as e:
                     st.error(f"Connection Error: {e}")
 
+    uploaded = st.file_uploader("Ingest file", type=["html", "htm", "txt", "md", "markdown", "pdf"])
+
+    if st.button("Upload & Embed"):
+        if uploaded:
+            with st.spinner("Uploading..."):
+                try:
+                    res = requests.post(f"{API_URL}/upload", files={"file": (uploaded.name, uploaded.getvalue())}, params={"collection": collection})
+                    if res.status_code == 200:
+                        st.success(f"Task Started! ID: {res.json()['task_id']}")
+                        if "sources" in st.session_state:
+                            del st.session_state["sources"]
+                    else:
+                        st.error(f"Error: {res.status_code} {res.json().get('detail', '')}")
+                except Exception as e:
+                    st.error(f"Connection Error: {e}")
+
     st.divider()
     st.header("Manage Documents")
     
@@ -90,12 +146,13 @@ with st.sidebar:
     if "sources" in st.session_state and st.session_state.sources:
         for src in st.session_state.sources:
             col1, col2 = st.columns([3, 1])
-            col1.write(src)
-            if col2.button("Delete", key=src):
+            col1.write(src["url"])
+            col1.caption(f"{src['collection']} · {src['status']} · {src['chunk_count']} chunks · {src['bytes'] / 1024:.0f} KB")
+            if col2.button("Delete", key=f"{src['collection']}:{src['url']}"):
                 try:
-                    res = requests.delete(f"{API_URL}/sources", params={"source": src})
+                    res = requests.delete(f"{API_URL}/sources", params={"source": src["url"], "collection": src["collection"]})
                     if res.status_code == 200:
-                        st.success(f"Deleted {src}")
+                        st.success(f"Deleted {src['url']}")
                         # Remove from local state
                         st.session_state.sources.remove(src)
                         st.rerun()
@@ -130,20 +187,41 @@ if prompt := st.chat_input("Ask a question..."):
 
     # Bot response
     with st.chat_message("assistant"):
+        trace_placeholder = st.empty()
         message_placeholder = st.empty()
         full_response = ""
-        
-        with st.spinner("Thinking (this may take a moment)..."):
-            try:
-                res = requests.post(f"{API_URL}/chat", json={"query": prompt})
+        trace = []
+        sources = []
+
+        try:
+            with requests.post(f"{API_URL}/chat/stream", json={"query": prompt, "collections": [collection], "priority": "high"}, stream=True, timeout=300) as res:
                 if res.status_code == 200:
-                    data = res.json()
-                    full_response = data["answer"]
-                    trace = data.get("trace", [])
-                    sources = data.get("sources", [])
-                    
+                    event = None
+                    for line in res.iter_lines(decode_unicode=True):
+                        if line.startswith("event:"):
+                            event = line[len("event:"):].strip()
+                            continue
+                        if not line.startswith("data:"):
+                            continue
+                        data = json.loads(line[len("data:"):].strip())
+
+                        if event == "trace":
+                            trace.append(data)
+                            trace_placeholder.caption(" → ".join(trace))
+                        elif event == "token":
+                            full_response += data
+                            message_placeholder.markdown(full_response + "▌")
+                        elif event == "reset":
+                            full_response = ""
+                            message_placeholder.markdown("_Improving the answer..._")
+                        elif event == "done":
+                            full_response = data["answer"]
+                            trace = data.get("trace", [])
+                            sources = data.get("sources", [])
+
+                    trace_placeholder.empty()
                     message_placeholder.markdown(full_response)
-                    
+
                     if trace:
                         with st.expander("Thought Process"):
                             for step in trace:
@@ -152,14 +230,16 @@ if prompt := st.chat_input("Ask a question..."):
                         with st.expander("Sources"):
                              for src in sources:
                                 st.caption(src)
-                                
+
                     st.session_state.messages.append({
-                        "role": "assistant", 
+                        "role": "assistant",
                         "content": full_response,
                         "trace": trace,
                         "sources": sources
                     })
+                elif res.status_code in (429, 503):
+                    st.warning(f"The server is busy, try again in {res.headers.get('Retry-After', 'a few')} seconds.")
                 else:
                     st.error(f"API Error: {res.status_code}")
-            except Exception as e:
-                st.error(f"Connection Error: {e}")
+        except Exception as e:
+            st.error(f"Connection Error: {e}")
@@ -0,0 +1,78 @@
+import asyncio
+import math
+import re
+from concurrent.futures import Executor
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from app.models import Document
+from app.providers import get_cross_encoder
+
+Embed = Callable[[str], Awaitable[Sequence[float]]]
+
+
+def cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class LLMGrader:
+    """Asks the LLM for a 0..1 relevance score. One extra generation per request."""
+
+    threshold = 0.7
+
+    def __init__(self, complete: Callable[[str], Awaitable[str]]):
+        self.complete = complete
+
+    async def grade(self, query: str, docs: List[Document], answer: str) -> float:
+        context = "\n".join([d.content for d in docs])
+        prompt = f"""Rate the relevance of the answer to the query based on the context.
+    Return ONLY a number between 0.0 and 1.0.
+
+    Query: {query}
+    Answer: {answer}
+    Context: {context}
+    """
+        try:
+            score_str = (await self.complete(prompt)).strip()
+            # Clean up any extra text if LLM ignores instructions
+            match = re.search(r"0\.\d+|1\.0|0", score_str)
+            return float(match.group(0)) if match else 0.5
+        except Exception:
+            return 0.5
+
+
+class EmbeddingGrader:
+    """Scores with the bi-encoder: how close the answer is to the query and to
+    the best supporting chunk. Costs one embedding, the chunk vectors are
+    already loaded with the documents."""
+
+    threshold = 0.5
+
+    def __init__(self, embed_query: Embed, embed_text: Embed):
+        self.embed_query = embed_query
+        self.embed_text = embed_text
+
+    async def grade(self, query: str, docs: List[Document], answer: str) -> float:
+        query_vector, answer_vector = await asyncio.gather(self.embed_query(query), self.embed_text(answer))
+        relevance = cosine(query_vector, answer_vector)
+        grounding = max((cosine(answer_vector, doc.embedding) for doc in docs), default=0.0)
+        return round(max(0.0, (relevance + grounding) / 2), 3)
+
+
+class CrossEncoderGrader:
+    """Scores the (query, answer) pair with a local cross-encoder."""
+
+    threshold = 0.5
+
+    def __init__(self, model_name: str, executor: Optional[Executor] = None):
+        self.model_name = model_name
+        self.executor = executor
+
+    def _predict(self, pairs):
+        return get_cross_encoder(self.model_name).predict(pairs)
+
+    async def grade(self, query: str, docs: List[Document], answer: str) -> float:
+        loop = asyncio.get_running_loop()
+        logits = await loop.run_in_executor(self.executor, self._predict, [(query, answer)])
+        return round(1 / (1 + math.exp(-float(logits[0]))), 3)
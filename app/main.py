@@ -1,34 +1,117 @@
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends
+import asyncio
+import json
+import os
+import re
+import uuid
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select
+from sqlalchemy import insert
+from sqlmodel import select, func
 
 from datetime import datetime
-from app.database import init_db, get_session
-from app.models import Greeting, Document, Job
-from app.schemas import ScrapeRequest, TaskResponse, ChatRequest, ChatResponse, JobResponse
-from app.worker import scrape_url, celery_app
-from app.rag import rag_flow
+from app.database import init_db, get_session, async_session
+from app.models import DEFAULT_COLLECTION, Greeting, Job, Source
+from app.schemas import ScrapeRequest, TaskResponse, ChatRequest, ChatResponse, JobResponse, BatchScrapeRequest, BatchResponse, CrawlRequest, SourceResponse, CollectionRequest, CollectionResponse
+from app.settings import settings
+from app.celery_app import celery_app
+from app import crawler, events, extract, partitions, providers
+from app.rag import answer_scope, rag_flow_stream, embed_batcher, reranker
+from app.cache import answer_cache, embedding_cache, normalize
+from app.admission import Rejected, chat_admission, chat_flights
+from app import metrics
+from app.events import job_events, source_events
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    if settings.WARMUP_MODELS:
+        # Loads in the background so the process serves requests right away;
+        # /ready reports when it is done.
+        app.state.warmup = asyncio.create_task(run_in_threadpool(providers.warm_up))
+    if settings.ANSWER_CACHE:
+        # Drops cached answers whose sources change, in any process.
+        follower = asyncio.create_task(answer_cache.follow(source_events))
     yield
+    if settings.ANSWER_CACHE:
+        follower.cancel()
 
 app = FastAPI(lifespan=lifespan)
 
+metrics.register_stats("pulse_job_events", job_events.stats, counters=("dropped",))
+metrics.register_stats("pulse_chat_admission", chat_admission.stats, counters=("admitted", "rejected", "timed_out"))
+metrics.register_stats("pulse_chat_flights", chat_flights.stats, counters=("started", "joined"))
+
+def recent_jobs():
+    return select(Job).where(Job.parent_id.is_(None)).order_by(Job.created_at.desc()).limit(50)
+
 @app.get("/jobs", response_model=list[JobResponse])
 async def list_jobs(session: AsyncSession = Depends(get_session)):
-    stmt = select(Job).order_by(Job.created_at.desc()).limit(50)
-    result = await session.execute(stmt)
+    result = await session.execute(recent_jobs())
     return result.scalars().all()
 
+@app.get("/jobs/stream")
+async def jobs_stream():
+    # A "jobs" snapshot of recent_jobs(), then every status change ("job")
+    # and ingestion step ("progress") as the workers publish them.
+    async def feed():
+        async with job_events.subscribe() as queue:
+            # Subscribed before the snapshot is read, so no change falls in between.
+            async with async_session() as session:
+                result = await session.execute(recent_jobs())
+                snapshot = [JobResponse.model_validate(job, from_attributes=True).model_dump(mode="json") for job in result.scalars()]
+            yield f"event: jobs\ndata: {json.dumps(snapshot)}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), settings.JOB_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Also how a closed connection is noticed.
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    # Fell behind; the client reconnects and gets a new snapshot.
+                    return
+                yield f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+    return StreamingResponse(
+        feed(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, session: AsyncSession = Depends(get_session)):
+    job = await session.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    response = JobResponse.model_validate(job, from_attributes=True)
+    if job.kind == "batch":
+        stmt = select(Job.status, func.count()).where(Job.parent_id == job_id).group_by(Job.status)
+        result = await session.execute(stmt)
+        response.progress = dict(result.all())
+    elif job.kind == "crawl":
+        response.progress = await run_in_threadpool(crawler.progress, job_id)
+    return response
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
+@app.get("/ready")
+async def ready():
+    # 503 until the models /chat needs are loaded.
+    status = providers.readiness()
+    warmup = getattr(app.state, "warmup", None)
+    if warmup is not None and warmup.done() and not warmup.cancelled() and warmup.exception():
+        status["error"] = str(warmup.exception())
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.post("/scrape", response_model=TaskResponse)
 async def scrape(request: ScrapeRequest, session: AsyncSession = Depends(get_session)):
+    await partitions.ensure_collection(session, request.collection)
     # Create Job record
     job = Job(
         id=None, # will be set by celery id? No, we should probably set a UUID or let DB handle it. 
@@ -36,25 +119,223 @@ async def scrape(request: ScrapeRequest, session: AsyncSession = Depends(get_ses
                  # Let's generate a task first then save it.
         url=request.url,
         status="PENDING",
-        created_at=datetime.utcnow().isoformat()
+        created_at=datetime.utcnow()
     )
     # Ideally we'd commit to get an ID if auto-inc, but here we can just use the task ID if we want consistency.
     # But Job.id is string (from my model edit).
     
-    task = scrape_url.delay(request.url)
+    task = celery_app.send_task("app.worker.scrape_url", args=[request.url, request.collection])
     
     # Use task.id as job.id
     job.id = task.id
     session.add(job)
     await session.commit()
+    await events.apublish("job", events.job_event(job))
     
     return {"task_id": task.id, "status": "Processing"}
 
+@app.post("/scrape/batch", response_model=BatchResponse)
+async def scrape_batch_urls(request: BatchScrapeRequest, session: AsyncSession = Depends(get_session)):
+    await partitions.ensure_collection(session, request.collection)
+    # One job per URL: a repeated URL would be fetched once for two jobs.
+    urls = list(dict.fromkeys(request.urls))
+    now = datetime.utcnow()
+    batch_id = str(uuid.uuid4())
+    batch = Job(
+        id=batch_id,
+        url=f"batch of {len(urls)} URLs",
+        kind="batch",
+        status="PENDING",
+        created_at=now,
+    )
+    session.add(batch)
+    children = [
+        {"id": str(uuid.uuid4()), "url": url, "kind": "scrape", "parent_id": batch_id, "status": "PENDING", "created_at": now}
+        for url in urls
+    ]
+    await session.execute(insert(Job), children)
+    await session.commit()
+    await events.apublish("job", events.job_event(batch))
+
+    # Each task fetches its slice concurrently, so slices spread the batch
+    # across workers while keeping per-task connection pools busy.
+    size = settings.BATCH_TASK_SIZE
+    tasks = 0
+    for start in range(0, len(children), size):
+        celery_app.send_task(
+            "app.worker.scrape_batch",
+            args=[batch_id, [(child["id"], child["url"]) for child in children[start:start + size]], request.collection],
+        )
+        tasks += 1
+
+    return {"batch_id": batch_id, "jobs": len(children), "tasks": tasks}
+
+@app.post("/crawl", response_model=TaskResponse)
+async def crawl(request: CrawlRequest, session: AsyncSession = Depends(get_session)):
+    await partitions.ensure_collection(session, request.collection)
+    crawl_id = str(uuid.uuid4())
+    job = Job(
+        id=crawl_id,
+        url=request.url,
+        kind="crawl",
+        status="PENDING",
+        created_at=datetime.utcnow(),
+    )
+    session.add(job)
+    await session.commit()
+    await events.apublish("job", events.job_event(job))
+
+    celery_app.send_task("app.worker.start_crawl", args=[
+        crawl_id,
+        request.url,
+        settings.CRAWL_MAX_DEPTH if request.max_depth is None else request.max_depth,
+        request.max_pages or settings.CRAWL_MAX_PAGES,
+        request.sitemap,
+        request.collection,
+    ])
+    return {"task_id": crawl_id, "status": "Processing"}
+
+@app.post("/upload", response_model=TaskResponse)
+async def upload(
+    file: UploadFile,
+    collection: str = Query(DEFAULT_COLLECTION, pattern=partitions.NAME_PATTERN),
+    session: AsyncSession = Depends(get_session),
+):
+    filename = os.path.basename(file.filename or "")
+    kind = extract.kind_for_filename(filename)
+    if kind is None:
+        raise HTTPException(status_code=415, detail=f"Unsupported file type, expected one of {sorted(extract.FILE_TYPES)}")
+    await partitions.ensure_collection(session, collection)
+
+    # Copied block by block to the directory shared with the worker, which
+    # reads it the same way; the file is never held in memory.
+    job_id = str(uuid.uuid4())
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(settings.UPLOAD_DIR, job_id + os.path.splitext(filename)[1].lower())
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while block := await file.read(extract.READ_SIZE):
+                size += len(block)
+                if settings.UPLOAD_MAX_BYTES and size > settings.UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File is larger than {settings.UPLOAD_MAX_BYTES} bytes")
+                await run_in_threadpool(f.write, block)
+    except BaseException:
+        # open() itself may have failed; its error is the one to report.
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+
+    url = f"upload://{filename}"
+    job = Job(id=job_id, url=url, kind="upload", status="PENDING", created_at=datetime.utcnow())
+    session.add(job)
+    await session.commit()
+    await events.apublish("job", events.job_event(job))
+    celery_app.send_task("app.worker.ingest_file", args=[job_id, path, url, kind, collection])
+    return {"task_id": job_id, "status": "Processing"}
+
+def chat_key(request: ChatRequest) -> str | None:
+    # Requests that run the same pipeline; include_timings and priority only
+    # change what is sent back and which lane is waited in.
+    if not settings.CHAT_COALESCE:
+        return None
+    return json.dumps([normalize(request.query), answer_scope(request), request.cache])
+
+async def start_chat(request: ChatRequest):
+    # Joins an identical request in flight or starts a run, which waits for an
+    # admission slot in the request's lane. The run may outlive the request
+    # that started it, so it owns its own session.
+    async def run(flight):
+        async with chat_admission.slot(request.priority):
+            flight.admit()
+            async with async_session() as session:
+                async for event in rag_flow_stream(session, request.query, request, request.cache):
+                    flight.publish(event)
+
+    flight = chat_flights.join(chat_key(request), run)
+    try:
+        # Shielded: a client going away must not cancel the admission other callers wait on.
+        await asyncio.shield(flight.admitted)
+    except Rejected as e:
+        flight.leave()
+        raise rejection(e)
+    except asyncio.CancelledError:
+        flight.leave()
+        if flight.admitted.cancelled() and not asyncio.current_task().cancelling():
+            # The run itself was cancelled (e.g. on shutdown) before it was admitted.
+            wait = chat_admission.estimate_wait(chat_admission.queued(request.priority))
+            raise rejection(Rejected(503, "The chat request was cancelled before it was admitted", wait))
+        raise
+    except BaseException:
+        flight.leave()
+        raise
+    return flight
+
+def rejection(e: Rejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+def chat_response(data: dict, include_timings: bool) -> dict:
+    # The done event is shared by every caller of a flight, so it is copied.
+    return data if include_timings else {key: value for key, value in data.items() if key != "timings"}
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, session: AsyncSession = Depends(get_session)):
-    result = await rag_flow(session, request.query)
+async def chat(request: ChatRequest):
+    flight = await start_chat(request)
+    result = None
+    async for event in flight.follow():
+        if event["event"] == "done":
+            result = chat_response(event["data"], request.include_timings)
+    if result is None:
+        # The run was cancelled (e.g. the server is shutting down) before it answered.
+        raise HTTPException(status_code=503, detail="The chat pipeline stopped without an answer")
     return result
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    # Admission is decided before the response starts, so a rejected request
+    # still gets its 429/503 status.
+    flight = await start_chat(request)
+    started = False
+
+    async def events():
+        nonlocal started
+        started = True  # from here on follow() leaves the flight
+        async for event in flight.follow():
+            data = event["data"]
+            if event["event"] == "done":
+                data = chat_response(data, request.include_timings)
+            yield f"event: {event['event']}\ndata: {json.dumps(data)}\n\n"
+
+    async def release():
+        # A client that disconnects before the first chunk never starts the
+        # generator; its place in the flight (and the admission slot) is given up here.
+        if not started:
+            flight.leave()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
+
+@app.get("/chat/stats")
+async def chat_stats():
+    return {"admission": chat_admission.stats(), "coalescing": chat_flights.stats()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"embeddings": embedding_cache.stats(), "rerank_scores": reranker.stats(), "answers": answer_cache.stats()}
+
+@app.get("/batcher/stats")
+async def batcher_stats():
+    return {"embeddings": embed_batcher.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/greetings")
 async def create_greeting(message: str, session: AsyncSession = Depends(get_session)):
     greeting = Greeting(message=message)
@@ -69,16 +350,47 @@ async def get_greetings(session: AsyncSession = Depends(get_session)):
     greetings = result.scalars().all()
     return greetings
 
-@app.get("/sources")
-async def list_sources(session: AsyncSession = Depends(get_session)):
-    stmt = select(Document.source).distinct()
+async def publish_source_change(event: dict):
+    # Applied here right away, and by the other API processes through Redis.
+    answer_cache.invalidate(event)
+    await events.apublish("source", event, events.SOURCES_CHANNEL)
+
+@app.get("/sources", response_model=list[SourceResponse])
+async def list_sources(collection: str | None = None, session: AsyncSession = Depends(get_session)):
+    # All collections unless one is given.
+    stmt = select(Source).order_by(Source.collection, Source.url)
+    if collection is not None:
+        stmt = stmt.where(Source.collection == collection)
     result = await session.execute(stmt)
     return result.scalars().all()
 
 @app.delete("/sources")
-async def delete_source(source: str, session: AsyncSession = Depends(get_session)):
+async def delete_source(source: str, collection: str = DEFAULT_COLLECTION, session: AsyncSession = Depends(get_session)):
     from sqlalchemy import delete
-    stmt = delete(Document).where(Document.source == source)
-    await session.execute(stmt)
+    # Chunks go with the source row via the indexed ON DELETE CASCADE foreign
+    # key, and so do the HTTP validators, so a re-scrape starts from scratch.
+    deleted = await session.execute(
+        delete(Source).where(Source.collection == collection, Source.url == source).returning(Source.id)
+    )
     await session.commit()
+    for source_id in deleted.scalars():
+        await publish_source_change(events.source_event(source_id, collection, deleted=True))
     return {"message": f"Deleted all documents from {source}"}
+
+@app.get("/collections", response_model=list[CollectionResponse])
+async def list_collections(session: AsyncSession = Depends(get_session)):
+    return await partitions.list_collections(session)
+
+@app.post("/collections", response_model=CollectionResponse)
+async def create_collection(request: CollectionRequest, session: AsyncSession = Depends(get_session)):
+    await partitions.ensure_collection(session, request.name)
+    collections = await partitions.list_collections(session)
+    return next(c for c in collections if c["name"] == request.name)
+
+@app.delete("/collections/{name}")
+async def delete_collection(name: str, session: AsyncSession = Depends(get_session)):
+    # Drops the collection's partition: instant, whatever its size.
+    if not re.fullmatch(partitions.NAME_PATTERN, name) or not await partitions.drop_collection(session, name):
+        raise HTTPException(status_code=404, detail="Collection not found")
+    await publish_source_change(events.source_event(None, name, deleted=True))
+    return {"message": f"Deleted collection {name}"}
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import numpy as np
+from sqlalchemy import select, text
+
+from app.database import engine, init_db
+from app.models import Document, EMBEDDING_DIM
+from app.settings import settings
+from app import providers, vector_index
+
+
+async def migrate(args):
+    await init_db()
+    async with engine.connect() as conn:
+        print(await vector_index.current_index_def(conn) or "No vector index (VECTOR_INDEX=none)")
+
+
+async def reindex(args):
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        print(f"Rebuilding {vector_index.INDEX_NAME} ({settings.VECTOR_INDEX}, {settings.VECTOR_METRIC}, {settings.VECTOR_STORAGE})...")
+        start = time.perf_counter()
+        await vector_index.rebuild_index(conn)
+        print(f"Done in {time.perf_counter() - start:.1f}s")
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE document"))
+
+
+async def top_k_ids(conn, vector, k, exact=False, ef_search=None, probes=None):
+    async with conn.begin():
+        if exact:
+            await conn.execute(text("SET LOCAL enable_indexscan = off"))
+            await conn.execute(text("SET LOCAL enable_bitmapscan = off"))
+            stmt = select(Document.id).order_by(vector_index.distance(Document.embedding, vector)).limit(k)
+        else:
+            await vector_index.apply_search_params(conn, ef_search=ef_search, probes=probes, limit=k)
+            stmt = vector_index.nearest(vector, k, Document.id)
+        start = time.perf_counter()
+        result = await conn.execute(stmt)
+        ids = result.scalars().all()
+        return ids, (time.perf_counter() - start) * 1000
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def recall_report(args):
+    if settings.VECTOR_INDEX == "none":
+        raise SystemExit("VECTOR_INDEX=none, nothing to compare against exact search")
+    if settings.VECTOR_INDEX == "hnsw":
+        knob, values = "ef_search", [int(v) for v in args.ef_search.split(",")]
+    else:
+        knob, values = "probes", [int(v) for v in args.probes.split(",")]
+
+    async with engine.connect() as conn:
+        # Sampled document embeddings stand in for real query vectors.
+        result = await conn.execute(
+            select(Document.embedding).order_by(text("random()")).limit(args.queries)
+        )
+        queries = result.scalars().all()
+        await conn.commit()
+        if not queries:
+            raise SystemExit("The document table is empty")
+
+        exact, exact_ms = [], []
+        for vector in queries:
+            ids, ms = await top_k_ids(conn, vector, args.k, exact=True)
+            exact.append(set(ids))
+            exact_ms.append(ms)
+
+        rows = [{
+            knob: "exact",
+            "recall": 1.0,
+            "p50_ms": round(statistics.median(exact_ms), 2),
+            "p95_ms": round(percentile(exact_ms, 95), 2),
+        }]
+        for value in values:
+            recalls, latencies = [], []
+            for vector, truth in zip(queries, exact):
+                ids, ms = await top_k_ids(conn, vector, args.k, **{knob: value})
+                recalls.append(len(truth & set(ids)) / len(truth))
+                latencies.append(ms)
+            rows.append({
+                knob: value,
+                "recall": round(statistics.mean(recalls), 4),
+                "p50_ms": round(statistics.median(latencies), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+            })
+
+    print(f"Recall@{args.k} over {len(queries)} queries ({settings.VECTOR_INDEX}, {settings.VECTOR_METRIC}, {settings.VECTOR_STORAGE})")
+    print(f"{knob:>10} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        print(f"{row[knob]:>10} {row['recall']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "index": settings.VECTOR_INDEX,
+                "metric": settings.VECTOR_METRIC,
+                "storage": settings.VECTOR_STORAGE,
+                "k": args.k,
+                "rows": rows,
+            }, f, indent=2)
+
+
+async def storage_report(args):
+    # document is partitioned by collection, its sizes are the sums over the partitions.
+    async with engine.connect() as conn:
+        result = await conn.execute(text("""
+            SELECT count(*) AS rows,
+                   (SELECT sum(pg_table_size(relid)) FROM pg_partition_tree('document')) AS table_bytes,
+                   (SELECT sum(pg_relation_size(relid)) FROM pg_partition_tree(to_regclass(:index))) AS index_bytes
+            FROM document
+        """), {"index": vector_index.INDEX_NAME})
+        rows, table_bytes, index_bytes = result.one()
+    index_bytes = index_bytes or 0
+    report = {
+        "storage": settings.VECTOR_STORAGE,
+        "index": settings.VECTOR_INDEX,
+        "rows": rows,
+        "table_bytes": table_bytes,
+        "index_bytes": index_bytes,
+        "index_bytes_per_row": round(index_bytes / rows, 1) if rows else 0,
+        # Raw float32 payload of all vectors, for comparison with index_bytes.
+        "float32_vector_bytes": rows * 4 * EMBEDDING_DIM,
+    }
+    for name, value in report.items():
+        print(f"{name:>22}: {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+async def export_onnx(args):
+    from app.onnx_embeddings import export
+    output = args.output or settings.ONNX_MODEL_DIR
+    print(f"Exporting {settings.EMBEDDING_MODEL} to {output}...")
+    info = await asyncio.to_thread(export, settings.EMBEDDING_MODEL, output)
+    for name, value in info.items():
+        print(f"{name:>22}: {value}")
+
+
+def embedding_agreement(reference, candidate, k: int = 10) -> dict:
+    # Row-wise cosine between two embeddings of the same texts, and how many
+    # of each text's k nearest neighbours within the sample both agree on.
+    a = np.asarray(reference, dtype=np.float32)
+    b = np.asarray(candidate, dtype=np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    cosines = (a * b).sum(axis=1)
+    k = min(k, len(a) - 1)
+    overlap = 1.0
+    if k > 0:
+        sims_a, sims_b = a @ a.T, b @ b.T
+        np.fill_diagonal(sims_a, -np.inf)
+        np.fill_diagonal(sims_b, -np.inf)
+        top_a = np.argsort(-sims_a, axis=1)[:, :k]
+        top_b = np.argsort(-sims_b, axis=1)[:, :k]
+        overlap = float(np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)]))
+    return {
+        "texts": len(a),
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "max_abs_diff": round(float(np.abs(a - b).max()), 6),
+        f"neighbor_overlap@{k}": round(overlap, 4),
+    }
+
+
+# Vectors already stored by the torch model stay valid if a backend is this close.
+DEFAULT_TOLERANCE = {"torch": 1e-6, "onnx": 1e-4, "onnx-int8": 0.02}
+
+
+async def verify_embeddings(args):
+    if args.texts:
+        with open(args.texts) as f:
+            texts = [line.strip() for line in f if line.strip()][:args.samples]
+    else:
+        async with engine.connect() as conn:
+            result = await conn.execute(select(Document.content).order_by(text("random()")).limit(args.samples))
+            texts = result.scalars().all()
+    if not texts:
+        raise SystemExit("No texts to compare, ingest some pages or pass --texts")
+
+    reference = await asyncio.to_thread(providers.make_embeddings("torch").embed_documents, texts)
+    candidate = await asyncio.to_thread(providers.make_embeddings(args.backend).embed_documents, texts)
+    report = embedding_agreement(reference, candidate, args.k)
+    tolerance = DEFAULT_TOLERANCE[args.backend] if args.tolerance is None else args.tolerance
+    report.update(backend=args.backend, tolerance=tolerance, passed=report["min_cosine"] >= 1 - tolerance)
+    for name, value in report.items():
+        print(f"{name:>22}: {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not report["passed"]:
+        raise SystemExit(f"{args.backend} differs from torch by more than {tolerance} (1 - min cosine)")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("migrate", help="Create extension, tables and the vector index").set_defaults(func=migrate)
+    sub.add_parser("reindex", help="Drop and rebuild the vector index from current settings").set_defaults(func=reindex)
+
+    report = sub.add_parser("recall-report", help="Compare ANN search against exact search")
+    report.add_argument("--queries", type=int, default=100)
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--ef-search", default="10,20,40,80,160")
+    report.add_argument("--probes", default="1,5,10,20,50")
+    report.add_argument("--output", help="Write the report as JSON to this path")
+    report.set_defaults(func=recall_report)
+
+    storage = sub.add_parser("storage-report", help="Show table and vector index size for the current storage mode")
+    storage.add_argument("--output", help="Write the report as JSON to this path")
+    storage.set_defaults(func=storage_report)
+
+    onnx = sub.add_parser("export-onnx", help="Export EMBEDDING_MODEL to ONNX, plus an int8-quantized copy")
+    onnx.add_argument("--output", help="Directory, defaults to ONNX_MODEL_DIR")
+    onnx.set_defaults(func=export_onnx)
+
+    verify = sub.add_parser("verify-embeddings", help="Check an embedding backend against the torch model")
+    verify.add_argument("--backend", choices=providers.EMBEDDING_BACKENDS, default=settings.EMBEDDING_BACKEND)
+    verify.add_argument("--samples", type=int, default=500, help="Stored chunks to compare")
+    verify.add_argument("--texts", help="Compare the lines of this file instead of stored chunks")
+    verify.add_argument("--tolerance", type=float, help="Largest allowed 1 - cosine (default depends on the backend)")
+    verify.add_argument("--k", type=int, default=10, help="Neighbours compared within the sample")
+    verify.add_argument("--output", help="Write the report as JSON to this path")
+    verify.set_defaults(func=verify_embeddings)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# With several processes (Celery prefork children, uvicorn --workers) each one
+# writes its samples to PROMETHEUS_MULTIPROC_DIR and the scrape merges them.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CHAT_STAGE_SECONDS = Histogram(
+    "pulse_chat_stage_seconds", "Duration of each /chat pipeline stage",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)  # embed | retrieve | rerank | context | generate | grade | rewrite
+CHAT_SECONDS = Histogram("pulse_chat_seconds", "End-to-end /chat pipeline duration", buckets=LATENCY_BUCKETS)
+CHAT_REQUESTS = Counter("pulse_chat_requests", "/chat requests by outcome", ["outcome"])  # answered | rewritten | cached | no_results | error
+
+INGEST_STAGE_SECONDS = Histogram(
+    "pulse_ingest_stage_seconds", "Duration of each ingestion phase",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)  # fetch | parse | chunk | embed | write | wait (backpressure)
+INGEST_PAGES = Counter("pulse_ingest_pages", "Pages processed by the worker", ["result"])  # ingested | not_modified | failed
+INGEST_CHUNKS = Counter("pulse_ingest_chunks", "Chunks written or skipped during ingestion", ["change"])  # added | unchanged | removed
+
+
+@contextmanager
+def span(histogram: Histogram, stage: str, timings: Optional[Dict[str, float]] = None):
+    # Observes the duration of the block; timings, if given, also receives it
+    # in milliseconds, summed with earlier spans of the same stage.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.labels(stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed * 1000
+
+
+class StageTimer:
+    """Per-stage durations of a streaming pipeline, observed once at the end.
+
+    Stages run interleaved (the chunker pulls text from the parser, which
+    pulls blocks from the socket), so time spent in an inner stage is not
+    counted in the one that called it.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.totals: Dict[str, float] = {}
+        self._stack: list[str] = []
+        self._since = 0.0
+
+    def _enter(self, stage: str):
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(now)
+        self._stack.append(stage)
+        self._since = now
+
+    def _exit(self):
+        now = time.perf_counter()
+        self._charge(now)
+        self._stack.pop()
+        self._since = now
+
+    def _charge(self, now: float):
+        stage = self._stack[-1]
+        self.totals[stage] = self.totals.get(stage, 0.0) + now - self._since
+
+    @contextmanager
+    def stage(self, stage: str):
+        self._enter(stage)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def wrap(self, stage: str, items: Iterable):
+        iterator = iter(items)
+        while True:
+            with self.stage(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def observe(self):
+        for stage, seconds in self.totals.items():
+            self.histogram.labels(stage).observe(seconds)
+        self.totals = {}
+
+
+class StatsCollector:
+    """Exposes an existing stats() dict at scrape time.
+
+    Keys listed in counters become counters, other numeric values gauges.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], dict], counters: Iterable[str] = ()):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = set(counters)
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            if key in self.counters:
+                yield CounterMetricFamily(name, f"{self.prefix} {key}", value=value)
+            else:
+                yield GaugeMetricFamily(name, f"{self.prefix} {key}", value=value)
+
+
+_stats_collectors: list[StatsCollector] = []
+
+
+def register_stats(prefix: str, stats: Callable[[], dict], counters: Iterable[str] = ()):
+    collector = StatsCollector(prefix, stats, counters)
+    _stats_collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    # In-process stats are not shared through the directory; these are the
+    # scraped process's own.
+    for collector in _stats_collectors:
+        registry.register(collector)
+    return registry
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def start_server(port: int):
+    start_http_server(port, registry=registry())
+
+
+def reset_multiproc_dir():
+    # Samples of processes from an earlier run would otherwise be merged in.
+    if MULTIPROC_DIR:
+        shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def mark_process_dead(pid: int):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -1,21 +1,74 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, ForeignKey, Index, Integer, BigInteger, text
 from typing import Optional, List
+from datetime import datetime
 from pgvector.sqlalchemy import Vector
 
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+DEFAULT_COLLECTION = "default"
+
 class Greeting(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     message: str
 
-class Document(SQLModel, table=True):
+class Collection(SQLModel, table=True):
+    # Each collection has its own partition of document, see app.partitions.
+    name: str = Field(primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Source(SQLModel, table=True):
+    # The same URL can be ingested into several collections.
+    __table_args__ = (Index("ux_source_collection_url", "collection", "url", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
+    # server_default matches the column the schema patch adds to older databases.
+    collection: str = Field(default=DEFAULT_COLLECTION, sa_column_kwargs={"server_default": DEFAULT_COLLECTION})
+    url: str
+    status: str = Field(default="PENDING")  # PENDING | INGESTING | ACTIVE | FAILED
+    chunk_count: int = Field(default=0)
+    bytes: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, server_default="0"))
+    last_ingested_at: Optional[datetime] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    last_fetched_at: Optional[datetime] = None
+
+class Document(SQLModel, table=True):
+    # List-partitioned by collection: every partition gets its own copy of
+    # the indexes, including the vector index, and a search for one
+    # collection only touches that partition.
+    __table_args__ = (
+        Index("ix_document_source_id_hash", "source_id", "content_hash"),
+        {"postgresql_partition_by": "LIST (collection)"},
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    # A partitioned table's primary key has to include the partition key.
+    collection: str = Field(default=DEFAULT_COLLECTION, primary_key=True, sa_column_kwargs={"server_default": DEFAULT_COLLECTION})
     content: str
-    source: str = Field(default="unknown")
-    embedding: List[float] = Field(sa_type=Vector(384)) # 384 dims for all-MiniLM-L6-v2
+    source: str = Field(default="unknown")  # denormalized Source.url
+    # Deleting a Source removes its chunks through the indexed foreign key.
+    source_id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(Integer, ForeignKey("source.id", ondelete="CASCADE"), index=True),
+    )
+    content_hash: Optional[str] = None  # sha256 of content, used to skip unchanged chunks on re-ingestion
+    # Position within the source's extracted text, used to merge neighbouring hits.
+    ordinal: Optional[int] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    embedding: List[float] = Field(sa_type=Vector(EMBEDDING_DIM))
 
 class Job(SQLModel, table=True):
+    # /jobs lists the newest top-level jobs, so index exactly that.
+    __table_args__ = (
+        Index("ix_job_top_level_created_at", "created_at", postgresql_where=text("parent_id IS NULL")),
+    )
+
     id: Optional[str] = Field(default=None, primary_key=True)
     url: str
+    kind: str = Field(default="scrape")  # scrape | batch | crawl | upload
+    parent_id: Optional[str] = Field(default=None, index=True)  # batch job of a child scrape
     status: str = Field(default="PENDING")
-    created_at: str
-    finished_at: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
     result: Optional[str] = None
@@ -0,0 +1,136 @@
+import json
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# sentence-transformers models exported to ONNX: the transformer runs in ONNX
+# Runtime, tokenization in the Rust tokenizer, pooling in numpy. No torch
+# import at serving time.
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model-int8.onnx"
+CONFIG_FILE = "pulse_onnx.json"
+
+
+def mean_pool(hidden: np.ndarray, attention_mask: np.ndarray, normalize: bool) -> np.ndarray:
+    # Same as the sentence-transformers Pooling(mean) + Normalize modules.
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    if normalize:
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    return pooled
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings from an exported transformer graph, see export()."""
+
+    def __init__(self, session, tokenizer, normalize: bool = True, batch_size: int = 64):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.normalize = normalize
+        self.batch_size = batch_size
+        self.input_names = {i.name for i in session.get_inputs()}
+
+    @classmethod
+    def from_dir(cls, model_dir: str, quantized: bool = False, batch_size: int = 64, threads: int = 0) -> "OnnxEmbeddings":
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = os.path.join(model_dir, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found, run `python -m app.manage export-onnx` first")
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            config = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=config["max_seq_length"])
+        tokenizer.enable_padding(pad_id=config["pad_token_id"], pad_token=config["pad_token"])
+        return cls(session, tokenizer, normalize=config["normalize"], batch_size=batch_size)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        return mean_pool(hidden, feeds["attention_mask"], self.normalize)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Batches of similar length waste less compute on padding.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors: List[List[float]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def export(model_name: str, model_dir: str, opset: int = 17) -> dict:
+    # Needs torch and sentence-transformers, but only when exporting.
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, device="cpu")
+    pooling = next(m for m in model if isinstance(m, Pooling))
+    if pooling.get_pooling_mode_str() != "mean":
+        raise ValueError(f"{model_name} uses {pooling.get_pooling_mode_str()} pooling, only mean is supported")
+    transformer = model[0]
+    tokenizer = transformer.tokenizer
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.auto_model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer.save_pretrained(model_dir)
+    sample = tokenizer(["export"], return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    axes = {name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]}
+    path = os.path.join(model_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()),
+            tuple(sample[name] for name in names),
+            path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=axes,
+            opset_version=opset,
+        )
+    quantized_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": model.max_seq_length,
+        "normalize": any(isinstance(m, Normalize) for m in model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "dimension": model.get_sentence_embedding_dimension(),
+    }
+    with open(os.path.join(model_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+    return {**config, "model_bytes": os.path.getsize(path), "quantized_model_bytes": os.path.getsize(quantized_path)}
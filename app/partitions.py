@@ -0,0 +1,92 @@
+import re
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.models import Collection, DEFAULT_COLLECTION, Source
+
+# Every collection is a list partition of document named document__<name>.
+# A partition is created empty and then attached, which only takes a SHARE
+# UPDATE EXCLUSIVE lock on document, so searches and ingestion into other
+# collections carry on. The indexes declared on document, the vector index
+# included, are created on the partition as it is attached.
+
+NAME_PATTERN = r"^[a-z0-9_]{1,40}$"
+
+
+def partition_name(collection: str) -> str:
+    # Names end up in DDL, so they are restricted to plain identifiers.
+    if not re.fullmatch(NAME_PATTERN, collection):
+        raise ValueError(f"Invalid collection name '{collection}', expected {NAME_PATTERN}")
+    return f"document__{collection}"
+
+
+def partition_ddl(collection: str) -> List[str]:
+    table = partition_name(collection)
+    return [
+        f"CREATE TABLE {table} (LIKE document INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)",
+        f"ALTER TABLE document ATTACH PARTITION {table} FOR VALUES IN ('{collection}')",
+    ]
+
+
+async def ensure_collection(session, name: str) -> bool:
+    # Commits, so a task sent afterwards can write to the partition. The
+    # primary key serializes concurrent creation of the same collection.
+    partition_name(name)
+    created = (await session.execute(
+        pg_insert(Collection)
+        .values(name=name, created_at=datetime.utcnow())
+        .on_conflict_do_nothing()
+        .returning(Collection.name)
+    )).scalar() is not None
+    if created:
+        print(f"Creating collection {name}...")
+        for statement in partition_ddl(name):
+            await session.execute(text(statement))
+    await session.commit()
+    return created
+
+
+async def drop_collection(session, name: str) -> bool:
+    # Dropping the partition removes the chunks without touching any other
+    # collection's rows or indexes; the sources go with it.
+    table = partition_name(name)
+    deleted = (await session.execute(
+        Collection.__table__.delete().where(Collection.name == name).returning(Collection.name)
+    )).scalar() is not None
+    if deleted:
+        await session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        await session.execute(Source.__table__.delete().where(Source.collection == name))
+    await session.commit()
+    return deleted
+
+
+async def list_collections(session) -> list[dict]:
+    stmt = (
+        select(
+            Collection.name,
+            Collection.created_at,
+            func.count(Source.id).label("sources"),
+            func.coalesce(func.sum(Source.chunk_count), 0).label("chunks"),
+            func.coalesce(func.sum(Source.bytes), 0).label("bytes"),
+        )
+        .outerjoin(Source, Source.collection == Collection.name)
+        .group_by(Collection.name, Collection.created_at)
+        .order_by(Collection.name)
+    )
+    return [dict(row._mapping) for row in await session.execute(stmt)]
+
+
+def default_partition_patch() -> str:
+    # For app.database: a new database starts with the default collection.
+    statements = ";\n            ".join(partition_ddl(DEFAULT_COLLECTION))
+    return f"""
+    DO $$
+    BEGIN
+        IF to_regclass('{partition_name(DEFAULT_COLLECTION)}') IS NULL THEN
+            {statements};
+        END IF;
+    END $$
+    """
@@ -0,0 +1,250 @@
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from array import array
+from contextlib import contextmanager, suppress
+from typing import Callable, List, Optional, Tuple
+
+import redis
+
+from app.settings import settings
+
+# Ingestion runs as a chain of tasks, each stage on its own Celery queue so
+# it can get a pool sized for its work:
+#   fetch  download the body to INGEST_SPOOL_DIR               (network bound)
+#   parse  extract text, chunk, skip chunks already stored     (CPU bound)
+#   embed  encode queued chunks of any documents together      (CPU bound)
+#   write  insert the chunks; the task that stores a document's last
+#          chunks removes its stale ones and completes its job
+# Bodies travel through the spool directory, chunks through Redis. State of
+# a document in flight:
+#   ingest:<doc>        hash  context (JSON) and counters; pending is the
+#                             number of chunks (plus one while parsing) not
+#                             yet written, whoever brings it to 0 finishes
+#   ingest:<doc>:seen   set   hashes of every chunk of the new version
+#   ingest:embed        list  JSON chunks waiting for the embed stage
+#   ingest:documents    zset  documents in flight by start time
+# An embed task moves the chunks it takes to a claim, which stays until
+# every document in it has been written, so chunks of a worker that dies
+# are not lost:
+#   ingest:claim:<id>       list  the chunks taken
+#   ingest:claim:<id>:docs  set   documents whose write is still to be acknowledged
+#   ingest:claims           zset  claims by time last worked on, for reclaim()
+# The tasks are routed to the queues in app.celery_app.
+
+store = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+EMBED_LIST = "ingest:embed"
+DOCUMENTS = "ingest:documents"
+CLAIMS = "ingest:claims"
+
+# Counters of a failed (deleted) document must not be recreated by tasks still running for it.
+_incr_existing = store.register_script("""
+if redis.call('exists', KEYS[1]) == 0 then return false end
+return redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+""")
+
+# Moves up to ARGV[1] chunks to a claim in one step: a worker dying in between loses none.
+_take = store.register_script("""
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('lmove', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not item then break end
+    items[i] = item
+end
+if #items > 0 then redis.call('zadd', KEYS[3], ARGV[2], ARGV[3]) end
+return items
+""")
+
+
+def key(doc_id: str, name: Optional[str] = None) -> str:
+    return f"ingest:{doc_id}:{name}" if name else f"ingest:{doc_id}"
+
+
+def spool_path() -> str:
+    os.makedirs(settings.INGEST_SPOOL_DIR, exist_ok=True)
+    return os.path.join(settings.INGEST_SPOOL_DIR, uuid.uuid4().hex)
+
+
+def discard(path: Optional[str]):
+    # A spooled body that will not be parsed; it may never have been created.
+    if path is not None:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def start(doc: dict) -> str:
+    # doc: url, collection, source_id, path, kind and encoding of the spooled
+    # body, plus what to complete at the end (job_id, batch_id, crawl_id).
+    doc_id = uuid.uuid4().hex
+    store.hset(key(doc_id), mapping={
+        "doc": json.dumps(doc), "pending": 1, "chunks": 0, "added": 0, "unchanged": 0,
+    })
+    store.expire(key(doc_id), settings.INGEST_STATE_TTL)
+    store.zadd(DOCUMENTS, {doc_id: time.time()})
+    return doc_id
+
+
+def context(doc_id: str) -> Optional[dict]:
+    # None once the document is finished or failed.
+    raw = store.hget(key(doc_id), "doc")
+    return json.loads(raw) if raw else None
+
+
+def counts(doc_id: str) -> dict:
+    raw = store.hgetall(key(doc_id))
+    return {name: int(raw.get(name, 0)) for name in ("chunks", "added", "unchanged")}
+
+
+def count(doc_id: str, **values: int):
+    for name, value in values.items():
+        _incr_existing(keys=[key(doc_id)], args=[name, value])
+
+
+def add_seen(doc_id: str, hashes: List[str]):
+    if hashes and store.exists(key(doc_id)):
+        store.sadd(key(doc_id, "seen"), *hashes)
+        store.expire(key(doc_id, "seen"), settings.INGEST_STATE_TTL)
+
+
+def seen(doc_id: str) -> List[str]:
+    return list(store.smembers(key(doc_id, "seen")))
+
+
+def release(doc_id: str, pending: int) -> bool:
+    # True for the caller that has to finish the document.
+    return _incr_existing(keys=[key(doc_id)], args=["pending", -pending]) == 0
+
+
+def queue_chunks(doc_id: str, chunks: List[dict]):
+    # Counted as pending before they are visible to the embed stage.
+    if _incr_existing(keys=[key(doc_id)], args=["pending", len(chunks)]) is None:
+        return
+    store.rpush(EMBED_LIST, *(json.dumps({"doc": doc_id, **chunk}) for chunk in chunks))
+
+
+def claim_key(claim: str, name: Optional[str] = None) -> str:
+    return f"ingest:claim:{claim}:{name}" if name else f"ingest:claim:{claim}"
+
+
+def take_chunks(limit: int) -> Tuple[str, List[dict]]:
+    claim = uuid.uuid4().hex
+    items = _take(keys=[EMBED_LIST, claim_key(claim), CLAIMS], args=[limit, time.time(), claim])
+    return claim, [json.loads(raw) for raw in items]
+
+
+def touch(claim: str):
+    # Still working on it, e.g. waiting for the write stage.
+    store.zadd(CLAIMS, {claim: time.time()}, xx=True)
+
+
+@contextmanager
+def keep_claim(claim: str):
+    # Touches the claim from a thread while the body blocks (the embedding model).
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(settings.INGEST_CLAIM_TIMEOUT / 3):
+            touch(claim)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def hand_off(claim: str, doc_ids: List[str]):
+    # Before the write tasks are sent: each of them acknowledges its document.
+    store.sadd(claim_key(claim, "docs"), *doc_ids)
+
+
+def ack(claim: str, doc_id: str):
+    # The document's chunks are written, or it failed. The last one drops the claim.
+    store.srem(claim_key(claim, "docs"), doc_id)
+    if not store.scard(claim_key(claim, "docs")):
+        drop_claim(claim)
+
+
+def drop_claim(claim: str):
+    store.delete(claim_key(claim), claim_key(claim, "docs"))
+    store.zrem(CLAIMS, claim)
+
+
+def stale_claims() -> List[str]:
+    # A claim handed off to the write stage is touched by each of its writes
+    # as it starts. Until then its writes may still be queued behind others,
+    # so handed-off claims only go stale once the write queue is empty.
+    claims = store.zrangebyscore(CLAIMS, 0, time.time() - settings.INGEST_CLAIM_TIMEOUT)
+    if claims and queued_tasks("write"):
+        claims = [claim for claim in claims if not store.exists(claim_key(claim, "docs"))]
+    return claims
+
+
+def reclaim(claim: str) -> Tuple[int, List[str]]:
+    # A claim older than INGEST_CLAIM_TIMEOUT: its embed or write task died.
+    # Chunks never handed to the write stage go back to the front of the
+    # embed queue; documents whose write was sent but not acknowledged may be
+    # partly written, so they are returned to be failed rather than retried.
+    # Returns (chunks requeued, documents to fail).
+    if not store.zrem(CLAIMS, claim):
+        return 0, []  # another worker got to it first
+    docs = list(store.smembers(claim_key(claim, "docs")))
+    requeued = 0
+    if not docs:
+        while store.lmove(claim_key(claim), EMBED_LIST, "RIGHT", "LEFT") is not None:
+            requeued += 1
+    store.delete(claim_key(claim), claim_key(claim, "docs"))
+    return requeued, docs
+
+
+def finish(doc_id: str):
+    store.delete(key(doc_id), key(doc_id, "seen"))
+    store.zrem(DOCUMENTS, doc_id)
+
+
+def in_flight() -> int:
+    # Documents of workers that died never finish; they stop counting after INGEST_DOCUMENT_TIMEOUT.
+    store.zremrangebyscore(DOCUMENTS, 0, time.time() - settings.INGEST_DOCUMENT_TIMEOUT)
+    return store.zcard(DOCUMENTS)
+
+
+def has_room() -> bool:
+    # Fetching stops while INGEST_MAX_DOCUMENTS documents are between fetch and write.
+    return in_flight() < settings.INGEST_MAX_DOCUMENTS
+
+
+def queued_chunks() -> int:
+    return store.llen(EMBED_LIST)
+
+
+def queued_tasks(queue: str) -> int:
+    # Messages waiting in a Celery queue (a list named after it with the Redis broker).
+    return store.llen(queue)
+
+
+def wait_for_room(backlog: Callable[[], int], limit: int, interval: float = 0.2, heartbeat: Optional[Callable[[], None]] = None):
+    # Blocks while the next stage is behind.
+    while backlog() >= limit:
+        if heartbeat is not None:
+            heartbeat()
+        time.sleep(interval)
+
+
+def pack(vectors: List[List[float]]) -> str:
+    # float32 as base64, a third of the size of JSON floats in the message.
+    values = array("f")
+    for vector in vectors:
+        values.extend(vector)
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def unpack(packed: str, count: int) -> List[List[float]]:
+    values = array("f", base64.b64decode(packed)).tolist()
+    size = len(values) // count if count else 0
+    return [values[i * size:(i + 1) * size] for i in range(count)]
@@ -0,0 +1,91 @@
+import threading
+from typing import Any, Callable, Dict
+
+from app.settings import settings
+
+# Models are loaded on first use (or by warm_up) and shared by everything in
+# the process. Imports happen inside the loaders so that importing the API
+# does not pull in torch.
+
+_models: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _load(name: str, factory: Callable[[], Any]) -> Any:
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            # Another thread may have finished loading while we waited.
+            model = _models.get(name)
+            if model is None:
+                print(f"Loading {name}...")
+                model = _models[name] = factory()
+    return model
+
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def make_embeddings(backend: str | None = None):
+    # A new, unshared instance; verification and benchmarks load several backends side by side.
+    backend = backend or settings.EMBEDDING_BACKEND
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=settings.EMBEDDING_MODEL,
+            encode_kwargs={"batch_size": settings.EMBED_BATCH_SIZE},
+        )
+    if backend in ("onnx", "onnx-int8"):
+        from app.onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings.from_dir(
+            settings.ONNX_MODEL_DIR,
+            quantized=backend == "onnx-int8",
+            batch_size=settings.EMBED_BATCH_SIZE,
+            threads=settings.ONNX_THREADS,
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected one of {list(EMBEDDING_BACKENDS)}")
+
+
+def get_embeddings():
+    return _load("embeddings", make_embeddings)
+
+
+def get_llm():
+    def factory():
+        from langchain_community.chat_models import ChatOllama
+        return ChatOllama(model=settings.OLLAMA_MODEL, base_url=settings.OLLAMA_BASE_URL)
+    return _load("llm", factory)
+
+
+def get_cross_encoder(model_name: str):
+    def factory():
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
+    return _load(f"cross-encoder:{model_name}", factory)
+
+
+def required_models() -> list[str]:
+    # What the API needs before it can answer /chat with the current settings.
+    names = ["embeddings", "llm"]
+    if settings.RERANK:
+        names.append(f"cross-encoder:{settings.RERANK_MODEL}")
+    if settings.GRADER == "cross-encoder":
+        names.append(f"cross-encoder:{settings.CROSS_ENCODER_MODEL}")
+    return list(dict.fromkeys(names))
+
+
+def warm_up(names: list[str] | None = None):
+    for name in names or required_models():
+        if name == "embeddings":
+            # The first forward pass is much slower than the following ones.
+            get_embeddings().embed_query("warm up")
+        elif name == "llm":
+            get_llm()
+        elif name.startswith("cross-encoder:"):
+            model_name = name.split(":", 1)[1]
+            get_cross_encoder(model_name).predict([("warm up", "warm up")])
+
+
+def readiness() -> dict:
+    models = {name: name in _models for name in required_models()}
+    return {"ready": all(models.values()), "models": models}
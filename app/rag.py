@@ -1,76 +1,282 @@
-from typing import List, Dict, Any
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sqlalchemy import select
-from app.database import get_session
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Dict, Any
 from app.models import Document
+from app import retrieval
+from app.schemas import SearchOptions
+from app.settings import settings
+from app.cache import answer_cache, embedding_cache
+from app.batcher import MicroBatcher
+from app.database import async_session
+from app import grading
+from app.rerank import Reranker
+from app.context import build_context
+from app.providers import get_embeddings, get_llm
+from app import metrics
+from app.metrics import CHAT_REQUESTS, CHAT_SECONDS, CHAT_STAGE_SECONDS, span
 
-# Initialize models
-llm = ChatOllama(model="llama3", base_url="http://ollama:11434")
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-async def search_docs(session, query: str, limit: int = 3) -> List[Document]:
-    query_vector = embeddings.embed_query(query)
-    stmt = select(Document).order_by(Document.embedding.l2_distance(query_vector)).limit(limit)
-    result = await session.execute(stmt)
-    return result.scalars().all()
-
-async def grade_answer(query: str, context: str, answer: str) -> float:
-    prompt = f"""Rate the relevance of the answer to the query based on the context. 
-    Return ONLY a number between 0.0 and 1.0.
-    
-    Query: {query}
-    Answer: {answer}
-    Context: {context}
-    """
-    try:
-        score_str = llm.invoke(prompt).content.strip()
-        # Clean up any extra text if LLM ignores instructions
-        import re
-        match = re.search(r"0\.\d+|1\.0|0", score_str)
-        return float(match.group(0)) if match else 0.5
-    except:
-        return 0.5
+# Embedding is CPU-bound and synchronous, so it runs on a bounded pool off the event loop.
+# The semaphores cap how many requests can be inside each stage at once.
+embed_executor = ThreadPoolExecutor(max_workers=settings.EMBED_WORKERS, thread_name_prefix="embed")
+llm_limit = asyncio.Semaphore(settings.LLM_CONCURRENCY)
+search_limit = asyncio.Semaphore(settings.SEARCH_CONCURRENCY)
+
+reranker = Reranker(
+    settings.RERANK_MODEL,
+    batch_size=settings.RERANK_BATCH_SIZE,
+    cache_size=settings.RERANK_CACHE_SIZE,
+    executor=embed_executor,
+)
+
+def embed_documents(texts: List[str]) -> List[List[float]]:
+    return get_embeddings().embed_documents(texts)
+
+# Concurrent cache misses are encoded together in one forward pass.
+embed_batcher = MicroBatcher(
+    embed_documents,
+    max_batch=settings.EMBED_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBED_BATCH_MAX_WAIT_MS,
+    executor=embed_executor,
+)
+
+metrics.register_stats("pulse_embedding_cache", embedding_cache.stats,
+                       counters=("local_hits", "redis_hits", "misses", "evictions", "redis_errors"))
+metrics.register_stats("pulse_rerank_cache", reranker.stats, counters=("hits", "misses"))
+metrics.register_stats("pulse_answer_cache", answer_cache.stats,
+                       counters=("hits", "misses", "stores", "stale", "invalidated", "expired", "evictions"))
+metrics.register_stats("pulse_embed_batcher", embed_batcher.stats, counters=("batches", "items"))
+
+async def embed_text(text: str) -> List[float]:
+    if settings.EMBED_MICROBATCH:
+        return await embed_batcher.submit(text)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(embed_executor, lambda: get_embeddings().embed_query(text))
+
+async def embed_query(text: str) -> List[float]:
+    vector = await embedding_cache.get(text)
+    if vector is None:
+        vector = await embed_text(text)
+        await embedding_cache.set(text, vector)
+    return vector
+
+async def complete(prompt: str) -> str:
+    async with llm_limit:
+        message = await get_llm().ainvoke(prompt)
+    return message.content
+
+async def search_docs(
+    session,
+    query: str,
+    options: SearchOptions | None = None,
+    timings: Dict[str, float] | None = None,
+    query_vector: List[float] | None = None,
+) -> List[Document]:
+    # timings, if given, receives per-stage durations in milliseconds.
+    options = options or SearchOptions()
+    rerank = settings.RERANK if options.rerank is None else options.rerank
+    # With reranking, retrieval only has to produce a wide candidate set.
+    limit = (options.rerank_candidates or settings.RERANK_CANDIDATES) if rerank else options.top_k
+
+    if query_vector is None:
+        with span(CHAT_STAGE_SECONDS, "embed", timings):
+            query_vector = await embed_query(query)
+
+    with span(CHAT_STAGE_SECONDS, "retrieve", timings):
+        async with search_limit:
+            if (options.mode or settings.RETRIEVAL_MODE) == "hybrid":
+                docs = await retrieval.hybrid_search(
+                    session,
+                    query,
+                    query_vector,
+                    limit=limit,
+                    candidates=max(limit, options.candidates or settings.HYBRID_CANDIDATES),
+                    vector_weight=settings.HYBRID_VECTOR_WEIGHT if options.vector_weight is None else options.vector_weight,
+                    text_weight=settings.HYBRID_TEXT_WEIGHT if options.text_weight is None else options.text_weight,
+                    collections=options.collections,
+                )
+            else:
+                docs = await retrieval.vector_search(session, query_vector, limit, options.collections)
+
+    if rerank and docs:
+        with span(CHAT_STAGE_SECONDS, "rerank", timings):
+            docs = await reranker.rerank(query, docs, options.top_k)
+    return docs
+
+def answer_scope(options: SearchOptions | None) -> str:
+    # Cached answers are only reused for requests that search the same way.
+    scope = (options or SearchOptions()).model_dump(include=set(SearchOptions.model_fields))
+    scope["collections"] = sorted(set(scope["collections"]))
+    return json.dumps(scope, sort_keys=True)
+
+def format_timings(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in timings.items())
+
+def add_timings(total: Dict[str, float], timings: Dict[str, float]):
+    for stage, ms in timings.items():
+        total[stage] = total.get(stage, 0.0) + ms
+
+def make_grader():
+    if settings.GRADER == "llm":
+        return grading.LLMGrader(complete)
+    if settings.GRADER == "embedding":
+        return grading.EmbeddingGrader(embed_query, embed_text)
+    if settings.GRADER == "cross-encoder":
+        return grading.CrossEncoderGrader(settings.CROSS_ENCODER_MODEL, embed_executor)
+    raise ValueError(f"Unknown GRADER '{settings.GRADER}', expected llm, embedding or cross-encoder")
+
+grader = make_grader()
+grade_threshold = grader.threshold if settings.GRADE_THRESHOLD is None else settings.GRADE_THRESHOLD
+
+async def grade_answer(query: str, docs: List[Document], answer: str) -> float:
+    return await grader.grade(query, docs, answer)
 
 async def rewrite_query(query: str) -> str:
     prompt = f"""Rewrite this query to be more specific for a vector search. Return ONLY the new query.
     Original: {query}"""
-    return llm.invoke(prompt).content.strip()
+    return (await complete(prompt)).strip()
 
-async def generate_answer(query: str, context_docs: List[Document]) -> str:
-    context_text = "\n\n".join([doc.content for doc in context_docs])
-    prompt = f"""You are a helpful assistant. Answer the question based ONLY on the context below.
+async def rewrite_and_search(query: str, options: SearchOptions | None) -> tuple[str, List[Document]]:
+    # Runs next to draft generation, so it must not share the request's session.
+    new_query = await rewrite_query(query)
+    async with async_session() as session:
+        docs = await search_docs(session, new_query, options)
+    return new_query, docs
+
+def answer_prompt(query: str, context_text: str) -> str:
+    return f"""You are a helpful assistant. Answer the question based ONLY on the context below.
     Context: {context_text}
     Question: {query}"""
-    return llm.invoke(prompt).content
 
-async def rag_flow(session, query: str) -> Dict[str, Any]:
+async def generate_answer(query: str, context_text: str) -> str:
+    return await complete(answer_prompt(query, context_text))
+
+async def generate_answer_stream(query: str, context_text: str) -> AsyncIterator[str]:
+    async with llm_limit:
+        async for chunk in get_llm().astream(answer_prompt(query, context_text)):
+            if chunk.content:
+                yield chunk.content
+
+async def rag_flow_stream(session, query: str, options: SearchOptions | None = None, cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+    # Events: trace (a new trace step), token (answer text), reset (discard the
+    # answer streamed so far, a regenerated one follows) and done (final response).
+    # With cache, a cached answer to a similar query is returned as one token.
     trace = []
-    
-    # Attempt 1
-    trace.append(f"Searching for: {query}")
-    docs = await search_docs(session, query)
-    if not docs:
-        return {"answer": "No information found.", "trace": trace, "sources": []}
-        
-    answer = await generate_answer(query, docs)
-    trace.append("Draft answer generated.")
-    
-    context_text = "\n".join([d.content for d in docs])
-    grade = await grade_answer(query, context_text, answer)
-    trace.append(f"Grade: {grade}")
-    
-    if grade < 0.7:
-        trace.append("Confidence low. Rewriting query...")
-        new_query = await rewrite_query(query)
-        trace.append(f"New Query: {new_query}")
-        
-        docs = await search_docs(session, new_query)
-        answer = await generate_answer(new_query, docs)
-        trace.append("New answer generated.")
-        
-    return {
+    # Milliseconds per stage, summed over both attempts when the answer is regenerated.
+    timings = {}
+    started = time.perf_counter()
+
+    def step(message: str) -> Dict[str, Any]:
+        trace.append(message)
+        return {"event": "trace", "data": message}
+
+    def done(outcome: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - started
+        CHAT_SECONDS.observe(elapsed)
+        CHAT_REQUESTS.labels(outcome).inc()
+        timings["total"] = elapsed * 1000
+        data["timings"] = {stage: round(ms, 1) for stage, ms in timings.items()}
+        return {"event": "done", "data": data}
+
+    speculative = None
+    cache = cache and settings.ANSWER_CACHE
+    query_vector = None
+    try:
+        if cache:
+            scope = answer_scope(options)
+            # Invalidations after this point are checked before the answer is stored.
+            version = answer_cache.version
+            with span(CHAT_STAGE_SECONDS, "embed", timings):
+                query_vector = await embed_query(query)
+            cached = answer_cache.get(scope, query_vector)
+            if cached is not None:
+                response, similarity = cached
+                yield step(f"Cached answer (similarity {similarity:.3f})")
+                yield {"event": "token", "data": response["answer"]}
+                yield done("cached", {"answer": response["answer"], "trace": trace, "sources": response["sources"]})
+                return
+
+        # Attempt 1
+        yield step(f"Searching for: {query}")
+        search_timings = {}
+        docs = await search_docs(session, query, options, search_timings, query_vector)
+        add_timings(timings, search_timings)
+        yield step(f"Retrieved {len(docs)} chunks ({format_timings(search_timings)})")
+        if not docs:
+            yield done("no_results", {"answer": "No information found.", "trace": trace, "sources": []})
+            return
+
+        # Speculatively rewrite and re-retrieve while the draft is generated and
+        # graded; the result is discarded if the draft passes.
+        if settings.SPECULATIVE_REWRITE:
+            speculative = asyncio.create_task(rewrite_and_search(query, options))
+            # Retrieve the exception of an unused task so it is not logged as unhandled.
+            speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+            yield step("Speculative rewrite started.")
+
+        with span(CHAT_STAGE_SECONDS, "context", timings):
+            context = build_context(docs)
+        yield step(f"Context: {context.summary()}")
+
+        answer = ""
+        # Streamed stages also include the time the consumer takes per token.
+        with span(CHAT_STAGE_SECONDS, "generate", timings):
+            async for token in generate_answer_stream(query, context.text):
+                answer += token
+                yield {"event": "token", "data": token}
+        yield step("Draft answer generated.")
+
+        with span(CHAT_STAGE_SECONDS, "grade", timings):
+            grade = await grade_answer(query, docs, answer)
+        yield step(f"Grade: {grade}")
+
+        outcome = "answered"
+        if grade < grade_threshold:
+            outcome = "rewritten"
+            yield step("Confidence low. Rewriting query...")
+            if speculative is not None:
+                # Only the part of the speculative work that is still running.
+                with span(CHAT_STAGE_SECONDS, "rewrite", timings):
+                    new_query, docs = await speculative
+                speculative = None
+            else:
+                with span(CHAT_STAGE_SECONDS, "rewrite", timings):
+                    new_query = await rewrite_query(query)
+                search_timings = {}
+                docs = await search_docs(session, new_query, options, search_timings)
+                add_timings(timings, search_timings)
+                yield step(f"Retrieved {len(docs)} chunks ({format_timings(search_timings)})")
+            yield step(f"New Query: {new_query}")
+
+            with span(CHAT_STAGE_SECONDS, "context", timings):
+                context = build_context(docs)
+            yield step(f"Context: {context.summary()}")
+
+            yield {"event": "reset", "data": None}
+            answer = ""
+            with span(CHAT_STAGE_SECONDS, "generate", timings):
+                async for token in generate_answer_stream(new_query, context.text):
+                    answer += token
+                    yield {"event": "token", "data": token}
+            yield step("New answer generated.")
+    except Exception:
+        CHAT_REQUESTS.labels("error").inc()
+        raise
+    finally:
+        if speculative is not None:
+            speculative.cancel()
+
+    sources = [doc.content[:200] + "..." for doc in docs]
+    if cache:
+        answer_cache.put(scope, query_vector, {"answer": answer, "sources": sources}, docs, (options or SearchOptions()).collections, version)
+    yield done(outcome, {
         "answer": answer,
         "trace": trace,
-        "sources": [doc.content[:200] + "..." for doc in docs]
-    }
+        "sources": sources
+    })
+
+async def rag_flow(session, query: str, options: SearchOptions | None = None, cache: bool = True) -> Dict[str, Any]:
+    async for event in rag_flow_stream(session, query, options, cache):
+        if event["event"] == "done":
+            return event["data"]
@@ -0,0 +1,63 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
+
+from app.cache import normalize
+from app.models import Document
+from app.providers import get_cross_encoder
+
+
+class Reranker:
+    """Rescores retrieval candidates with a cross-encoder and keeps the best.
+
+    Scores are cached per (normalized query, chunk id), so repeated queries
+    only run the model on chunks they have not seen yet.
+    """
+
+    def __init__(self, model_name: str, batch_size: int, cache_size: int, executor: Optional[Executor] = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.executor = executor
+        self._scores: OrderedDict[Tuple[str, int], float] = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        model = get_cross_encoder(self.model_name)
+        return [float(score) for score in model.predict(pairs, batch_size=self.batch_size)]
+
+    def _remember(self, key: Tuple[str, int], score: float):
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.cache_size:
+            self._scores.popitem(last=False)
+
+    async def rerank(self, query: str, docs: List[Document], top_k: int) -> List[Document]:
+        normalized = normalize(query)
+        scores = {}
+        missing = []
+        for doc in docs:
+            key = (normalized, doc.id)
+            if key in self._scores:
+                self._scores.move_to_end(key)
+                scores[doc.id] = self._scores[key]
+                self.cache_hits += 1
+            else:
+                missing.append(doc)
+        self.cache_misses += len(missing)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            new_scores = await loop.run_in_executor(
+                self.executor, self._predict, [(query, doc.content) for doc in missing]
+            )
+            for doc, score in zip(missing, new_scores):
+                scores[doc.id] = score
+                self._remember((normalized, doc.id), score)
+
+        return sorted(docs, key=lambda doc: scores[doc.id], reverse=True)[:top_k]
+
+    def stats(self) -> dict:
+        return {"size": len(self._scores), "hits": self.cache_hits, "misses": self.cache_misses}
@@ -0,0 +1,62 @@
+from collections import defaultdict
+from typing import List, Sequence
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from app import vector_index
+from app.models import Document
+from app.settings import settings
+
+# Generated column, created by a schema patch in app.database rather than
+# declared on the model so plain Document selects never load it.
+content_tsv = literal_column("document.content_tsv", type_=TSVECTOR)
+
+
+async def vector_search(session, query_vector: List[float], limit: int, collections: Sequence[str] | None = None) -> List[Document]:
+    await vector_index.apply_search_params(session, limit=limit)
+    stmt = vector_index.nearest(query_vector, limit, Document, collections=collections)
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+
+async def text_search(session, query: str, limit: int, collections: Sequence[str] | None = None) -> List[Document]:
+    tsquery = func.websearch_to_tsquery(settings.TEXT_SEARCH_CONFIG, query)
+    stmt = (
+        select(Document)
+        .where(content_tsv.op("@@")(tsquery), *vector_index.in_collections(collections))
+        .order_by(func.ts_rank_cd(content_tsv, tsquery).desc())
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+
+def fuse_rrf(rankings: Sequence[Sequence[int]], weights: Sequence[float], k: int = 60) -> List[int]:
+    # Reciprocal-rank fusion: score(d) = sum over rankings of weight / (k + rank).
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += weight / (k + rank)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
+
+
+async def hybrid_search(
+    session,
+    query: str,
+    query_vector: List[float],
+    limit: int,
+    candidates: int,
+    vector_weight: float,
+    text_weight: float,
+    collections: Sequence[str] | None = None,
+) -> List[Document]:
+    vector_docs = await vector_search(session, query_vector, candidates, collections)
+    text_docs = await text_search(session, query, candidates, collections) if text_weight > 0 else []
+    by_id = {doc.id: doc for doc in vector_docs + text_docs}
+    fused = fuse_rrf(
+        [[doc.id for doc in vector_docs], [doc.id for doc in text_docs]],
+        [vector_weight, text_weight],
+        k=settings.RRF_K,
+    )
+    return [by_id[doc_id] for doc_id in fused[:limit]]
@@ -1,7 +1,30 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Annotated, Literal
+from pydantic import BaseModel, Field
+from app.models import DEFAULT_COLLECTION
+from app.partitions import NAME_PATTERN
+
+CollectionName = Annotated[str, Field(pattern=NAME_PATTERN)]
 
 class ScrapeRequest(BaseModel):
     url: str
+    collection: CollectionName = DEFAULT_COLLECTION  # created on first use
+
+class BatchScrapeRequest(BaseModel):
+    urls: list[str] = Field(min_length=1)
+    collection: CollectionName = DEFAULT_COLLECTION
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    jobs: int
+    tasks: int
+
+class CrawlRequest(BaseModel):
+    url: str
+    max_depth: int | None = Field(default=None, ge=0)
+    max_pages: int | None = Field(default=None, ge=1)
+    sitemap: bool = False  # seed from sitemap.xml (url itself if it ends in .xml)
+    collection: CollectionName = DEFAULT_COLLECTION
 
 class TaskResponse(BaseModel):
     task_id: str
@@ -10,15 +33,51 @@ class TaskResponse(BaseModel):
 class JobResponse(BaseModel):
     id: str
     url: str
+    kind: str = "scrape"
     status: str
-    created_at: str
-    finished_at: str | None
+    created_at: datetime
+    finished_at: datetime | None
     result: str | None
+    progress: dict[str, int] | None = None  # batch: child jobs by status, crawl: page counters
+
+class SourceResponse(BaseModel):
+    id: int
+    collection: str
+    url: str
+    status: str
+    chunk_count: int
+    bytes: int
+    last_ingested_at: datetime | None
+
+class CollectionRequest(BaseModel):
+    name: CollectionName
+
+class CollectionResponse(BaseModel):
+    name: str
+    created_at: datetime
+    sources: int
+    chunks: int
+    bytes: int
+
+class SearchOptions(BaseModel):
+    # Unset fields fall back to the RETRIEVAL_MODE / HYBRID_* / RERANK* settings.
+    collections: list[CollectionName] = Field(default=[DEFAULT_COLLECTION], min_length=1)  # searched together
+    mode: Literal["vector", "hybrid"] | None = None
+    top_k: int = Field(default=3, ge=1, le=50)
+    candidates: int | None = Field(default=None, ge=1, le=1000)  # per retriever, hybrid only
+    vector_weight: float | None = Field(default=None, ge=0)
+    text_weight: float | None = Field(default=None, ge=0)
+    rerank: bool | None = None
+    rerank_candidates: int | None = Field(default=None, ge=1, le=500)
 
-class ChatRequest(BaseModel):
+class ChatRequest(SearchOptions):
     query: str
+    include_timings: bool = False  # add per-stage durations to the response
+    cache: bool = True  # reuse or store the answer in the answer cache (ANSWER_CACHE)
+    priority: Literal["high", "normal", "low"] = "normal"  # admission lane, see app.admission
 
 class ChatResponse(BaseModel):
     answer: str
     trace: list[str]
     sources: list[str]
+    timings: dict[str, float] | None = None  # milliseconds per stage, with include_timings
@@ -4,6 +4,115 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     REDIS_URL: str
     API_URL: str = "http://web:8000"
+    EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    EMBEDDING_BACKEND: str = "torch"  # torch | onnx | onnx-int8
+    ONNX_MODEL_DIR: str = "models/onnx"  # written by `python -m app.manage export-onnx`
+    ONNX_THREADS: int = 0  # intra-op threads per ONNX Runtime session, 0 = all cores
+    OLLAMA_BASE_URL: str = "http://ollama:11434"
+    OLLAMA_MODEL: str = "llama3"
+    WARMUP_MODELS: bool = True  # load models at startup instead of on the first request
+
+    # Vector index (pgvector)
+    VECTOR_INDEX: str = "hnsw"  # hnsw | ivfflat | none
+    VECTOR_METRIC: str = "l2"  # l2 | cosine | ip
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 64
+    HNSW_EF_SEARCH: int = 40
+    IVFFLAT_LISTS: int = 100
+    IVFFLAT_PROBES: int = 10
+    VECTOR_STORAGE: str = "full"  # full | halfvec | binary (quantized index, exact re-scoring)
+    RESCORE_FACTOR: int = 4  # quantized modes shortlist limit * factor rows before re-scoring
+
+    # Retrieval
+    RETRIEVAL_MODE: str = "vector"  # vector | hybrid
+    TEXT_SEARCH_CONFIG: str = "english"
+    HYBRID_CANDIDATES: int = 20  # candidates fetched from each retriever before fusion
+    HYBRID_VECTOR_WEIGHT: float = 1.0
+    HYBRID_TEXT_WEIGHT: float = 1.0
+    RRF_K: int = 60
+    RERANK: bool = False  # rescore a wider candidate set with a cross-encoder
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 50
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_CACHE_SIZE: int = 50000  # cached (query, chunk id) scores
+
+    # Context assembly
+    CONTEXT_TOKEN_BUDGET: int = 2000  # estimated tokens of retrieved text per prompt, 0 = unlimited
+    CONTEXT_CHARS_PER_TOKEN: float = 4.0  # used to estimate tokens
+    CONTEXT_DEDUP_THRESHOLD: float = 0.8  # drop a passage when this share of its text is already in the context
+
+    # Self-correction
+    GRADER: str = "llm"  # llm | embedding | cross-encoder
+    GRADE_THRESHOLD: float | None = None  # rewrite below this grade, defaults to the grader's own threshold
+    CROSS_ENCODER_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    SPECULATIVE_REWRITE: bool = False  # rewrite + re-retrieve while the draft is generated
+
+    # /chat pipeline concurrency
+    EMBED_WORKERS: int = 4  # threads running CPU-bound query embedding
+    LLM_CONCURRENCY: int = 4  # in-flight Ollama calls per API process
+    SEARCH_CONCURRENCY: int = 16  # in-flight vector searches per API process
+    EMBED_MICROBATCH: bool = True  # batch concurrent query embeddings into one forward pass
+    EMBED_BATCH_MAX_SIZE: int = 32
+    EMBED_BATCH_MAX_WAIT_MS: float = 5.0
+
+    # /chat admission control
+    CHAT_MAX_ACTIVE: int = 4  # pipelines running at once per API process, about LLM_CONCURRENCY
+    CHAT_MAX_QUEUED: int = 32  # requests waiting for a slot; the low lane may fill half, normal three quarters
+    CHAT_MAX_QUEUE_WAIT: float = 30.0  # seconds; longer expected waits get 429, longer actual waits 503
+    CHAT_COALESCE: bool = True  # identical concurrent requests share one pipeline run
+
+    # Ingestion
+    EMBED_BATCH_SIZE: int = 64  # chunks per sentence-transformers forward pass
+    INSERT_BATCH_SIZE: int = 512  # rows per INSERT/commit
+    UPLOAD_DIR: str = "uploads"  # shared with the worker, files are removed once ingested
+    UPLOAD_MAX_BYTES: int = 200 * 1024 * 1024  # 0 = unlimited
+
+    # Ingestion pipeline (fetch -> parse -> embed -> write queues)
+    INGEST_SPOOL_DIR: str = "spool"  # fetched bodies, shared by fetch and parse workers
+    INGEST_MAX_DOCUMENTS: int = 100  # documents between fetch and write before fetching pauses
+    INGEST_MAX_QUEUED_CHUNKS: int = 4096  # chunks waiting for embedding before parsing pauses
+    INGEST_MAX_QUEUED_WRITES: int = 32  # write tasks waiting before embedding pauses
+    INGEST_EMBED_BATCH: int = 256  # chunks, from any documents, encoded by one embed task
+    INGEST_RETRY_DELAY: float = 5.0  # seconds a fetch or upload task waits for room in the pipeline
+    INGEST_STATE_TTL: int = 86400  # seconds a document's pipeline state is kept
+    INGEST_DOCUMENT_TIMEOUT: int = 3600  # seconds after which a document stops counting as in flight (its worker died)
+    INGEST_CLAIM_TIMEOUT: int = 600  # seconds an embed or write task may go silent before its chunks are requeued or its documents failed
+
+    # Query embedding cache
+    EMBED_CACHE_SIZE: int = 10000  # entries in the in-process LRU
+    EMBED_CACHE_TTL: int = 86400  # seconds, applies to both levels
+    EMBED_CACHE_REDIS: bool = True
+
+    # Answer cache
+    ANSWER_CACHE: bool = True  # reuse the answer of a semantically similar earlier query
+    ANSWER_CACHE_THRESHOLD: float = 0.95  # minimum cosine similarity of the query embeddings
+    ANSWER_CACHE_SIZE: int = 1000  # answers per API process
+    ANSWER_CACHE_TTL: int = 3600  # seconds, also bounds staleness from sources added since
+
+    # Fetching
+    FETCH_TIMEOUT: float = 10.0
+    FETCH_CONCURRENCY: int = 64  # connections per batch task
+    FETCH_PER_HOST: int = 4  # concurrent requests to a single host
+    FETCH_RETRIES: int = 3
+    FETCH_BACKOFF: float = 0.5  # seconds, doubled on every retry
+    FETCH_MAX_BACKOFF: float = 30.0  # seconds, also caps a server's Retry-After
+    BATCH_TASK_SIZE: int = 100  # URLs handled by one scrape_batch task
+
+    # Crawling
+    CRAWL_MAX_DEPTH: int = 2
+    CRAWL_MAX_PAGES: int = 500
+    CRAWL_CONCURRENCY: int = 8  # pages of one crawl in flight across all workers
+    CRAWL_HOST_DELAY: float = 1.0  # seconds between requests to one host (robots.txt Crawl-delay wins if larger)
+    CRAWL_RESPECT_ROBOTS: bool = True
+    CRAWL_TTL: int = 86400  # seconds crawl state is kept in Redis
+
+    # Job events
+    JOB_EVENTS_HEARTBEAT: float = 15.0  # seconds between /jobs/stream keep-alives
+    JOB_EVENTS_MAX_PENDING: int = 1000  # events queued for a slow /jobs/stream client before it is dropped
+
+    # Observability
+    SQL_ECHO: bool = False  # log every SQL statement
+    WORKER_METRICS_PORT: int = 9191  # Prometheus endpoint of the Celery worker, 0 disables
 
     class Config:
         env_file = ".env"
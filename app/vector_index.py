@@ -0,0 +1,203 @@
+import re
+from typing import Sequence
+
+from sqlalchemy import bindparam, cast, func, select, text
+from pgvector.sqlalchemy import BIT, HALFVEC, VECTOR
+from app.models import Document, EMBEDDING_DIM
+from app.settings import settings
+
+INDEX_NAME = "document_embedding_idx"
+
+# metric -> (operator class, comparator method)
+METRICS = {
+    "l2": ("vector_l2_ops", "l2_distance"),
+    "cosine": ("vector_cosine_ops", "cosine_distance"),
+    "ip": ("vector_ip_ops", "max_inner_product"),
+}
+
+INDEX_TYPES = ("hnsw", "ivfflat", "none")
+
+# full: index the float32 column as is.
+# halfvec: index a float16 cast of the column (half the index size).
+# binary: index the sign bits of the column (1/32 of the size), Hamming distance.
+# Quantized modes index an expression, so rows never need rewriting, and
+# the shortlist they return is re-scored against the float32 column.
+STORAGE_MODES = ("full", "halfvec", "binary")
+
+MAX_EF_SEARCH = 1000  # pgvector rejects a larger hnsw.ef_search
+# What pgvector builds with when an index has no WITH (...) for a parameter.
+PGVECTOR_DEFAULTS = {"m": 16, "ef_construction": 64, "lists": 100}
+
+# Lists of the ivfflat index found or built by this process (see
+# ensure_index), which may differ from IVFFLAT_LISTS until a reindex.
+_index_lists: int | None = None
+
+
+def _metric(metric: str | None = None) -> str:
+    metric = metric or settings.VECTOR_METRIC
+    if metric not in METRICS:
+        raise ValueError(f"Unknown VECTOR_METRIC '{metric}', expected one of {sorted(METRICS)}")
+    return metric
+
+
+def _index_type(index_type: str | None = None) -> str:
+    index_type = index_type or settings.VECTOR_INDEX
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown VECTOR_INDEX '{index_type}', expected one of {list(INDEX_TYPES)}")
+    return index_type
+
+
+def _storage(storage: str | None = None) -> str:
+    storage = storage or settings.VECTOR_STORAGE
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"Unknown VECTOR_STORAGE '{storage}', expected one of {list(STORAGE_MODES)}")
+    return storage
+
+
+def distance(column, vector, metric: str | None = None):
+    # The ORDER BY expression must use the same operator as the index opclass,
+    # otherwise Postgres falls back to a sequential scan.
+    _, method = METRICS[_metric(metric)]
+    return getattr(column, method)(vector)
+
+
+def coarse_distance(vector, storage: str | None = None, metric: str | None = None):
+    # Must match the indexed expression in index_ddl exactly.
+    storage = _storage(storage)
+    query = bindparam(None, vector, type_=VECTOR(EMBEDDING_DIM))
+    if storage == "halfvec":
+        _, method = METRICS[_metric(metric)]
+        column = cast(Document.embedding, HALFVEC(EMBEDDING_DIM))
+        return getattr(column, method)(cast(query, HALFVEC(EMBEDDING_DIM)))
+    if storage == "binary":
+        column = cast(func.binary_quantize(Document.embedding), BIT(EMBEDDING_DIM))
+        return column.hamming_distance(cast(func.binary_quantize(query), BIT(EMBEDDING_DIM)))
+    return distance(Document.embedding, vector, metric)
+
+
+def in_collections(collections: Sequence[str] | None):
+    # Lets the planner prune the scan to those collections' partitions.
+    return [Document.collection.in_(collections)] if collections else []
+
+
+def nearest(vector, limit: int, *entities, storage: str | None = None, collections: Sequence[str] | None = None):
+    # SELECT entities ORDER BY distance LIMIT limit, through the configured
+    # index of each partition searched (all of them without collections).
+    storage = _storage(storage)
+    exact = distance(Document.embedding, vector)
+    where = in_collections(collections)
+    if storage == "full":
+        return select(*entities).where(*where).order_by(exact).limit(limit)
+    shortlist = (
+        select(Document.id)
+        .where(*where)
+        .order_by(coarse_distance(vector, storage))
+        .limit(candidate_count(limit, storage))
+    )
+    return select(*entities).where(*where, Document.id.in_(shortlist)).order_by(exact).limit(limit)
+
+
+def _indexed_expression(storage: str, metric: str) -> str:
+    opclass, _ = METRICS[metric]
+    if storage == "halfvec":
+        return f"((embedding::halfvec({EMBEDDING_DIM})) {opclass.replace('vector_', 'halfvec_')})"
+    if storage == "binary":
+        return f"((binary_quantize(embedding)::bit({EMBEDDING_DIM})) bit_hamming_ops)"
+    return f"(embedding {opclass})"
+
+
+def index_ddl(index_type: str | None = None, metric: str | None = None, storage: str | None = None) -> str | None:
+    index_type = _index_type(index_type)
+    if index_type == "none":
+        return None
+    expression = _indexed_expression(_storage(storage), _metric(metric))
+    params = ", ".join(f"{name} = {value}" for name, value in _build_params(index_type).items())
+    return (
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON document "
+        f"USING {index_type} {expression} WITH ({params})"
+    )
+
+
+async def current_index_def(conn) -> str | None:
+    result = await conn.execute(
+        text("SELECT indexdef FROM pg_indexes WHERE tablename = 'document' AND indexname = :name"),
+        {"name": INDEX_NAME},
+    )
+    return result.scalar()
+
+
+def _build_params(index_type: str) -> dict[str, int]:
+    if index_type == "hnsw":
+        return {"m": settings.HNSW_M, "ef_construction": settings.HNSW_EF_CONSTRUCTION}
+    return {"lists": settings.IVFFLAT_LISTS}
+
+
+def index_params(indexdef: str) -> dict[str, int]:
+    # The WITH (...) of an index definition; pg_indexes quotes the values: WITH (m='16', ef_construction='64').
+    match = re.search(r"\bwith \(([^)]*)\)", indexdef, re.IGNORECASE)
+    params = {}
+    for item in match.group(1).split(",") if match else []:
+        name, _, value = item.partition("=")
+        params[name.strip().lower()] = int(value.strip().strip("'"))
+    return params
+
+
+def _matches_settings(indexdef: str) -> bool:
+    index_type = _index_type()
+    expression = _indexed_expression(_storage(), _metric())
+    opclass = expression.rstrip(")").split()[-1]
+    built = index_params(indexdef)
+    params_match = all(built.get(name, PGVECTOR_DEFAULTS[name]) == value for name, value in _build_params(index_type).items())
+    indexdef = indexdef.lower()
+    return f"using {index_type}" in indexdef and f"{opclass})" in indexdef and params_match
+
+
+def _remember_lists(indexdef: str | None):
+    global _index_lists
+    if indexdef is not None and "using ivfflat" in indexdef.lower():
+        _index_lists = index_params(indexdef).get("lists", PGVECTOR_DEFAULTS["lists"])
+    else:
+        _index_lists = None
+
+
+async def ensure_index(conn):
+    ddl = index_ddl()
+    existing = await current_index_def(conn)
+    if ddl is None:
+        return
+    if existing is None:
+        print(f"Creating vector index {INDEX_NAME} ({settings.VECTOR_INDEX}, {settings.VECTOR_METRIC}, {settings.VECTOR_STORAGE})...")
+        await conn.execute(text(ddl))
+        existing = ddl
+    elif not _matches_settings(existing):
+        # Rebuilding can take a long time on a large corpus, so never do it implicitly at startup.
+        print(f"Vector index {INDEX_NAME} does not match settings, run `python -m app.manage reindex`: {existing}")
+    _remember_lists(existing)
+
+
+async def rebuild_index(conn):
+    await conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+    ddl = index_ddl()
+    if ddl is not None:
+        await conn.execute(text(ddl))
+    _remember_lists(ddl)
+
+
+def candidate_count(limit: int, storage: str | None = None) -> int:
+    # Rows the index scan has to return for a query with this LIMIT.
+    return limit if _storage(storage) == "full" else limit * settings.RESCORE_FACTOR
+
+
+async def apply_search_params(session, ef_search: int | None = None, probes: int | None = None, limit: int = 0):
+    # SET LOCAL only lasts until the end of the current transaction.
+    index_type = _index_type()
+    if index_type == "hnsw":
+        # An HNSW scan returns at most ef_search rows, so never go below the
+        # LIMIT, up to what pgvector accepts; larger shortlists are cut there.
+        value = min(max(int(ef_search or settings.HNSW_EF_SEARCH), candidate_count(limit)), MAX_EF_SEARCH)
+        await session.execute(text(f"SET LOCAL hnsw.ef_search = {value}"))
+    elif index_type == "ivfflat":
+        # Probing more lists than the index was built with is an error.
+        lists = _index_lists or settings.IVFFLAT_LISTS
+        value = max(1, min(int(probes or settings.IVFFLAT_PROBES), lists))
+        await session.execute(text(f"SET LOCAL ivfflat.probes = {value}"))
@@ -1,89 +1,633 @@
-from celery import Celery
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import hashlib
+import os
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urljoin
+from dataclasses import asdict, dataclass
+from celery.signals import celeryd_init, worker_ready, worker_process_init, worker_process_shutdown
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert, select, update, delete, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 from app.settings import settings
 from datetime import datetime
-from app.models import Document, Job
+from app.models import DEFAULT_COLLECTION, Document, Job, Source
+from app.fetcher import http, fetch_all, host_of
+from app import crawler, events, extract, pipeline, providers
+from app.celery_app import celery_app
+from app import metrics
+from app.metrics import INGEST_CHUNKS, INGEST_PAGES, INGEST_STAGE_SECONDS, StageTimer, span
 
 # ... (imports)
 
-celery_app = Celery(
-    "worker",
-    broker=settings.REDIS_URL,
-    backend=settings.REDIS_URL
-)
+@celeryd_init.connect
+def reset_metrics(**kwargs):
+    # Runs in the main process before the pool forks.
+    metrics.reset_multiproc_dir()
 
-# Initialize embeddings model globally (loads on worker start)
-embeddings_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+@worker_ready.connect
+def start_metrics_server(**kwargs):
+    if settings.WORKER_METRICS_PORT:
+        metrics.start_server(settings.WORKER_METRICS_PORT)
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    metrics.mark_process_dead(pid)
+
+@worker_process_init.connect
+def warm_up_models(**kwargs):
+    # Each pool process loads the embedding model before its first task
+    # instead of during it; torch is not fork-safe, so not in the parent.
+    if settings.WARMUP_MODELS:
+        providers.warm_up(["embeddings"])
 
 # Sync engine for worker (Celery task is blocking anyway)
 sync_db_url = settings.DATABASE_URL.replace("postgresql+asyncpg", "postgresql")
 engine = create_engine(sync_db_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-@celery_app.task(bind=True)
-def scrape_url(self, url: str):
+@dataclass
+class IngestResult:
+    added: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    not_modified: bool = False
+
+    def summary(self) -> str:
+        if self.not_modified:
+            return "Not modified"
+        return f"Ingested {self.added} new chunks, {self.unchanged} unchanged, {self.removed} removed"
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def get_or_create_source(session, url: str, collection: str = DEFAULT_COLLECTION) -> Source:
+    session.execute(
+        pg_insert(Source)
+        .values(url=url, collection=collection, status="PENDING", chunk_count=0, bytes=0)
+        .on_conflict_do_nothing(index_elements=[Source.collection, Source.url])
+    )
+    session.commit()
+    return session.execute(select(Source).where(Source.collection == collection, Source.url == url)).scalar_one()
+
+def update_source_stats(session, source: Source, chunks: int, size: int, **values):
+    # Stats are adjusted in the same transaction as the rows they count.
+    session.execute(
+        update(Source).where(Source.id == source.id).values(
+            chunk_count=Source.chunk_count + chunks,
+            bytes=Source.bytes + size,
+            **values,
+        )
+    )
+
+@dataclass
+class Chunk:
+    text: str
+    ordinal: int | None = None  # position in the page's chunk sequence
+    start: int | None = None  # character offsets in the extracted text
+    end: int | None = None
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def write_chunks(session, chunks: list[Chunk], vectors: list[list[float]], source: Source):
+    # One multi-row INSERT plus the matching stats update, committed together.
+    with span(INGEST_STAGE_SECONDS, "write"):
+        session.execute(
+            insert(Document),
+            [
+                {
+                    "content": chunk.text,
+                    "content_hash": content_hash(chunk.text),
+                    "embedding": vector,
+                    "source": source.url,
+                    "source_id": source.id,
+                    "collection": source.collection,
+                    "ordinal": chunk.ordinal,
+                    "start_offset": chunk.start,
+                    "end_offset": chunk.end,
+                }
+                for chunk, vector in zip(chunks, vectors)
+            ],
+        )
+        update_source_stats(session, source, len(chunks), sum(len(chunk.text.encode("utf-8")) for chunk in chunks))
+        session.commit()
+
+def diff_chunks(session, source: Source, batch: list[Chunk], seen: set) -> tuple[list[Chunk], int]:
+    # The chunks of a batch whose hash is not stored yet, and how many are.
+    # seen collects the hashes of the document so far, a repeated chunk is
+    # kept once. Unchanged chunks move when text before them changes.
+    by_hash = {}
+    for chunk in batch:
+        h = content_hash(chunk.text)
+        if h not in seen:
+            by_hash.setdefault(h, chunk)
+    seen.update(by_hash)
+    existing = {
+        row.content_hash: row
+        for row in session.execute(
+            select(Document.id, Document.content_hash, Document.ordinal, Document.start_offset)
+            .where(
+                Document.collection == source.collection,
+                Document.source_id == source.id,
+                Document.content_hash.in_(list(by_hash)),
+            )
+        )
+    }
+    with span(INGEST_STAGE_SECONDS, "write"):
+        moved = [
+            {
+                "id": existing[h].id, "collection": source.collection,
+                "ordinal": chunk.ordinal, "start_offset": chunk.start, "end_offset": chunk.end,
+            }
+            for h, chunk in by_hash.items()
+            if h in existing and (existing[h].ordinal, existing[h].start_offset) != (chunk.ordinal, chunk.start)
+        ]
+        if moved:
+            session.execute(update(Document), moved)
+            session.commit()
+    return [chunk for h, chunk in by_hash.items() if h not in existing], len(existing)
+
+def remove_stale_chunks(session, source: Source, seen: Iterable[str]) -> list[int]:
+    # Deletes stored chunks that are no longer in the document and marks the
+    # source ingested. Returns the ids of the deleted chunks.
+    with span(INGEST_STAGE_SECONDS, "write"):
+        removed = session.execute(
+            delete(Document).where(
+                Document.collection == source.collection,
+                Document.source_id == source.id,
+                or_(Document.content_hash.is_(None), Document.content_hash.not_in(list(seen))),
+            ).returning(Document.id, func.octet_length(Document.content))
+        ).all()
+        update_source_stats(
+            session, source, -len(removed), -sum(size for _, size in removed),
+            status="ACTIVE", last_ingested_at=datetime.utcnow(),
+        )
+        session.commit()
+    return [chunk_id for chunk_id, _ in removed]
+
+def conditional_headers(session, url: str, collection: str = DEFAULT_COLLECTION) -> dict:
+    source = session.execute(
+        select(Source).where(Source.collection == collection, Source.url == url)
+    ).scalar_one_or_none()
+    headers = {}
+    if source and source.etag:
+        headers["If-None-Match"] = source.etag
+    if source and source.last_modified:
+        headers["If-Modified-Since"] = source.last_modified
+    return headers
+
+def save_validators(session, source: Source, response_headers):
+    session.execute(
+        update(Source).where(Source.id == source.id).values(
+            etag=response_headers.get("ETag"),
+            last_modified=response_headers.get("Last-Modified"),
+            last_fetched_at=datetime.utcnow(),
+        )
+    )
+    session.commit()
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+SPLIT_WINDOW = 16 * CHUNK_SIZE  # characters of text held while chunking
+
+def stream_chunks(pieces: Iterable[str]) -> Iterator[Chunk]:
+    # Chunks a text that arrives in pieces while holding at most one window
+    # of it: the window is split, all but its last chunk are emitted, and the
+    # next window starts at that chunk. Windows are cut at fixed text
+    # positions, so the chunks (and their hashes) do not depend on how the
+    # text arrived.
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    buffer, offset, ordinal = "", 0, 0
+
+    def split(text: str):
+        return [(doc.metadata["start_index"], doc.page_content) for doc in text_splitter.create_documents([text])]
+
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= SPLIT_WINDOW:
+            docs = split(buffer[:SPLIT_WINDOW])
+            # Mostly whitespace, nothing to carry over.
+            resume = docs.pop()[0] if len(docs) > 1 else SPLIT_WINDOW
+            for start, text in docs:
+                yield Chunk(text, ordinal, offset + start, offset + start + len(text))
+                ordinal += 1
+            buffer, offset = buffer[resume:], offset + resume
+    for start, text in split(buffer) if buffer else []:
+        yield Chunk(text, ordinal, offset + start, offset + start + len(text))
+        ordinal += 1
+
+def mark_source(session, source: Source, status: str):
+    session.execute(update(Source).where(Source.id == source.id).values(status=status))
+    session.commit()
+
+def set_job_status(session, job_id: str, status: str, result: str | None = None):
+    job = session.get(Job, job_id)
+    event = None
+    if job:
+        job.status = status
+        if status in ("COMPLETED", "FAILED"):
+            job.finished_at = datetime.utcnow()
+        if result is not None:
+            job.result = result
+        event = events.job_event(job)
+    session.commit()
+    if event:
+        events.publish("job", event)
+
+def update_batch_progress(session, batch_id: str):
+    counts = dict(session.execute(
+        select(Job.status, func.count()).where(Job.parent_id == batch_id).group_by(Job.status)
+    ).all())
+    total = sum(counts.values())
+    finished = counts.get("COMPLETED", 0) + counts.get("FAILED", 0)
+    status = "COMPLETED" if finished == total else "PROCESSING"
+    set_job_status(
+        session, batch_id, status,
+        f"{finished}/{total} done, {counts.get('FAILED', 0)} failed",
+    )
+
+def dispatch_crawl(crawl_id: str):
+    for url, depth in crawler.take(crawl_id):
+        crawl_page.delay(crawl_id, url, depth)
+
+def finish_crawl_page(crawl_id: str, ok: bool):
+    last = crawler.finish_page(crawl_id, ok)
+    progress = crawler.progress(crawl_id)
+    summary = f"{progress['done']} pages ingested, {progress['failed']} failed, {progress['frontier'] + progress['inflight']} pending"
+    with SessionLocal() as session:
+        set_job_status(session, crawl_id, "COMPLETED" if last else "PROCESSING", summary)
+    if not last:
+        dispatch_crawl(crawl_id)
+
+# A document moves through the stages as a dict (see app.pipeline): url,
+# collection, source_id, path, kind and encoding of the spooled body, the
+# HTTP validators to save at the end, and what it was ingested for: job_id
+# (scrape, upload, batch child), batch_id, crawl_id with depth and follow.
+
+def report(doc: dict, stage: str, **data):
+    # Crawl pages have no job of their own to report progress on.
+    if doc.get("job_id"):
+        events.progress(doc["job_id"], stage, **data)
+
+def complete_document(doc: dict, ok: bool, summary: str):
+    print(f"{'Ingested' if ok else 'Failed'} {doc['url']}: {summary}")
+    with SessionLocal() as session:
+        if doc.get("job_id"):
+            set_job_status(session, doc["job_id"], "COMPLETED" if ok else "FAILED", summary)
+        if doc.get("batch_id"):
+            update_batch_progress(session, doc["batch_id"])
+    if doc.get("crawl_id"):
+        finish_crawl_page(doc["crawl_id"], ok)
+
+def fetch_failed(doc: dict, error: Exception):
+    # The document never entered the pipeline.
+    INGEST_PAGES.labels("failed").inc()
+    complete_document(doc, False, str(error))
+
+def fail_document(doc_id: str, doc: dict, error: Exception):
+    # Tasks of the document still queued find no state and do nothing.
+    pipeline.finish(doc_id)
+    INGEST_PAGES.labels("failed").inc()
+    with SessionLocal() as session:
+        session.execute(update(Source).where(Source.id == doc["source_id"]).values(status="FAILED"))
+        session.commit()
+    complete_document(doc, False, str(error))
+
+def spool_body(blocks: Iterable[bytes]) -> str:
+    path = pipeline.spool_path()
+    try:
+        with open(path, "wb") as f:
+            for block in blocks:
+                f.write(block)
+    except Exception:
+        pipeline.discard(path)
+        raise
+    return path
+
+def start_document(session, doc: dict, response, blocks: Iterable[bytes] | None = None, path: str | None = None):
+    # End of the fetch stage: the body, read from blocks or already spooled
+    # at path, is queued for parsing. A 304 completes the document right away.
+    report(
+        doc, "fetched", status_code=response.status_code,
+        content_type=response.headers.get("Content-Type"), bytes=response.headers.get("Content-Length"),
+    )
+    source = get_or_create_source(session, doc["url"], doc["collection"])
+    if response.status_code == 304:
+        session.execute(update(Source).where(Source.id == source.id).values(last_fetched_at=datetime.utcnow()))
+        session.commit()
+        INGEST_PAGES.labels("not_modified").inc()
+        complete_document(doc, True, IngestResult(not_modified=True).summary())
+        return
+    if path is None:
+        path = spool_body(blocks)
+    content_type = response.headers.get("Content-Type", "")
+    doc.update(
+        source_id=source.id, path=path,
+        kind=extract.kind_for_content_type(content_type), encoding=extract.charset_of(content_type),
+        validators={name: response.headers.get(name) for name in ("ETag", "Last-Modified")},
+    )
+    mark_source(session, source, "INGESTING")
+    parse_document.delay(pipeline.start(doc))
+
+def finish_document(doc_id: str):
+    # Runs once every chunk of the document is written.
+    doc = pipeline.context(doc_id)
+    counts = pipeline.counts(doc_id)
+    try:
+        with SessionLocal() as session:
+            source = session.get(Source, doc["source_id"])
+            removed = remove_stale_chunks(session, source, pipeline.seen(doc_id))
+            if doc.get("validators"):
+                # Saved only once the content is stored, so a failed
+                # ingestion is never skipped as "not modified" on the next run.
+                save_validators(session, source, doc["validators"])
+    except Exception as e:
+        fail_document(doc_id, doc, e)
+        return
+    pipeline.finish(doc_id)
+    if counts["added"] or removed:
+        # Cached answers built from this source's chunks are now stale.
+        event = events.source_event(doc["source_id"], doc["collection"], counts["added"], removed)
+        events.publish("source", event, events.SOURCES_CHANNEL)
+    result = IngestResult(added=counts["added"], unchanged=counts["unchanged"], removed=len(removed))
+    INGEST_PAGES.labels("ingested").inc()
+    INGEST_CHUNKS.labels("added").inc(result.added)
+    INGEST_CHUNKS.labels("unchanged").inc(result.unchanged)
+    INGEST_CHUNKS.labels("removed").inc(result.removed)
+    report(doc, "written", chunks=counts["chunks"], added=result.added, unchanged=result.unchanged, removed=result.removed)
+    complete_document(doc, True, result.summary())
+
+@celery_app.task(bind=True, max_retries=None)
+def scrape_url(self, url: str, collection: str = DEFAULT_COLLECTION):
     job_id = self.request.id
+    if not pipeline.has_room():
+        # The job stays PENDING until the pipeline has room.
+        reap_claims()
+        raise self.retry(countdown=settings.INGEST_RETRY_DELAY)
     print(f"Processing job {job_id} for {url}...")
-    
+    doc = {"job_id": job_id, "url": url, "collection": collection}
+
     with SessionLocal() as session:
-        job = session.get(Job, job_id)
-        if job:
-            job.status = "PROCESSING"
-            session.commit()
-    
+        set_job_status(session, job_id, "PROCESSING")
+
+    timer = StageTimer(INGEST_STAGE_SECONDS)
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.extract()
-            
-        text = soup.get_text()
-        
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        clean_text = '\n'.join(chunk for chunk in chunks if chunk)
-        
-        # Chunking
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        docs = text_splitter.create_documents([clean_text])
-        
-        print(f"Split into {len(docs)} chunks. Embedding and storing...")
-        
         with SessionLocal() as session:
-            for doc in docs:
-                embedding = embeddings_model.embed_query(doc.page_content)
-                db_doc = Document(content=doc.page_content, embedding=embedding, source=url)
-                session.add(db_doc)
-            
-            # Update job success
-            job = session.get(Job, job_id)
-            if job:
-                job.status = "COMPLETED"
-                job.finished_at = datetime.utcnow().isoformat()
-                job.result = f"Ingested {len(docs)} chunks"
-                
-            session.commit()
-            
-        print(f"Ingestion complete for {url}.")
-        return f"Ingested {len(docs)} chunks."
-        
+            headers = conditional_headers(session, url, collection)
+            with timer.stage("fetch"):
+                response = http.get(url, headers=headers, timeout=settings.FETCH_TIMEOUT, stream=True)
+            with response:
+                response.raise_for_status()
+                start_document(session, doc, response, timer.wrap("fetch", response.iter_content(extract.READ_SIZE)))
+        return f"Fetched {url}"
     except Exception as e:
         print(f"Error scraping {url}: {e}")
+        fetch_failed(doc, e)
+        return f"Error: {e}"
+    finally:
+        timer.observe()
+
+@celery_app.task(bind=True, max_retries=None)
+def ingest_file(self, job_id: str, path: str, url: str, kind: str, collection: str = DEFAULT_COLLECTION):
+    # An upload saved to UPLOAD_DIR by the API. It is already on disk, so it
+    # enters the pipeline at the parse stage (this task runs on its queue).
+    if not pipeline.has_room():
+        # Like a fetch, the job stays PENDING until the pipeline has room.
+        reap_claims()
+        raise self.retry(countdown=settings.INGEST_RETRY_DELAY)
+    print(f"Processing upload {job_id} ({url})...")
+    doc = {"job_id": job_id, "url": url, "collection": collection, "path": path, "kind": kind, "encoding": None}
+    try:
         with SessionLocal() as session:
-            job = session.get(Job, job_id)
-            if job:
-                job.status = "FAILED"
-                job.finished_at = datetime.utcnow().isoformat()
-                job.result = str(e)
-            session.commit()
+            set_job_status(session, job_id, "PROCESSING")
+            source = get_or_create_source(session, url, collection)
+            mark_source(session, source, "INGESTING")
+            doc["source_id"] = source.id
+    except Exception as e:
+        print(f"Error ingesting {url}: {e}")
+        os.remove(path)
+        fetch_failed(doc, e)
+        return f"Error: {e}"
+    parse_document(pipeline.start(doc))
+    return f"Parsed {url}"
+
+@celery_app.task
+def parse_document(doc_id: str):
+    # Extracts and chunks the spooled body batch by batch, so memory does not
+    # grow with the document. Only chunks whose hash is not stored yet are
+    # queued for embedding; the spooled file is removed once read.
+    doc = pipeline.context(doc_id)
+    if doc is None:
+        return
+    timer = StageTimer(INGEST_STAGE_SECONDS)
+    links = [] if doc.get("follow") else None
+    seen = set()
+    total = 0
+    try:
+        text = extract.file_text(doc["path"], doc["kind"], doc["encoding"], links)
+        chunks = timer.wrap("chunk", stream_chunks(timer.wrap("parse", text)))
+        with SessionLocal() as session:
+            source = session.get(Source, doc["source_id"])
+            for batch in batched(chunks, settings.INSERT_BATCH_SIZE):
+                # The total is unknown until the document is read to the end.
+                total += len(batch)
+                report(doc, "chunked", chunks=total)
+                new, unchanged = diff_chunks(session, source, batch, seen)
+                pipeline.count(doc_id, chunks=len(batch), unchanged=unchanged)
+                if new:
+                    # Backpressure: parsing pauses while the embed stage is behind.
+                    with timer.stage("wait"):
+                        pipeline.wait_for_room(pipeline.queued_chunks, settings.INGEST_MAX_QUEUED_CHUNKS)
+                    pipeline.queue_chunks(doc_id, [asdict(chunk) for chunk in new])
+                    embed_chunks.delay()
+        pipeline.add_seen(doc_id, list(seen))
+        if links:
+            crawler.enqueue(doc["crawl_id"], crawler.resolve_links(links, doc["base_url"]), doc["depth"] + 1)
+    except Exception as e:
+        print(f"Error parsing {doc['url']}: {e}")
+        fail_document(doc_id, doc, e)
+        return
+    finally:
+        timer.observe()
+        if os.path.exists(doc["path"]):
+            os.remove(doc["path"])
+    if pipeline.release(doc_id, 1):
+        finish_document(doc_id)
+
+@celery_app.task
+def embed_chunks():
+    # Encodes queued chunks of any documents together, so small documents
+    # still fill a batch, then hands each document's share to the write stage.
+    reap_claims()
+    claim, items = pipeline.take_chunks(settings.INGEST_EMBED_BATCH)
+    if not items:
+        return
+    if pipeline.queued_chunks():
+        embed_chunks.delay()
+    try:
+        with span(INGEST_STAGE_SECONDS, "embed"), pipeline.keep_claim(claim):
+            vectors = providers.get_embeddings().embed_documents([item["text"] for item in items])
+    except Exception as e:
+        print(f"Error embedding {len(items)} chunks: {e}")
+        for doc_id in {item["doc"] for item in items}:
+            doc = pipeline.context(doc_id)
+            if doc is not None:
+                fail_document(doc_id, doc, e)
+        pipeline.drop_claim(claim)
+        return
+
+    by_doc = {}
+    for item, vector in zip(items, vectors):
+        by_doc.setdefault(item.pop("doc"), []).append((item, vector))
+    pipeline.hand_off(claim, list(by_doc))
+    # Backpressure: embedding pauses while the write stage is behind.
+    with span(INGEST_STAGE_SECONDS, "wait"):
+        pipeline.wait_for_room(
+            lambda: pipeline.queued_tasks("write"), settings.INGEST_MAX_QUEUED_WRITES, heartbeat=lambda: pipeline.touch(claim)
+        )
+    for doc_id, rows in by_doc.items():
+        write_batch.delay(doc_id, [chunk for chunk, _ in rows], pipeline.pack([vector for _, vector in rows]), claim)
+
+@celery_app.task
+def write_batch(doc_id: str, chunks: list[dict], vectors: str, claim: Optional[str] = None):
+    # claim: the embed task's claim on the chunks, acknowledged once they are
+    # written or the document failed.
+    if claim is not None:
+        pipeline.touch(claim)
+    try:
+        write_document_chunks(doc_id, chunks, vectors)
+    finally:
+        if claim is not None:
+            pipeline.ack(claim, doc_id)
+
+def write_document_chunks(doc_id: str, chunks: list[dict], vectors: str):
+    doc = pipeline.context(doc_id)
+    if doc is None:
+        return
+    try:
+        with SessionLocal() as session:
+            source = session.get(Source, doc["source_id"])
+            write_chunks(session, [Chunk(**chunk) for chunk in chunks], pipeline.unpack(vectors, len(chunks)), source)
+    except Exception as e:
+        print(f"Error writing {doc['url']}: {e}")
+        fail_document(doc_id, doc, e)
+        return
+    pipeline.count(doc_id, added=len(chunks))
+    counts = pipeline.counts(doc_id)
+    report(doc, "embedded", chunks=counts["chunks"], embedded=counts["added"], unchanged=counts["unchanged"])
+    if pipeline.release(doc_id, len(chunks)):
+        finish_document(doc_id)
+
+def reap_claims():
+    # Claims of embed or write tasks whose worker died (see pipeline.reclaim).
+    for claim in pipeline.stale_claims():
+        requeued, doc_ids = pipeline.reclaim(claim)
+        if requeued:
+            print(f"Requeued {requeued} chunks of a lost embed task")
+            embed_chunks.delay()
+        for doc_id in doc_ids:
+            doc = pipeline.context(doc_id)
+            if doc is not None:
+                fail_document(doc_id, doc, RuntimeError("The worker writing its chunks was lost"))
+
+@celery_app.task(bind=True)
+def scrape_batch(self, batch_id: str, items: list[tuple[str, str]], collection: str = DEFAULT_COLLECTION):
+    # items: (child job id, url). The whole slice is fetched concurrently on
+    # one pooled async client, each body streamed to the spool directory,
+    # then each page is handed to the parse stage.
+    job_ids = [job_id for job_id, _ in items]
+    with SessionLocal() as session:
+        session.execute(update(Job).where(Job.id.in_(job_ids)).values(status="PROCESSING"))
+        set_job_status(session, batch_id, "PROCESSING")
+
+    # Backpressure: the slice is fetched once the pipeline has room.
+    with span(INGEST_STAGE_SECONDS, "wait"):
+        pipeline.wait_for_room(pipeline.in_flight, settings.INGEST_MAX_DOCUMENTS, heartbeat=reap_claims)
+    with SessionLocal() as session:
+        headers = {url: conditional_headers(session, url, collection) for _, url in items}
+    responses = asyncio.run(fetch_all((url for _, url in items), pipeline.spool_path, headers))
+
+    fetched = 0
+    with SessionLocal() as session:
+        for job_id, url in items:
+            doc = {"job_id": job_id, "batch_id": batch_id, "url": url, "collection": collection}
+            response = responses[url]
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                start_document(session, doc, response, path=response.path)
+                fetched += 1
+            except Exception as e:
+                print(f"Error scraping {url}: {e}")
+                if not isinstance(response, Exception):
+                    pipeline.discard(response.path)
+                session.rollback()
+                fetch_failed(doc, e)
+
+    return f"Fetched {fetched}/{len(items)} URLs."
+
+@celery_app.task(bind=True)
+def start_crawl(
+    self, crawl_id: str, url: str, max_depth: int, max_pages: int,
+    sitemap: bool = False, collection: str = DEFAULT_COLLECTION,
+):
+    with SessionLocal() as session:
+        set_job_status(session, crawl_id, "PROCESSING")
+    try:
+        crawler.init(crawl_id, host_of(url), max_depth, max_pages, collection)
+        if sitemap:
+            sitemap_url = url if url.endswith(".xml") else urljoin(url, "/sitemap.xml")
+            seeds = [crawler.normalize_url(page) for page in crawler.sitemap_urls(sitemap_url)]
+        else:
+            seeds = [crawler.normalize_url(url)]
+        queued = crawler.enqueue(crawl_id, seeds, 0)
+        if queued == 0:
+            raise ValueError("No crawlable URLs found")
+        dispatch_crawl(crawl_id)
+        return f"Queued {queued} seed URLs."
+    except Exception as e:
+        print(f"Error starting crawl {crawl_id}: {e}")
+        with SessionLocal() as session:
+            set_job_status(session, crawl_id, "FAILED", str(e))
         return f"Error: {e}"
+
+@celery_app.task(bind=True, max_retries=None)
+def crawl_page(self, crawl_id: str, url: str, depth: int):
+    if not pipeline.has_room():
+        raise self.retry(countdown=settings.INGEST_RETRY_DELAY)
+    allowed = crawler.allowed(url)
+    if allowed:
+        wait = crawler.acquire_host_slot(url)
+        if wait is not None:
+            # Another worker hit this host recently; come back when the slot frees up.
+            raise self.retry(countdown=wait)
+
+    # The page is finished for the crawl when its document is (complete_document).
+    doc = {"crawl_id": crawl_id, "depth": depth, "url": url}
+    timer = StageTimer(INGEST_STAGE_SECONDS)
+    try:
+        if not allowed:
+            raise PermissionError("Disallowed by robots.txt")
+        conf = crawler.config(crawl_id)
+        doc["collection"] = conf["collection"]
+        doc["follow"] = depth < conf["max_depth"]
+        with SessionLocal() as session:
+            # A 304 has no body to take links from, so conditional requests
+            # are only used for leaf pages.
+            headers = {} if doc["follow"] else conditional_headers(session, url, conf["collection"])
+            with timer.stage("fetch"):
+                response = http.get(url, headers=headers, timeout=settings.FETCH_TIMEOUT, stream=True)
+            with response:
+                response.raise_for_status()
+                # Links are collected by the parse stage and resolved against the final URL.
+                doc["base_url"] = response.url
+                start_document(session, doc, response, timer.wrap("fetch", response.iter_content(extract.READ_SIZE)))
+    except Exception as e:
+        print(f"Error crawling {url}: {e}")
+        fetch_failed(doc, e)
+    finally:
+        timer.observe()
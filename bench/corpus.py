@@ -0,0 +1,185 @@
+import hashlib
+import io
+import struct
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from app import vector_index
+from app.models import DEFAULT_COLLECTION, EMBEDDING_DIM
+from app.settings import settings
+
+# Synthetic corpus: chunks belong to one of TOPICS clusters. A chunk's vector
+# is its topic centre plus noise, and its text is drawn mostly from the
+# topic's own words, so both vector and full-text search have structure.
+# Everything is derived from the seed, so two runs load identical data.
+
+TOPICS = 256
+TOPIC_WORDS = 64
+VOCAB_SIZE = 20000
+NOISE = 0.8  # expected norm of the noise added to a unit topic centre
+TOPIC_SHARE = 0.7  # fraction of a chunk's words taken from its topic
+SHARD_SIZE = 50000  # rows generated and copied at a time
+
+SYLLABLES = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+# collection routes each row to its partition of document.
+COPY_COLUMNS = ("collection", "content", "source", "source_id", "content_hash", "embedding")
+
+
+@dataclass
+class TopicModel:
+    vocab: np.ndarray  # VOCAB_SIZE words
+    centers: np.ndarray  # TOPICS x EMBEDDING_DIM, unit length
+    words: np.ndarray  # TOPICS x TOPIC_WORDS vocab indices
+
+
+@lru_cache(maxsize=None)
+def topic_model(seed: int) -> TopicModel:
+    rng = np.random.default_rng([seed, 3])
+    vocab = {}
+    while len(vocab) < VOCAB_SIZE:
+        word = "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        vocab.setdefault(word, None)
+    centers = rng.standard_normal((TOPICS, EMBEDDING_DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    words = rng.integers(VOCAB_SIZE, size=(TOPICS, TOPIC_WORDS))
+    return TopicModel(np.array(list(vocab)), centers, words)
+
+
+def _sample(rng: np.random.Generator, model: TopicModel, count: int, words: int):
+    topics = rng.integers(TOPICS, size=count)
+    noise = rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32) * (NOISE / np.sqrt(EMBEDDING_DIM))
+    vectors = model.centers[topics] + noise
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    own = model.words[topics[:, None], rng.integers(TOPIC_WORDS, size=(count, words))]
+    common = rng.integers(VOCAB_SIZE, size=(count, words))
+    ids = np.where(rng.random((count, words)) < TOPIC_SHARE, own, common)
+    texts = [" ".join(row) for row in model.vocab[ids]]
+    return texts, vectors
+
+
+def shard(seed: int, index: int, count: int, words: int = 150):
+    # Shard `index` of the corpus, independent of every other shard.
+    return _sample(np.random.default_rng([seed, 0, index]), topic_model(seed), count, words)
+
+
+def queries(seed: int, count: int, words: int = 8):
+    # Unseen points from the same distribution: short texts and their vectors.
+    return _sample(np.random.default_rng([seed, 1]), topic_model(seed), count, words)
+
+
+def ingest_sample(seed: int, count: int, words: int = 150):
+    return _sample(np.random.default_rng([seed, 2]), topic_model(seed), count, words)
+
+
+def copy_buffer(
+    texts: list[str], vectors: np.ndarray, source_url: str, source_id: int, collection: str = DEFAULT_COLLECTION,
+) -> io.BytesIO:
+    # Binary COPY payload for document (COPY_COLUMNS).
+    # Formatting 384 floats as text per row would dominate the load time.
+    buf = io.BytesIO()
+    buf.write(COPY_HEADER)
+    collection = collection.encode("utf-8")
+    url = source_url.encode("utf-8")
+    vector_header = struct.pack("!ihh", 4 + 4 * EMBEDDING_DIM, EMBEDDING_DIM, 0)
+    for content, vector in zip(texts, vectors.astype(">f4")):
+        content = content.encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest().encode("ascii")
+        buf.write(struct.pack("!hi", len(COPY_COLUMNS), len(collection)))
+        buf.write(collection)
+        buf.write(struct.pack("!i", len(content)))
+        buf.write(content)
+        buf.write(struct.pack("!i", len(url)))
+        buf.write(url)
+        buf.write(struct.pack("!ii", 4, source_id))
+        buf.write(struct.pack("!i", len(digest)))
+        buf.write(digest)
+        buf.write(vector_header)
+        buf.write(vector.tobytes())
+    buf.write(COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def corpus_url(seed: int, chunks: int) -> str:
+    return f"bench://corpus?seed={seed}&chunks={chunks}"
+
+
+def load(chunks: int, seed: int, words: int = 150, collection: str = DEFAULT_COLLECTION) -> dict:
+    """Loads the corpus into the configured database, unless it is already there.
+
+    The vector index is dropped during the load and rebuilt afterwards, so
+    this must run against a dedicated benchmark database. The collection's
+    partition must exist (init_db creates the default one).
+    """
+    url = corpus_url(seed, chunks)
+    engine = create_engine(settings.DATABASE_URL.replace("postgresql+asyncpg", "postgresql"))
+    with engine.begin() as conn:
+        loaded = conn.execute(
+            text("SELECT chunk_count FROM source WHERE collection = :collection AND url = :url AND status = 'ACTIVE'"),
+            {"collection": collection, "url": url},
+        ).scalar()
+    if loaded == chunks:
+        print(f"Reusing corpus {url}")
+        engine.dispose()
+        return {"chunks": chunks, "reused": True}
+
+    with engine.begin() as conn:
+        # Earlier benchmark corpora, their chunks go with them (ON DELETE CASCADE).
+        conn.execute(text("DELETE FROM source WHERE url LIKE 'bench://%'"))
+        conn.execute(text(f"DROP INDEX IF EXISTS {vector_index.INDEX_NAME}"))
+        source_id = conn.execute(
+            text(
+                "INSERT INTO source (collection, url, status, chunk_count, bytes) "
+                "VALUES (:collection, :url, 'INGESTING', 0, 0) RETURNING id"
+            ),
+            {"collection": collection, "url": url},
+        ).scalar_one()
+
+    start = time.perf_counter()
+    size = 0
+    raw = engine.raw_connection()
+    try:
+        for index, offset in enumerate(range(0, chunks, SHARD_SIZE)):
+            texts, vectors = shard(seed, index, min(SHARD_SIZE, chunks - offset), words)
+            size += sum(len(t.encode("utf-8")) for t in texts)
+            with raw.cursor() as cur:
+                cur.copy_expert(
+                    f"COPY document ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+                    copy_buffer(texts, vectors, url, source_id, collection),
+                )
+            raw.commit()
+            print(f"Loaded {offset + len(texts)}/{chunks} chunks")
+    finally:
+        raw.close()
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ddl = vector_index.index_ddl()
+    with engine.begin() as conn:
+        if ddl is not None:
+            print(f"Building {vector_index.INDEX_NAME} ({settings.VECTOR_INDEX}, {settings.VECTOR_STORAGE})...")
+            conn.execute(text(ddl))
+        conn.execute(
+            text("UPDATE source SET status = 'ACTIVE', chunk_count = :chunks, bytes = :size, last_ingested_at = now() WHERE id = :id"),
+            {"chunks": chunks, "size": size, "id": source_id},
+        )
+    index_s = time.perf_counter() - start
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE document"))
+    engine.dispose()
+    return {
+        "chunks": chunks,
+        "reused": False,
+        "bytes": size,
+        "copy_s": round(load_s, 2),
+        "copy_chunks_per_s": round(chunks / load_s, 1),
+        "index_build_s": round(index_s, 2),
+    }
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import time
+
+from bench.run import percentiles, rss_mb
+
+# Throughput (batched, as the worker embeds) and single-query latency (as the
+# API embeds) of each embedding backend, plus agreement with the torch model.
+
+
+def measure(backend: str, texts: list[str], queries: list[str]) -> tuple[dict, list]:
+    from app import providers
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model = providers.make_embeddings(backend)
+    model.embed_query("warm up")
+    result = {"load_s": round(time.perf_counter() - start, 2)}
+
+    start = time.perf_counter()
+    vectors = model.embed_documents(texts)
+    result["batch_texts_per_s"] = round(len(texts) / (time.perf_counter() - start), 1)
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.embed_query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    result["query_ms"] = percentiles(latencies)
+    result["rss_delta_mb"] = round(rss_mb() - rss_before, 1)
+    return result, vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.embeddings")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--texts", type=int, default=2000, help="Chunks embedded in batches")
+    parser.add_argument("--queries", type=int, default=200, help="Single queries timed one by one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result path, defaults to bench/results/embeddings-<timestamp>.json")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    from app.manage import embedding_agreement
+    from app.settings import settings
+    from bench import corpus
+
+    texts, _ = corpus.ingest_sample(args.seed, args.texts)
+    queries, _ = corpus.queries(args.seed, args.queries)
+    backends = args.backends.split(",")
+
+    report = {"model": settings.EMBEDDING_MODEL, "batch_size": settings.EMBED_BATCH_SIZE, "backends": {}}
+    reference = None
+    for backend in backends:
+        print(f"Measuring {backend}...")
+        result, vectors = measure(backend, texts, queries)
+        if backend == "torch":
+            reference = vectors
+        elif reference is not None:
+            result["agreement"] = embedding_agreement(reference, vectors)
+        report["backends"][backend] = result
+
+    output = args.output or os.path.join("bench", "results", time.strftime("embeddings-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'backend':>10} {'texts/s':>9} {'q p50 ms':>9} {'q p95 ms':>9} {'min cos':>8}")
+    for backend, result in report["backends"].items():
+        cosine = result.get("agreement", {}).get("min_cosine", "")
+        print(f"{backend:>10} {result['batch_texts_per_s']:>9} {result['query_ms']['p50']:>9} {result['query_ms']['p95']:>9} {cosine:>8}")
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
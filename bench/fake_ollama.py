@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Stand-in for the Ollama HTTP API (/api/chat, /api/generate, /api/tags) with
+# a fixed time to first token and per-token latency, so the /chat pipeline can
+# be benchmarked without a model or a GPU.
+
+WORDS = (
+    "the answer depends on the context retrieved from the indexed pages and "
+    "describes how the service handles requests responses and errors in detail"
+).split()
+
+
+def reply_tokens(prompt: str, tokens: int, grade: float, rng: random.Random) -> list[str]:
+    # Recognizes the grading and rewrite prompts from app.rag so the
+    # self-correction path behaves deterministically.
+    if "Return ONLY a number" in prompt:
+        return [str(grade)]
+    if "Return ONLY the new query" in prompt:
+        match = re.search(r"Original:\s*(.*)", prompt)
+        query = match.group(1).strip() if match else "query"
+        return [query, " details"]
+    return [(" " if i else "") + rng.choice(WORDS) for i in range(tokens)]
+
+
+def create_app(token_ms: float = 20.0, first_token_ms: float = 100.0, tokens: int = 64,
+               grade: float = 0.9, parallel: int = 4, model: str = "llama3") -> FastAPI:
+    app = FastAPI(title="fake-ollama")
+    # Requests beyond `parallel` queue, like OLLAMA_NUM_PARALLEL.
+    slots = asyncio.Semaphore(parallel)
+    rng = random.Random(0)
+
+    def chunk(content: str, chat: bool, done: bool, **extra) -> dict:
+        body = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done, **extra}
+        if chat:
+            body["message"] = {"role": "assistant", "content": content}
+        else:
+            body["response"] = content
+        return body
+
+    async def generate(prompt: str, chat: bool, stream: bool):
+        parts = reply_tokens(prompt, tokens, grade, rng)
+        async with slots:
+            start = time.perf_counter()
+            await asyncio.sleep(first_token_ms / 1000)
+            for i, part in enumerate(parts):
+                if i:
+                    await asyncio.sleep(token_ms / 1000)
+                if stream:
+                    yield json.dumps(chunk(part, chat, False)) + "\n"
+            elapsed_ns = int((time.perf_counter() - start) * 1e9)
+        final = chunk("" if stream else "".join(parts), chat, True,
+                      done_reason="stop", total_duration=elapsed_ns, eval_count=len(parts))
+        yield json.dumps(final) + "\n"
+
+    async def respond(prompt: str, chat: bool, stream: bool):
+        if stream:
+            return StreamingResponse(generate(prompt, chat, True), media_type="application/x-ndjson")
+        body = [line async for line in generate(prompt, chat, False)][-1]
+        return JSONResponse(json.loads(body))
+
+    @app.post("/api/chat")
+    async def api_chat(request: Request):
+        payload = await request.json()
+        prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []))
+        return await respond(prompt, True, payload.get("stream", True))
+
+    @app.post("/api/generate")
+    async def api_generate(request: Request):
+        payload = await request.json()
+        return await respond(payload.get("prompt", ""), False, payload.get("stream", True))
+
+    @app.get("/api/tags")
+    async def api_tags():
+        return {"models": [{"name": model, "model": model}]}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.fake_ollama")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-ms", type=float, default=20.0, help="Delay between streamed tokens")
+    parser.add_argument("--first-token-ms", type=float, default=100.0, help="Delay before the first token")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per generated answer")
+    parser.add_argument("--grade", type=float, default=0.9, help="Score returned to grading prompts")
+    parser.add_argument("--parallel", type=int, default=4, help="Generations served concurrently")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.token_ms, args.first_token_ms, args.tokens, args.grade, args.parallel)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
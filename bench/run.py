@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import requests
+
+# Settings are read when app modules are first imported, so the runner sets
+# its environment (Ollama URL, offline model loading) before importing them.
+
+
+def percentiles(values: list[float]) -> dict:
+    from app.manage import percentile
+    if not values:
+        return {}
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+    }
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def start_fake_ollama(args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, "-m", "bench.fake_ollama",
+        "--port", str(args.ollama_port),
+        "--token-ms", str(args.token_ms),
+        "--first-token-ms", str(args.first_token_ms),
+        "--tokens", str(args.tokens),
+        "--grade", str(args.grade),
+        "--parallel", str(args.ollama_parallel),
+    ])
+    url = f"http://127.0.0.1:{args.ollama_port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/api/tags", timeout=1).raise_for_status()
+            return process
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit(f"Fake Ollama did not start on {url}")
+
+
+async def measure_recall(args) -> dict:
+    from app import vector_index
+    from app.database import engine
+    from app.manage import top_k_ids
+    from app.settings import settings
+    from bench import corpus
+
+    _, vectors = corpus.queries(args.seed, args.recall_queries)
+    recalls, exact_ms, ann_ms = [], [], []
+    async with engine.connect() as conn:
+        for vector in vectors.tolist():
+            truth, ms = await top_k_ids(conn, vector, args.k, exact=True)
+            exact_ms.append(ms)
+            ids, ms = await top_k_ids(conn, vector, args.k)
+            ann_ms.append(ms)
+            recalls.append(len(set(truth) & set(ids)) / len(truth) if truth else 1.0)
+    return {
+        "k": args.k,
+        "queries": len(recalls),
+        "index": settings.VECTOR_INDEX,
+        "storage": settings.VECTOR_STORAGE,
+        "recall": round(statistics.mean(recalls), 4),
+        "exact_ms": percentiles(exact_ms),
+        "ann_ms": percentiles(ann_ms),
+        "candidates": vector_index.candidate_count(args.k),
+    }
+
+
+async def chat_once(query: str, options) -> dict:
+    # The first attempt of rag_flow, timed stage by stage.
+    from app import rag
+    from app.context import build_context
+    from app.database import async_session
+
+    stages = {}
+    start = time.perf_counter()
+    async with async_session() as session:
+        docs = await rag.search_docs(session, query, options, stages)
+
+    context_start = time.perf_counter()
+    context = build_context(docs)
+    stages["context"] = (time.perf_counter() - context_start) * 1000
+
+    generate_start = time.perf_counter()
+    answer = ""
+    async for token in rag.generate_answer_stream(query, context.text):
+        if not answer:
+            stages["first_token"] = (time.perf_counter() - generate_start) * 1000
+        answer += token
+    stages["generate"] = (time.perf_counter() - generate_start) * 1000
+
+    grade_start = time.perf_counter()
+    await rag.grade_answer(query, docs, answer)
+    stages["grade"] = (time.perf_counter() - grade_start) * 1000
+    stages["total"] = (time.perf_counter() - start) * 1000
+    return stages
+
+
+async def measure_chat(args) -> dict:
+    from app import rag
+    from app.schemas import SearchOptions
+    from bench import corpus
+
+    texts, _ = corpus.queries(args.seed + 1, args.warmup + args.queries)
+    options = SearchOptions(top_k=args.top_k)
+    for query in texts[:args.warmup]:
+        await chat_once(query, options)
+
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def run(query):
+        async with limit:
+            return await chat_once(query, options)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(query) for query in texts[args.warmup:]))
+    elapsed = time.perf_counter() - start
+
+    stages = {}
+    for result in results:
+        for stage, ms in result.items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "queries": len(results),
+        "concurrency": args.concurrency,
+        "throughput_qps": round(len(results) / elapsed, 2),
+        "stages_ms": {stage: percentiles(values) for stage, values in stages.items()},
+        "batcher": rag.embed_batcher.stats(),
+    }
+
+
+def measure_ingestion(args) -> dict:
+    from sqlalchemy import delete
+    from app import pipeline, worker
+    from app.celery_app import celery_app
+    from app.models import Source
+    from app.settings import settings
+    from bench import corpus
+
+    texts, vectors = corpus.ingest_sample(args.seed, args.ingest_chunks)
+    chunks = [worker.Chunk(text, ordinal) for ordinal, text in enumerate(texts)]
+    vectors = vectors.tolist()
+    batch_size = settings.INSERT_BATCH_SIZE
+    result = {
+        "chunks": len(texts),
+        "insert_batch_size": batch_size,
+        "ingest_embed_batch": settings.INGEST_EMBED_BATCH,
+        "embed_batch_size": settings.EMBED_BATCH_SIZE,
+    }
+
+    with worker.SessionLocal() as session:
+        # Write path only: synthetic vectors, the worker's batched INSERTs.
+        source = worker.get_or_create_source(session, "bench://ingest/write")
+        start = time.perf_counter()
+        for offset in range(0, len(texts), batch_size):
+            worker.write_chunks(session, chunks[offset:offset + batch_size], vectors[offset:offset + batch_size], source)
+        result["write_chunks_per_s"] = round(len(texts) / (time.perf_counter() - start), 1)
+
+        # The pipeline as an upload goes through it: the sample is spooled as
+        # one text document, parsed and diffed, encoded INGEST_EMBED_BATCH
+        # chunks at a time and written. The stage tasks run inline (eager), so
+        # no workers are needed and queueing between them is not measured.
+        source = worker.get_or_create_source(session, "bench://ingest/pipeline")
+        path = pipeline.spool_path()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(texts))
+        doc = {"url": source.url, "collection": source.collection, "source_id": source.id, "path": path, "kind": "text", "encoding": "utf-8"}
+        celery_app.conf.task_always_eager = True
+        try:
+            start = time.perf_counter()
+            worker.parse_document(pipeline.start(doc))
+            elapsed = time.perf_counter() - start
+        finally:
+            celery_app.conf.task_always_eager = False
+        session.refresh(source)
+        result["pipeline_chunks"] = source.chunk_count
+        result["pipeline_chunks_per_s"] = round(source.chunk_count / elapsed, 1)
+
+        session.execute(delete(Source).where(Source.url.like("bench://ingest/%")))
+        session.commit()
+    return result
+
+
+async def storage() -> dict:
+    from sqlalchemy import text
+    from app import vector_index
+    from app.database import engine
+
+    async with engine.connect() as conn:
+        result = await conn.execute(text("""
+            SELECT (SELECT sum(pg_table_size(relid)) FROM pg_partition_tree('document')),
+                   (SELECT sum(pg_relation_size(relid)) FROM pg_partition_tree(to_regclass(:index)))
+        """), {"index": vector_index.INDEX_NAME})
+        table_bytes, index_bytes = result.one()
+    return {"table_bytes": table_bytes, "index_bytes": index_bytes or 0}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args) -> dict:
+    from app.database import init_db
+    from app.settings import settings
+    from bench import corpus
+
+    await init_db()
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "args": {k: v for k, v in vars(args).items() if k != "func"},
+        "settings": settings.model_dump(exclude={"DATABASE_URL", "REDIS_URL"}),
+    }
+    report["corpus"] = await asyncio.to_thread(corpus.load, args.chunks, args.seed, args.words)
+    report["recall"] = await measure_recall(args)
+
+    from app import providers
+    providers.warm_up(["embeddings"])
+    report["memory"] = {"rss_after_model_mb": rss_mb()}
+    report["chat"] = await measure_chat(args)
+    report["memory"]["rss_after_chat_mb"] = rss_mb()
+
+    if args.ingest_chunks:
+        # The worker shares the embedding model already loaded by the API code.
+        report["ingestion"] = await asyncio.to_thread(measure_ingestion, args)
+    report["memory"]["peak_rss_mb"] = peak_rss_mb()
+    report["storage"] = await storage()
+    return report
+
+
+def run(args):
+    os.environ["OLLAMA_BASE_URL"] = args.ollama_url or f"http://127.0.0.1:{args.ollama_port}"
+    # Models must already be in the local Hugging Face cache.
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    ollama = None if args.ollama_url else start_fake_ollama(args)
+    try:
+        report = asyncio.run(benchmark(args))
+    finally:
+        if ollama is not None:
+            ollama.terminate()
+            ollama.wait()
+
+    output = args.output or os.path.join("bench", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    chat = report["chat"]
+    print(f"Corpus: {report['corpus']['chunks']} chunks, recall@{args.k} {report['recall']['recall']}")
+    print(f"Chat: {chat['throughput_qps']} q/s at concurrency {chat['concurrency']}")
+    print(f"{'stage':>12} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, values in chat["stages_ms"].items():
+        print(f"{stage:>12} {values['p50']:>9} {values['p95']:>9} {values['p99']:>9}")
+    if "ingestion" in report:
+        ingestion = report["ingestion"]
+        print(f"Ingestion: {ingestion['pipeline_chunks_per_s']} chunks/s parse to write (write only {ingestion['write_chunks_per_s']})")
+    print(f"Peak RSS: {report['memory']['peak_rss_mb']} MB")
+    print(f"Saved {output}")
+
+
+def flatten(report: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in report.items():
+        if key in ("args", "settings"):
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = flatten(json.load(f))
+    with open(args.candidate) as f:
+        candidate = flatten(json.load(f))
+    print(f"{'metric':<40} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[name], candidate[name]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else ""
+        print(f"{name:<40} {old:>12} {new:>12} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("run", help="Load a synthetic corpus and measure ingestion, /chat stages, recall and memory")
+    bench.add_argument("--chunks", type=int, default=10000, help="Corpus size (10k to 5M)")
+    bench.add_argument("--words", type=int, default=150, help="Words per synthetic chunk")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--queries", type=int, default=200, help="Measured /chat queries")
+    bench.add_argument("--warmup", type=int, default=10)
+    bench.add_argument("--concurrency", type=int, default=8)
+    bench.add_argument("--top-k", type=int, default=3)
+    bench.add_argument("--k", type=int, default=10, help="k for recall@k")
+    bench.add_argument("--recall-queries", type=int, default=200)
+    bench.add_argument("--ingest-chunks", type=int, default=5000, help="Chunks written through the worker (0 to skip)")
+    bench.add_argument("--ollama-url", help="Use this Ollama instead of starting the fake one")
+    bench.add_argument("--ollama-port", type=int, default=11435)
+    bench.add_argument("--ollama-parallel", type=int, default=4)
+    bench.add_argument("--token-ms", type=float, default=20.0)
+    bench.add_argument("--first-token-ms", type=float, default=100.0)
+    bench.add_argument("--tokens", type=int, default=64)
+    bench.add_argument("--grade", type=float, default=0.9)
+    bench.add_argument("--output", help="Result path, defaults to bench/results/<timestamp>.json")
+    bench.set_defaults(func=run)
+
+    diff = sub.add_parser("compare", help="Compare two result files")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, Rejected, SingleFlight
+
+async def test_queued_requests_are_served_by_priority():
+    admission = AdmissionController(max_active=1, max_queued=8, max_wait=5)
+    order = []
+
+    async def request(name, lane):
+        async with admission.slot(lane):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    first = asyncio.create_task(request("first", "normal"))
+    await asyncio.sleep(0)
+    waiting = [asyncio.create_task(request(name, lane)) for name, lane in (("low", "low"), ("normal", "normal"), ("high", "high"))]
+    await asyncio.gather(first, *waiting)
+    assert order == ["first", "high", "normal", "low"]
+    assert admission.stats()["active"] == 0
+    assert admission.stats()["admitted"] == 4
+
+async def test_full_lane_is_rejected_with_retry_after():
+    admission = AdmissionController(max_active=1, max_queued=4, max_wait=60, service_time=2)
+    await admission.acquire("normal")
+    waiting = [asyncio.create_task(admission.acquire("low")) for _ in range(2)]
+    await asyncio.sleep(0)
+    # The low lane may fill half of the queue, higher lanes still get in.
+    with pytest.raises(Rejected) as rejected:
+        await admission.acquire("low")
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after >= 2
+    high = asyncio.create_task(admission.acquire("high"))
+    await asyncio.sleep(0)
+    assert admission.stats()["queued_high"] == 1
+    for task in (high, *waiting):
+        task.cancel()
+    await asyncio.gather(high, *waiting, return_exceptions=True)
+    assert admission.queued() == 0
+
+async def test_long_estimated_wait_is_rejected_up_front():
+    admission = AdmissionController(max_active=1, max_queued=100, max_wait=10, service_time=4)
+    await admission.acquire("normal")
+    waiting = [asyncio.create_task(admission.acquire("normal")) for _ in range(2)]
+    await asyncio.sleep(0)
+    # Two ahead at 4 s each on one slot: 12 s > 10 s.
+    with pytest.raises(Rejected) as rejected:
+        await admission.acquire("normal")
+    assert (rejected.value.status_code, rejected.value.retry_after) == (429, 12)
+    for task in waiting:
+        task.cancel()
+    await asyncio.gather(*waiting, return_exceptions=True)
+
+async def test_wait_longer_than_max_wait_times_out():
+    admission = AdmissionController(max_active=1, max_queued=4, max_wait=0.05, service_time=0.01)
+    await admission.acquire("normal")
+    with pytest.raises(Rejected) as rejected:
+        await admission.acquire("normal")
+    assert rejected.value.status_code == 503
+    assert admission.stats()["timed_out"] == 1
+    assert admission.queued() == 0
+
+async def test_cancelled_waiter_passes_its_slot_on():
+    admission = AdmissionController(max_active=1, max_queued=4, max_wait=5)
+    await admission.acquire("normal")
+    gone = asyncio.create_task(admission.acquire("normal"))
+    await asyncio.sleep(0)
+    admission.release()  # hands the slot to the waiter...
+    gone.cancel()  # ...which is cancelled before it resumes
+    await asyncio.gather(gone, return_exceptions=True)
+    assert admission.active == 0
+
+async def test_waiter_cancelled_after_it_expired_frees_no_slot():
+    admission = AdmissionController(max_active=1, max_queued=4, max_wait=5)
+    await admission.acquire("normal")
+    gone = asyncio.create_task(admission.acquire("normal"))
+    await asyncio.sleep(0)
+    [future] = admission.waiters["normal"]
+    admission._expire("normal", future)  # the timer fires...
+    gone.cancel()  # ...and the client goes away before the waiter resumes
+    await asyncio.gather(gone, return_exceptions=True)
+    assert admission.active == 1
+    assert admission.stats()["timed_out"] == 1
+
+async def test_identical_requests_share_one_run():
+    flights = SingleFlight()
+    runs = []
+
+    async def run(flight):
+        runs.append(1)
+        flight.admit()
+        for event in ("a", "b"):
+            flight.publish(event)
+            await asyncio.sleep(0.01)
+
+    async def request():
+        flight = flights.join("key", run)
+        await flight.admitted
+        return [event async for event in flight.follow()]
+
+    results = await asyncio.gather(request(), request(), request())
+    assert results == [["a", "b"]] * 3
+    assert len(runs) == 1
+    assert flights.stats() == {"in_flight": 0, "started": 1, "joined": 2}
+
+async def test_errors_and_rejections_reach_every_caller():
+    flights = SingleFlight()
+
+    async def rejected(flight):
+        raise Rejected(429, "busy", 3)
+
+    first, second = flights.join("key", rejected), flights.join("key", rejected)
+    for flight in (first, second):
+        with pytest.raises(Rejected):
+            await flight.admitted
+
+    async def fail(flight):
+        flight.admit()
+        raise ValueError("boom")
+
+    flight = flights.join("other", fail)
+    with pytest.raises(ValueError):
+        [event async for event in flight.follow()]
+
+async def test_run_is_cancelled_when_every_caller_left():
+    flights = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def run(flight):
+        flight.admit()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    flight = flights.join("key", run)
+    await flight.admitted
+    flight.leave()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    # A new request does not join the abandoned run.
+    assert flights.join("key", run) is not flight
@@ -1,5 +1,14 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
 from fastapi.testclient import TestClient
+from app import main
+from app.admission import AdmissionController, SingleFlight
+from app.database import get_session
 from app.main import app
+from app.models import Document
+from app.schemas import ChatRequest
 
 client = TestClient(app)
 
@@ -12,3 +21,143 @@ def test_chat_validation_failure():
     # Helper to check validation without needing DB
     response = client.post("/chat", json={})
     assert response.status_code == 422
+
+def test_chat_stream_validation_failure():
+    response = client.post("/chat/stream", json={})
+    assert response.status_code == 422
+
+def test_ready_before_warm_up():
+    # TestClient without a context manager skips lifespan, so nothing is loaded.
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["models"]["embeddings"] is False
+
+def test_upload_rejects_unsupported_type():
+    response = client.post("/upload", files={"file": ("archive.zip", b"PK")})
+    assert response.status_code == 415
+
+def test_scrape_rejects_invalid_collection():
+    response = client.post("/scrape", json={"url": "https://example.com", "collection": "Not Valid"})
+    assert response.status_code == 422
+
+def test_chat_stream_sends_pipeline_events_as_sse(monkeypatch):
+    async def fake_flow(session, query, options, cache):
+        yield {"event": "trace", "data": f"Searching for: {query}"}
+        yield {"event": "token", "data": "Hel"}
+        yield {"event": "token", "data": "lo"}
+        yield {"event": "done", "data": {"answer": "Hello", "trace": [], "sources": [], "timings": {"total": 1.0}}}
+
+    monkeypatch.setattr(main, "rag_flow_stream", fake_flow)
+    response = client.post("/chat/stream", json={"query": "hi"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    messages = [block.split("\n") for block in response.text.strip().split("\n\n")]
+    events = [(lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: "))) for lines in messages]
+    assert events[:3] == [("trace", "Searching for: hi"), ("token", "Hel"), ("token", "lo")]
+    # Timings are only sent when asked for.
+    assert events[3] == ("done", {"answer": "Hello", "trace": [], "sources": []})
+
+def test_delete_source_cascades_to_its_chunks(monkeypatch):
+    # Chunks reference their source with ON DELETE CASCADE, so one DELETE of the source row removes them.
+    [foreign_key] = Document.__table__.c.source_id.foreign_keys
+    assert (foreign_key.column.table.name, foreign_key.ondelete) == ("source", "CASCADE")
+
+    statements, changes = [], []
+
+    class FakeSession:
+        async def execute(self, statement):
+            statements.append(statement)
+            return type("Result", (), {"scalars": lambda self: [5]})()
+
+        async def commit(self):
+            pass
+
+    async def fake_session():
+        yield FakeSession()
+
+    async def publish(event):
+        changes.append(event)
+
+    monkeypatch.setattr(main, "publish_source_change", publish)
+    app.dependency_overrides[get_session] = fake_session
+    try:
+        response = client.delete("/sources", params={"source": "https://example.com", "collection": "docs"})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    [delete] = statements
+    assert delete.is_delete and delete.table.name == "source"
+    assert delete.compile().params == {"collection_1": "docs", "url_1": "https://example.com"}
+    assert changes == [{"source_id": 5, "collection": "docs", "added": 0, "removed": [], "deleted": True}]
+
+def test_chat_without_an_answer_is_a_503(monkeypatch):
+    async def cancelled_flow(session, query, options, cache):
+        yield {"event": "trace", "data": f"Searching for: {query}"}
+
+    monkeypatch.setattr(main, "rag_flow_stream", cancelled_flow)
+    response = client.post("/chat", json={"query": "hi"})
+    assert response.status_code == 503
+
+async def test_chat_stream_never_started_gives_up_its_slot(monkeypatch):
+    async def slow_flow(session, query, options, cache):
+        yield {"event": "trace", "data": f"Searching for: {query}"}
+        await asyncio.sleep(10)
+
+    admission = AdmissionController(max_active=1, max_queued=4, max_wait=5)
+    monkeypatch.setattr(main, "chat_admission", admission)
+    monkeypatch.setattr(main, "chat_flights", SingleFlight())
+    monkeypatch.setattr(main, "rag_flow_stream", slow_flow)
+
+    response = await main.chat_stream(ChatRequest(query="hi"))
+    assert admission.active == 1
+    [flight] = main.chat_flights.flights.values()
+    # The client went away before the body was iterated; Starlette still runs the background task.
+    await response.background()
+    assert flight.task.cancelling()
+    await flight.task
+    assert admission.active == 0
+    assert main.chat_flights.stats()["in_flight"] == 0
+
+def test_chat_cancelled_before_admission_is_a_503(monkeypatch):
+    class Cancelled(AdmissionController):
+        @asynccontextmanager
+        async def slot(self, lane):
+            raise asyncio.CancelledError
+            yield
+
+    monkeypatch.setattr(main, "chat_admission", Cancelled(max_active=1, max_queued=4, max_wait=5))
+    monkeypatch.setattr(main, "chat_flights", SingleFlight())
+    response = client.post("/chat", json={"query": "hi"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+def test_batch_creates_one_job_per_distinct_url(monkeypatch):
+    children, tasks = [], []
+
+    class FakeSession:
+        def add(self, job):
+            pass
+
+        async def execute(self, statement, rows=None):
+            children.extend(rows)
+
+        async def commit(self):
+            pass
+
+    async def fake_session():
+        yield FakeSession()
+
+    async def nothing(*args):
+        pass
+
+    monkeypatch.setattr(main.partitions, "ensure_collection", nothing)
+    monkeypatch.setattr(main.events, "apublish", nothing)
+    monkeypatch.setattr(main.celery_app, "send_task", lambda name, args: tasks.append(args[1]))
+    app.dependency_overrides[get_session] = fake_session
+    try:
+        response = client.post("/scrape/batch", json={"urls": ["https://a.test/", "https://b.test/", "https://a.test/"]})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.json()["jobs"] == 2
+    assert [child["url"] for child in children] == ["https://a.test/", "https://b.test/"]
+    assert [url for _, url in tasks[0]] == ["https://a.test/", "https://b.test/"]
@@ -0,0 +1,27 @@
+import asyncio
+from app.batcher import MicroBatcher
+
+async def test_concurrent_calls_share_a_batch():
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_batch=8, max_wait_ms=20)
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+    assert results == [0, 2, 4, 6, 8]
+    assert calls == [[0, 1, 2, 3, 4]]
+    assert batcher.stats()["batch_sizes"] == {5: 1}
+
+async def test_full_batch_flushes_immediately():
+    batcher = MicroBatcher(lambda items: items, max_batch=2, max_wait_ms=10_000)
+    assert await asyncio.wait_for(asyncio.gather(batcher.submit("a"), batcher.submit("b")), 1) == ["a", "b"]
+
+async def test_errors_reach_every_waiter():
+    def fail(items):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(fail, max_batch=4, max_wait_ms=1)
+    results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,60 @@
+import json
+import struct
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from bench import corpus
+from bench.fake_ollama import create_app
+from bench.run import flatten, percentiles
+
+
+def test_corpus_is_deterministic_and_normalized():
+    texts, vectors = corpus.shard(seed=1, index=0, count=50, words=20)
+    again, same = corpus.shard(seed=1, index=0, count=50, words=20)
+    other, _ = corpus.shard(seed=1, index=1, count=50, words=20)
+
+    assert texts == again and np.array_equal(vectors, same)
+    assert texts != other
+    assert vectors.shape == (50, corpus.EMBEDDING_DIM)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+    assert all(len(text.split()) == 20 for text in texts)
+
+
+def test_copy_buffer_layout():
+    texts, vectors = corpus.shard(seed=1, index=0, count=3, words=5)
+    data = corpus.copy_buffer(texts, vectors, "bench://x", 7, "team_a").getvalue()
+    assert data.startswith(corpus.COPY_HEADER)
+    assert data.endswith(corpus.COPY_TRAILER)
+    # The partition key is written, or rows cannot be routed to a partition.
+    assert corpus.COPY_COLUMNS == ("collection", "content", "source", "source_id", "content_hash", "embedding")
+    header = len(corpus.COPY_HEADER)
+    assert data[header:header + 12] == struct.pack("!hi", 6, 6) + b"team_a"
+    # Six fields per row: collection, content, source, source_id, content_hash, embedding.
+    row_bytes = sum(
+        2 + 4 + 6 + 4 + len(t.encode()) + 4 + 9 + 4 + 4 + 4 + 64 + 4 + 4 + 4 * corpus.EMBEDDING_DIM for t in texts
+    )
+    assert len(data) == header + row_bytes + len(corpus.COPY_TRAILER)
+
+
+def test_fake_ollama_streams_chat_tokens():
+    client = TestClient(create_app(token_ms=0, first_token_ms=0, tokens=5, grade=0.8))
+
+    response = client.post("/api/chat", json={"model": "llama3", "messages": [{"role": "user", "content": "Hi"}]})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["done"] for line in lines] == [False] * 5 + [True]
+    assert all(line["message"]["role"] == "assistant" for line in lines)
+
+    response = client.post("/api/chat", json={
+        "messages": [{"role": "user", "content": "Return ONLY a number between 0.0 and 1.0."}],
+        "stream": False,
+    })
+    assert response.json()["message"]["content"] == "0.8"
+
+
+def test_percentiles_and_flatten():
+    summary = percentiles([float(ms) for ms in range(1, 101)])
+    assert summary["p50"] == 51.0 and summary["p99"] == 99.0 and summary["count"] == 100
+    assert flatten({"chat": {"stages_ms": {"embed": {"p50": 2.0}}}, "args": {"chunks": 1}, "commit": "abc"}) == {
+        "chat.stages_ms.embed.p50": 2.0
+    }
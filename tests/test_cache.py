@@ -0,0 +1,79 @@
+import asyncio
+
+from app.cache import AnswerCache, EmbeddingCache
+from app.events import EventHub, source_event
+from app.models import Document
+
+def make_cache(**kwargs):
+    return EmbeddingCache(model_name="test-model", max_size=kwargs.get("max_size", 2), ttl=kwargs.get("ttl", 60))
+
+async def test_normalized_text_hits():
+    cache = make_cache()
+    await cache.set("What is  Python?", [1.0, 2.0])
+    assert await cache.get(" what is python? ") == [1.0, 2.0]
+    assert cache.stats()["local_hits"] == 1
+
+async def test_lru_eviction():
+    cache = make_cache(max_size=2)
+    await cache.set("a", [1.0])
+    await cache.set("b", [2.0])
+    await cache.get("a")
+    await cache.set("c", [3.0])
+    assert await cache.get("b") is None
+    assert await cache.get("a") == [1.0]
+    assert cache.stats()["evictions"] == 1
+
+async def test_expired_entries_miss():
+    cache = make_cache(ttl=-1)
+    await cache.set("a", [1.0])
+    assert await cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+def test_key_includes_model():
+    assert make_cache().key("q") != EmbeddingCache("other", 1, 1).key("q")
+
+
+def answer_cache_with(*answers, threshold=0.9):
+    # answers: (vector, chunk ids of source 1)
+    cache = AnswerCache(threshold=threshold, max_size=10, ttl=60)
+    for vector, chunk_ids in answers:
+        docs = [Document(id=i, content="", source="s", source_id=1) for i in chunk_ids]
+        cache.put("scope", vector, {"answer": str(chunk_ids)}, docs, ["default"], cache.version)
+    return cache
+
+def test_similar_query_hits_in_same_scope():
+    cache = answer_cache_with(([1.0, 0.0], [1]))
+    response, similarity = cache.get("scope", [0.99, 0.1])
+    assert response == {"answer": "[1]"} and similarity > 0.9
+    assert cache.get("scope", [0.0, 1.0]) is None
+    assert cache.get("other scope", [1.0, 0.0]) is None
+    assert cache.stats()["hit_rate"] == 1 / 3
+
+def test_only_answers_using_changed_chunks_are_invalidated():
+    cache = answer_cache_with(([1.0, 0.0], [1]), ([0.0, 1.0], [2]))
+    assert cache.invalidate(source_event(1, "default", removed=[2])) == 1
+    assert cache.get("scope", [1.0, 0.0]) is not None
+    assert cache.invalidate(source_event(1, "default", added=3)) == 1
+    assert cache.stats()["size"] == 0
+
+def test_answer_invalidated_while_generated_is_not_stored():
+    cache = AnswerCache(threshold=0.9, max_size=10, ttl=60)
+    version = cache.version
+    cache.invalidate(source_event(2, "default", deleted=True))  # unrelated source
+    cache.invalidate(source_event(None, "default", deleted=True))
+    cache.put("scope", [1.0], {"answer": "a"}, [Document(id=1, content="", source="s", source_id=1)], ["default"], version)
+    assert cache.stats()["stale"] == 1 and cache.stats()["size"] == 0
+
+async def test_malformed_source_event_clears_the_cache_and_keeps_following():
+    cache = answer_cache_with(([1.0, 0.0], [1]))
+    hub = EventHub("redis://localhost:6379/0", max_pending=10)
+    hub._task = asyncio.create_task(asyncio.sleep(10))  # no Redis: events are delivered by hand
+    follower = asyncio.create_task(cache.follow(hub))
+    await asyncio.sleep(0)
+    hub.deliver({"event": "source", "data": {"collection": "default"}})
+    await asyncio.sleep(0)
+    assert cache.stats()["size"] == 0
+    # Subscribed again, so later invalidations still arrive.
+    assert len(hub.queues) == 1
+    follower.cancel()
+    hub._task.cancel()
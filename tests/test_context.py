@@ -0,0 +1,76 @@
+from app.context import build_context, drop_near_duplicates, merge_chunks
+from app.models import Document
+from app.worker import SPLIT_WINDOW, stream_chunks
+
+
+def doc(id, text, source_id=1, ordinal=None, start=None):
+    return Document(
+        id=id, content=text, source=f"https://example.com/{source_id}", source_id=source_id,
+        ordinal=ordinal, start_offset=start, end_offset=None if start is None else start + len(text),
+        embedding=[0.0],
+    )
+
+
+def test_overlapping_chunks_merge_back_into_source_text():
+    text = " ".join(f"word{i}" for i in range(1200))
+    chunks = list(stream_chunks([text]))
+    assert len(chunks) > 3
+    # Retrieved out of order, as a vector search would return them.
+    docs = [doc(i, c.text, ordinal=c.ordinal, start=c.start) for i, c in reversed(list(enumerate(chunks)))]
+
+    passages = merge_chunks(docs)
+
+    assert len(passages) == 1
+    assert passages[0].text == text
+    assert passages[0].rank == 0
+    assert sorted(passages[0].chunk_ids) == list(range(len(chunks)))
+
+
+def test_streamed_chunks_do_not_depend_on_how_text_arrives():
+    text = " ".join(f"word{i}" + ("\n\n" if i % 97 == 0 else "") for i in range(20000))
+    assert len(text) > 5 * SPLIT_WINDOW
+    pieces = [text[i:i + 1234] for i in range(0, len(text), 1234)]
+
+    chunks = list(stream_chunks([text]))
+
+    assert list(stream_chunks(pieces)) == chunks
+    assert [c.ordinal for c in chunks] == list(range(len(chunks)))
+    assert all(text[c.start:c.end] == c.text for c in chunks)
+    # Nothing but whitespace between consecutive chunks.
+    assert all(not text[a.end:b.start].strip() for a, b in zip(chunks, chunks[1:]))
+    assert chunks[-1].end == len(text.rstrip())
+
+
+def test_merge_keeps_sources_and_gaps_apart():
+    docs = [
+        doc(1, "alpha beta", ordinal=0, start=0),
+        doc(2, "gamma delta", ordinal=1, start=12),  # next chunk, no overlap
+        doc(3, "far away", ordinal=9, start=500),
+        doc(4, "alpha beta", source_id=2, ordinal=0, start=0),
+        doc(5, "legacy chunk"),
+    ]
+    passages = merge_chunks(docs)
+    assert [p.text for p in passages] == ["alpha beta\ngamma delta", "far away", "alpha beta", "legacy chunk"]
+
+
+def test_near_duplicates_are_dropped():
+    boilerplate = "Subscribe to our newsletter for the latest product updates and news"
+    passages = merge_chunks([
+        doc(1, "Useful answer text about the proxy configuration and timeouts"),
+        doc(2, boilerplate, source_id=2),
+        doc(3, boilerplate + " today", source_id=3),
+    ])
+    assert [p.chunk_ids for p in drop_near_duplicates(passages, 0.8)] == [[1], [2]]
+
+
+def test_pack_respects_token_budget():
+    docs = [doc(1, "a " * 400, source_id=1), doc(2, "b " * 400, source_id=2), doc(3, "c " * 20, source_id=3)]
+
+    packed = build_context(docs, budget=250, threshold=1.1)
+
+    # 800 chars ~ 200 tokens each: the second does not fit, the short third does.
+    assert [p.chunk_ids for p in packed.passages] == [[1], [3]]
+    assert packed.tokens <= 250 and packed.over_budget == 1
+
+    truncated = build_context(docs[:1], budget=50, threshold=1.1)
+    assert truncated.truncated and truncated.tokens <= 50
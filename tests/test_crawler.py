@@ -0,0 +1,15 @@
+from app import crawler, extract
+
+def test_links_are_collected_while_parsing_and_resolved_without_fragments():
+    html = b'<p>x</p><a href="/docs#intro">Docs</a><a href="https://other.org/">Other</a><a>none</a>'
+    links = []
+    "".join(extract.html_text([html], links=links))
+    assert crawler.resolve_links(links, "https://example.com/start") == [
+        "https://example.com/docs",
+        "https://other.org/",
+    ]
+
+def test_is_same_site():
+    assert crawler.is_same_site("https://example.com/a", "example.com")
+    assert not crawler.is_same_site("https://sub.example.com/a", "example.com")
+    assert not crawler.is_same_site("mailto:me@example.com", "example.com")
@@ -0,0 +1,62 @@
+import asyncio
+import json
+from datetime import datetime
+
+from app import events
+from app.events import EventHub, _message, job_event
+from app.models import Job
+
+
+def test_job_event_serializes_like_the_api():
+    job = Job(id="j1", url="https://example.com", status="PENDING", created_at=datetime(2024, 5, 1, 12, 30))
+    message = json.loads(_message("job", job_event(job)))
+    assert message == {
+        "event": "job",
+        "data": {
+            "id": "j1", "url": "https://example.com", "kind": "scrape", "parent_id": None, "status": "PENDING",
+            "created_at": "2024-05-01T12:30:00", "finished_at": None, "result": None,
+        },
+    }
+
+
+async def test_hub_fans_out_and_drops_slow_subscribers():
+    hub = EventHub("redis://localhost:6379/0", max_pending=2)
+    fast, slow = asyncio.Queue(), asyncio.Queue()
+    hub.queues.update({fast, slow})
+
+    for i in range(3):
+        hub.deliver({"event": "progress", "data": {"id": "j1", "stage": "chunked", "chunks": i}})
+        fast.get_nowait()
+
+    # The slow queue got two events, then None to close its stream.
+    assert [slow.get_nowait() for _ in range(3)][-1] is None
+    assert hub.queues == {fast}
+    assert hub.stats() == {"subscribers": 1, "dropped": 1}
+
+
+async def test_listener_skips_bad_messages_and_drops_subscribers_on_any_error(monkeypatch):
+    class FakePubSub:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def subscribe(self, channel):
+            pass
+
+        async def listen(self):
+            yield {"type": "subscribe", "data": 1}
+            yield {"type": "message", "data": b"not json"}
+            yield {"type": "message", "data": b'["not", "an", "event"]'}
+            yield {"type": "message", "data": _message("job", {"id": "j1"}).encode()}
+            raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(events.aioredis, "from_url", lambda url: type("FakeRedis", (), {"pubsub": lambda self: FakePubSub()})())
+    hub = EventHub("redis://localhost:6379/0", max_pending=10)
+    async with hub.subscribe() as queue:
+        assert await asyncio.wait_for(queue.get(), 1) == {"event": "job", "data": {"id": "j1"}}
+        # The listener survives the error, but events may have been missed.
+        assert await asyncio.wait_for(queue.get(), 1) is None
+        assert not hub._task.done()
+    hub._task.cancel()
@@ -0,0 +1,62 @@
+from bs4 import BeautifulSoup
+
+from app import extract
+
+PAGE = """<!doctype html><html><head><meta charset="utf-8"><title>Zażółć gęślą</title>
+<style>p{color:red}</style><script>var a = "<p>no</p>";</script></head>
+<body><!-- comment --><h1>Hello &amp; welcome</h1>
+<p>First   paragraph  with  double spaces<br>and a break &euro; 5</p>
+<ul><li>one</li><li><a href="/docs#intro">two</a></li></ul>
+<pre>  code
+   indented</pre><div>é ü ß 日本語</div></body></html>""".encode("utf-8")
+
+
+def soup_text(content: bytes) -> str:
+    # The BeautifulSoup extraction the streaming parser replaces.
+    soup = BeautifulSoup(content, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.extract()
+    lines = (line.strip() for line in soup.get_text().splitlines())
+    phrases = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(phrase for phrase in phrases if phrase)
+
+
+def test_html_text_matches_soup_whatever_the_block_size():
+    expected = soup_text(PAGE)
+    links = []
+
+    # One byte at a time splits multi-byte characters, entities and tags.
+    assert "".join(extract.html_text([PAGE[i:i + 1] for i in range(len(PAGE))], links=links)) == expected
+    assert "".join(extract.html_text([PAGE])) == expected
+    assert "var a" not in expected and "Hello & welcome" in expected
+    assert links == ["/docs#intro"]
+
+
+def test_html_charset_from_header_or_meta():
+    page = '<html><head><meta charset="iso-8859-2"></head><body>Łódź</body></html>'.encode("iso-8859-2")
+    assert "".join(extract.html_text([page])) == "Łódź"
+    assert "".join(extract.html_text([page], "iso-8859-2")) == "Łódź"
+    assert extract.charset_of('text/html; charset="UTF-8"') == "UTF-8"
+    assert extract.charset_of("text/html") is None
+
+
+def test_long_lines_are_cut_the_same_way_however_they_arrive():
+    line = ("word " * 40000).encode()
+    whole = list(extract.html_text([line]))
+    blocks = list(extract.html_text([line[i:i + 777] for i in range(0, len(line), 777)]))
+    assert whole == blocks and len(whole) > 1
+    assert max(len(piece) for piece in whole) <= extract.MAX_LINE + 1
+
+
+def test_plain_text_is_passed_through():
+    text = "# Title\n\n  indented  code\n\nParagraph ✓\n"
+    data = text.encode()
+    assert "".join(extract.text_from([data[i:i + 3] for i in range(0, len(data), 3)], "markdown")) == text
+
+
+def test_kinds():
+    assert extract.kind_for_filename("Report.PDF") == "pdf"
+    assert extract.kind_for_filename("notes.md") == "markdown"
+    assert extract.kind_for_filename("archive.zip") is None
+    assert extract.kind_for_content_type("text/plain; charset=utf-8") == "text"
+    assert extract.kind_for_content_type("") == "html"
@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+import httpx
+import pytest
+
+from app import fetcher
+from app.fetcher import fetch_all, retry_delay
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(fetcher.settings, "FETCH_RETRIES", 2)
+    monkeypatch.setattr(fetcher.settings, "FETCH_BACKOFF", 0.001)
+    monkeypatch.setattr(fetcher.settings, "FETCH_MAX_BACKOFF", 0.01)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    counter = itertools.count()
+    return lambda: str(tmp_path / f"body{next(counter)}")
+
+
+def test_retry_after_is_capped():
+    assert retry_delay("86400", 0) == 0.01
+    assert retry_delay("", 5) <= 0.01
+
+
+async def test_retryable_statuses_are_retried_with_capped_retry_after(spool):
+    attempts = Counter()
+
+    def handler(request):
+        attempts[request.url.path] += 1
+        if attempts[request.url.path] == 1:
+            return httpx.Response(503, headers={"Retry-After": "86400"})
+        return httpx.Response(200, text="ok")
+
+    started = time.monotonic()
+    results = await fetch_all(["https://a.test/page"], spool, transport=httpx.MockTransport(handler))
+    assert time.monotonic() - started < 1
+    with open(results["https://a.test/page"].path) as f:
+        assert f.read() == "ok"
+    assert attempts["/page"] == 2
+
+
+async def test_errors_are_returned_per_url_after_the_last_retry(spool):
+    attempts = Counter()
+
+    def handler(request):
+        attempts[request.url.path] += 1
+        if request.url.path == "/down":
+            raise httpx.ConnectError("refused", request=request)
+        if request.url.path == "/missing":
+            return httpx.Response(404)
+        return httpx.Response(304)
+
+    results = await fetch_all(
+        ["https://a.test/down", "https://a.test/missing", "https://a.test/same"],
+        spool,
+        headers={"https://a.test/same": {"If-None-Match": '"v1"'}},
+        transport=httpx.MockTransport(handler),
+    )
+    assert isinstance(results["https://a.test/down"], httpx.ConnectError)
+    assert attempts["/down"] == 3
+    # 4xx other than 429 is not retried; 304 is a result, not an error.
+    assert isinstance(results["https://a.test/missing"], httpx.HTTPStatusError)
+    assert attempts["/missing"] == 1
+    assert results["https://a.test/same"].status_code == 304
+    assert results["https://a.test/same"].path is None
+
+
+async def test_requests_per_host_are_limited(monkeypatch, spool):
+    monkeypatch.setattr(fetcher.settings, "FETCH_PER_HOST", 2)
+    running, peak = Counter(), Counter()
+
+    async def handler(request):
+        host = request.url.host
+        running[host] += 1
+        peak[host] = max(peak[host], running[host])
+        await asyncio.sleep(0.01)
+        running[host] -= 1
+        return httpx.Response(200)
+
+    urls = [f"https://{host}.test/{i}" for host in ("a", "b") for i in range(6)]
+    results = await fetch_all(urls, spool, transport=httpx.MockTransport(handler))
+    assert all(response.status_code == 200 for response in results.values())
+    assert peak == {"a.test": 2, "b.test": 2}
+
+
+async def test_bodies_are_streamed_to_the_spool_and_partial_ones_removed(spool, tmp_path):
+    class Body(httpx.AsyncByteStream):
+        def __init__(self, fail):
+            self.fail = fail
+
+        async def __aiter__(self):
+            for _ in range(4):
+                yield b"x" * 100_000
+            if self.fail:
+                raise httpx.ReadError("connection reset")
+
+    def handler(request):
+        return httpx.Response(200, stream=Body(fail=request.url.path == "/broken"))
+
+    results = await fetch_all(["https://a.test/big", "https://a.test/broken"], spool, transport=httpx.MockTransport(handler))
+    assert isinstance(results["https://a.test/broken"], httpx.ReadError)
+    [path] = list(tmp_path.iterdir())
+    assert str(path) == results["https://a.test/big"].path
+    assert path.stat().st_size == 400_000
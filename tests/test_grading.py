@@ -0,0 +1,22 @@
+from app.grading import EmbeddingGrader, LLMGrader
+from app.models import Document
+
+def doc(vector):
+    return Document(content="chunk", source="test", embedding=vector)
+
+async def test_embedding_grader_scores_relevance_and_grounding():
+    vectors = {"q": [1.0, 0.0], "on topic": [1.0, 0.0], "off topic": [0.0, 1.0]}
+
+    async def embed(text):
+        return vectors[text]
+
+    grader = EmbeddingGrader(embed, embed)
+    docs = [doc([1.0, 0.0])]
+    assert await grader.grade("q", docs, "on topic") == 1.0
+    assert await grader.grade("q", docs, "off topic") == 0.0
+
+async def test_llm_grader_parses_score():
+    async def complete(prompt):
+        return "Score: 0.85"
+
+    assert await LLMGrader(complete).grade("q", [doc([1.0, 0.0])], "a") == 0.85
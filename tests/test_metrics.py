@@ -0,0 +1,55 @@
+import time
+
+from prometheus_client import CollectorRegistry, Histogram, generate_latest
+
+from app.metrics import StageTimer, StatsCollector, span
+
+
+def test_span_observes_and_accumulates_timings():
+    registry = CollectorRegistry()
+    histogram = Histogram("test_stage_seconds", "test", ["stage"], registry=registry)
+    timings = {}
+
+    with span(histogram, "embed", timings):
+        pass
+    with span(histogram, "embed", timings):
+        pass
+    with span(histogram, "grade"):
+        pass
+
+    assert list(timings) == ["embed"] and timings["embed"] >= 0
+    assert registry.get_sample_value("test_stage_seconds_count", {"stage": "embed"}) == 2
+    assert registry.get_sample_value("test_stage_seconds_count", {"stage": "grade"}) == 1
+
+
+def test_stage_timer_counts_nested_stages_once():
+    registry = CollectorRegistry()
+    histogram = Histogram("test_pipeline_seconds", "test", ["stage"], registry=registry)
+    timer = StageTimer(histogram)
+
+    def blocks():
+        time.sleep(0.02)
+        yield "a"
+        time.sleep(0.02)
+        yield "b"
+
+    with timer.stage("fetch"):
+        time.sleep(0.01)
+    assert "".join(timer.wrap("parse", timer.wrap("fetch", blocks()))) == "ab"
+    timer.observe()
+
+    # Time spent in the inner fetch stage is not also counted as parsing.
+    assert 0.05 <= registry.get_sample_value("test_pipeline_seconds_sum", {"stage": "fetch"}) < 0.1
+    assert registry.get_sample_value("test_pipeline_seconds_sum", {"stage": "parse"}) < 0.01
+    assert registry.get_sample_value("test_pipeline_seconds_count", {"stage": "fetch"}) == 1
+
+
+def test_stats_collector_exposes_numeric_stats():
+    registry = CollectorRegistry()
+    stats = {"hits": 3, "size": 10, "hit_rate": 0.5, "batch_sizes": {1: 2}}
+    registry.register(StatsCollector("pulse_test_cache", lambda: stats, counters=("hits",)))
+
+    assert registry.get_sample_value("pulse_test_cache_hits_total") == 3
+    assert registry.get_sample_value("pulse_test_cache_size") == 10
+    assert registry.get_sample_value("pulse_test_cache_hit_rate") == 0.5
+    assert b"batch_sizes" not in generate_latest(registry)
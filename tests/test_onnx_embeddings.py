@@ -0,0 +1,99 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.manage import embedding_agreement
+from app.onnx_embeddings import CONFIG_FILE, MODEL_FILE, OnnxEmbeddings, mean_pool
+
+
+def test_mean_pool_ignores_padding_and_normalizes():
+    hidden = np.array([[[1.0, 0.0], [3.0, 0.0], [100.0, 100.0]]], dtype=np.float32)
+    mask = np.array([[1, 1, 0]])
+    assert np.allclose(mean_pool(hidden, mask, normalize=False), [[2.0, 0.0]])
+    assert np.allclose(mean_pool(hidden, mask, normalize=True), [[1.0, 0.0]])
+
+
+class FakeTokenizer:
+    def encode_batch(self, texts):
+        width = max(len(t) for t in texts)
+        return [
+            SimpleNamespace(
+                ids=[ord(c) for c in t] + [0] * (width - len(t)),
+                attention_mask=[1] * len(t) + [0] * (width - len(t)),
+                type_ids=[0] * width,
+            )
+            for t in texts
+        ]
+
+
+class FakeSession:
+    # "Hidden state" of a token is (token id, 1), so the pooled vector encodes the mean id.
+    def __init__(self):
+        self.batches = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input_ids"), SimpleNamespace(name="attention_mask")]
+
+    def run(self, outputs, feeds):
+        assert set(feeds) == {"input_ids", "attention_mask"}
+        self.batches.append(feeds["input_ids"].shape)
+        ids = feeds["input_ids"].astype(np.float32)
+        return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+
+def test_embed_documents_batches_by_length_and_keeps_order():
+    session = FakeSession()
+    model = OnnxEmbeddings(session, FakeTokenizer(), normalize=False, batch_size=2)
+    texts = ["aaaa", "b", "cccc", "d"]
+
+    vectors = model.embed_documents(texts)
+
+    assert [v[0] for v in vectors] == [ord("a"), ord("b"), ord("c"), ord("d")]
+    # The two short texts share a batch, so nothing is padded.
+    assert session.batches == [(2, 1), (2, 4)]
+
+
+def test_from_dir_runs_an_exported_graph(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper
+    from tokenizers import Tokenizer, models, pre_tokenizers
+
+    vocab = {"[PAD]": 0, "hello": 1, "world": 2}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[PAD]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+
+    table = np.array([[0, 0], [1, 0], [0, 1]], dtype=np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])],
+        "lookup",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "sequence"]),
+            helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["batch", "sequence"]),
+        ],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["batch", "sequence", 2])],
+        [helper.make_tensor("table", TensorProto.FLOAT, table.shape, table.flatten())],
+    )
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)]), str(tmp_path / MODEL_FILE))
+    (tmp_path / CONFIG_FILE).write_text(json.dumps(
+        {"max_seq_length": 8, "normalize": True, "pad_token": "[PAD]", "pad_token_id": 0}
+    ))
+
+    model = OnnxEmbeddings.from_dir(str(tmp_path))
+    vectors = model.embed_documents(["hello", "hello world world"])
+
+    assert np.allclose(vectors[0], [1.0, 0.0])
+    assert np.allclose(vectors[1], np.array([1.0, 2.0]) / np.sqrt(5))
+
+
+def test_embedding_agreement():
+    rng = np.random.default_rng(0)
+    reference = rng.standard_normal((20, 8))
+    same = embedding_agreement(reference, reference * 3, k=5)
+    assert same["min_cosine"] == pytest.approx(1.0)
+    assert same["neighbor_overlap@5"] == 1.0
+
+    noisy = embedding_agreement(reference, reference + rng.standard_normal((20, 8)), k=5)
+    assert noisy["min_cosine"] < 0.99
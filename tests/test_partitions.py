@@ -0,0 +1,25 @@
+import pytest
+
+from app import partitions
+from app.database import SCHEMA_PATCHES
+
+
+def test_partition_is_created_then_attached():
+    create, attach = partitions.partition_ddl("team_a")
+    assert create.startswith("CREATE TABLE document__team_a (LIKE document")
+    assert attach == "ALTER TABLE document ATTACH PARTITION document__team_a FOR VALUES IN ('team_a')"
+
+
+@pytest.mark.parametrize("name", ["", "Team", "a-b", "x'); DROP TABLE document; --", "a" * 41])
+def test_names_outside_pattern_are_rejected(name):
+    with pytest.raises(ValueError):
+        partitions.partition_name(name)
+
+
+def test_source_backfill_runs_after_the_collection_key_exists():
+    def position(fragment):
+        return next(i for i, patch in enumerate(SCHEMA_PATCHES) if fragment in patch)
+
+    backfill = position("INSERT INTO source")
+    assert position("ux_source_collection_url") < backfill
+    assert "ON CONFLICT (collection, url)" in SCHEMA_PATCHES[backfill]
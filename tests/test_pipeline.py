@@ -0,0 +1,146 @@
+import json
+import time
+
+import fakeredis
+import pytest
+
+from app import pipeline, worker
+from app.celery_app import celery_app
+
+
+def test_vectors_round_trip_as_float32():
+    vectors = [[0.5, -1.25, 3.0], [0.0, 2.5, -0.75]]
+    assert pipeline.unpack(pipeline.pack(vectors), 2) == vectors
+
+
+def test_every_stage_task_is_routed_to_a_registered_task():
+    routes = celery_app.conf.task_routes
+    assert {route["queue"] for route in routes.values()} == {"fetch", "parse", "embed", "write"}
+    assert set(routes) <= set(celery_app.tasks)
+    assert worker.write_batch.name in routes
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(pipeline, "store", fake)
+    for name in ("_incr_existing", "_take"):
+        monkeypatch.setattr(pipeline, name, fake.register_script(getattr(pipeline, name).script))
+    return fake
+
+
+def test_document_finishes_when_its_last_chunk_is_released(store):
+    doc_id = pipeline.start({"url": "https://example.com/page"})
+    pipeline.queue_chunks(doc_id, [{"text": "a"}, {"text": "b"}, {"text": "c"}])
+    # The parse stage holds one pending of its own until it has queued every chunk.
+    assert not pipeline.release(doc_id, 1)
+    assert not pipeline.release(doc_id, 2)
+    assert pipeline.release(doc_id, 1)
+
+    pipeline.finish(doc_id)
+    assert pipeline.in_flight() == 0
+    # Tasks still running for a finished (or failed) document do not recreate its state.
+    pipeline.count(doc_id, added=3)
+    pipeline.queue_chunks(doc_id, [{"text": "d"}])
+    assert not store.exists(pipeline.key(doc_id))
+    assert pipeline.queued_chunks() == 3
+
+
+def test_fetching_waits_while_the_pipeline_is_full(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_MAX_DOCUMENTS", 2)
+    first, _ = pipeline.start({}), pipeline.start({})
+    assert not pipeline.has_room()
+    pipeline.finish(first)
+    assert pipeline.has_room()
+
+    backlog, beats = iter([3, 2, 1]), []
+    pipeline.wait_for_room(lambda: next(backlog), 2, interval=0, heartbeat=lambda: beats.append(1))
+    assert beats == [1, 1]
+
+
+def test_documents_of_workers_that_died_stop_counting(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_MAX_DOCUMENTS", 1)
+    monkeypatch.setattr(pipeline.settings, "INGEST_DOCUMENT_TIMEOUT", 60)
+    doc_id = pipeline.start({})
+    store.zadd(pipeline.DOCUMENTS, {doc_id: time.time() - 61})
+    assert pipeline.has_room()
+
+
+def test_claimed_chunks_are_dropped_once_every_document_is_written(store):
+    store.rpush(pipeline.EMBED_LIST, *(json.dumps({"doc": doc, "text": doc}) for doc in "abc"))
+    claim, items = pipeline.take_chunks(2)
+    assert [item["doc"] for item in items] == ["a", "b"]
+    assert pipeline.queued_chunks() == 1
+
+    pipeline.hand_off(claim, ["a", "b"])
+    pipeline.ack(claim, "a")
+    assert store.llen(pipeline.claim_key(claim)) == 2
+    pipeline.ack(claim, "b")
+    assert not store.exists(pipeline.claim_key(claim))
+    assert not store.zcard(pipeline.CLAIMS)
+
+
+def test_chunks_of_a_lost_embed_task_are_requeued_in_order(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_CLAIM_TIMEOUT", 0)
+    store.rpush(pipeline.EMBED_LIST, *(json.dumps({"doc": "a", "text": str(i)}) for i in range(3)))
+    claim, _ = pipeline.take_chunks(2)
+
+    assert pipeline.stale_claims() == [claim]
+    assert pipeline.reclaim(claim) == (2, [])
+    assert [json.loads(raw)["text"] for raw in store.lrange(pipeline.EMBED_LIST, 0, -1)] == ["0", "1", "2"]
+    # Only one reaper gets a claim.
+    assert pipeline.reclaim(claim) == (0, [])
+
+
+def test_documents_of_a_lost_write_are_failed_not_requeued(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_CLAIM_TIMEOUT", 0)
+    store.rpush(pipeline.EMBED_LIST, *(json.dumps({"doc": doc, "text": doc}) for doc in "ab"))
+    claim, _ = pipeline.take_chunks(2)
+    pipeline.hand_off(claim, ["a", "b"])
+    pipeline.ack(claim, "a")
+
+    assert pipeline.reclaim(claim) == (0, ["b"])
+    assert pipeline.queued_chunks() == 0
+    assert not store.exists(pipeline.claim_key(claim))
+
+
+def test_reaper_fails_the_documents_of_lost_writes(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_CLAIM_TIMEOUT", 0)
+    failed = []
+    monkeypatch.setattr(worker, "fail_document", lambda doc_id, doc, error: failed.append(doc["url"]))
+    doc_id = pipeline.start({"url": "https://example.com/page"})
+    pipeline.queue_chunks(doc_id, [{"text": "a"}])
+    claim, _ = pipeline.take_chunks(1)
+    pipeline.hand_off(claim, [doc_id])
+
+    worker.reap_claims()
+    assert failed == ["https://example.com/page"]
+
+
+def test_writes_queued_past_the_timeout_are_not_reaped(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_CLAIM_TIMEOUT", 60)
+    doc_id = pipeline.start({"url": "https://example.com/page"})
+    pipeline.queue_chunks(doc_id, [{"text": "a"}])
+    claim, _ = pipeline.take_chunks(1)
+    pipeline.hand_off(claim, [doc_id])
+    store.zadd(pipeline.CLAIMS, {claim: time.time() - 61})
+    store.rpush("write", "a queued write task")
+    assert pipeline.stale_claims() == []
+
+    # The write starts once it leaves the queue, which makes the claim fresh again.
+    store.delete("write")
+    assert pipeline.stale_claims() == [claim]
+    stale_while_writing = []
+    monkeypatch.setattr(worker, "write_document_chunks", lambda *args: stale_while_writing.append(pipeline.stale_claims()))
+    worker.write_batch(doc_id, [{"text": "a"}], "", claim)
+    assert stale_while_writing == [[]]
+    assert not store.zcard(pipeline.CLAIMS)
+
+
+def test_claim_is_kept_fresh_while_embedding_blocks(store, monkeypatch):
+    monkeypatch.setattr(pipeline.settings, "INGEST_CLAIM_TIMEOUT", 0.03)
+    store.rpush(pipeline.EMBED_LIST, json.dumps({"doc": "a", "text": "a"}))
+    claim, _ = pipeline.take_chunks(1)
+    with pipeline.keep_claim(claim):
+        time.sleep(0.1)
+        assert store.zscore(pipeline.CLAIMS, claim) > time.time() - 0.03
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app import providers
+
+
+def test_model_is_loaded_once_across_threads(monkeypatch):
+    monkeypatch.setattr(providers, "_models", {})
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        models = list(pool.map(lambda _: providers._load("model", factory), range(32)))
+
+    assert len(calls) == 1
+    assert all(model is models[0] for model in models)
+
+
+def test_readiness_tracks_required_models(monkeypatch):
+    monkeypatch.setattr(providers, "_models", {})
+    assert providers.readiness() == {"ready": False, "models": {"embeddings": False, "llm": False}}
+
+    providers.get_llm()
+    monkeypatch.setitem(providers._models, "embeddings", object())
+    assert providers.readiness()["ready"] is True
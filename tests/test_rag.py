@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from app import rag
+
+async def test_llm_calls_are_awaited_within_the_concurrency_limit(monkeypatch):
+    running = peak = 0
+
+    class FakeLLM:
+        async def ainvoke(self, prompt):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return SimpleNamespace(content=prompt.upper())
+
+    monkeypatch.setattr(rag, "get_llm", lambda: FakeLLM())
+    monkeypatch.setattr(rag, "llm_limit", asyncio.Semaphore(2))
+    results = await asyncio.gather(*(rag.complete(f"p{i}") for i in range(6)))
+    assert results == [f"P{i}" for i in range(6)]
+    assert peak == 2
+
+async def test_query_embedding_does_not_block_the_event_loop(monkeypatch):
+    threads = []
+
+    class SlowEmbeddings:
+        def embed_query(self, text):
+            threads.append(threading.current_thread())
+            time.sleep(0.2)
+            return [1.0, 0.0]
+
+    monkeypatch.setattr(rag, "get_embeddings", lambda: SlowEmbeddings())
+    monkeypatch.setattr(rag.settings, "EMBED_MICROBATCH", False)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    assert await rag.embed_text("q") == [1.0, 0.0]
+    ticker.cancel()
+    assert threads[0] is not threading.main_thread()
+    # The loop kept running while the model was busy.
+    assert ticks >= 5
+
+async def test_stream_emits_trace_steps_and_tokens_as_they_happen(monkeypatch):
+    docs = [SimpleNamespace(content="chunk text")]
+
+    async def search_docs(session, query, options=None, timings=None, query_vector=None):
+        return docs
+
+    async def generate(query, context_text):
+        for token in (query, " answer"):
+            yield token
+
+    async def grade(query, docs, answer):
+        return 0.0  # low, so the query is rewritten
+
+    async def rewrite(query):
+        return "better query"
+
+    monkeypatch.setattr(rag, "search_docs", search_docs)
+    monkeypatch.setattr(rag, "generate_answer_stream", generate)
+    monkeypatch.setattr(rag, "grade_answer", grade)
+    monkeypatch.setattr(rag, "rewrite_query", rewrite)
+    monkeypatch.setattr(rag, "build_context", lambda docs: SimpleNamespace(text="context", summary=lambda: "1 passage"))
+    monkeypatch.setattr(rag, "grade_threshold", 0.5)
+    monkeypatch.setattr(rag.settings, "SPECULATIVE_REWRITE", False)
+
+    events = [event async for event in rag.rag_flow_stream(None, "question", cache=False)]
+    kinds = [event["event"] for event in events]
+
+    assert kinds[0] == "trace" and events[0]["data"] == "Searching for: question"
+    # The draft is streamed, discarded after the low grade, and regenerated.
+    assert [e["data"] for e in events if e["event"] == "token"] == ["question", " answer", "better query", " answer"]
+    assert kinds.index("token") < kinds.index("reset") < kinds.index("done") == len(events) - 1
+    assert any(e["data"] == "New Query: better query" for e in events if e["event"] == "trace")
+    done = events[-1]["data"]
+    assert done["answer"] == "better query answer"
+    assert "Grade: 0.0" in done["trace"]
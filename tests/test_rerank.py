@@ -0,0 +1,21 @@
+from app.models import Document
+from app.rerank import Reranker
+
+class FakeReranker(Reranker):
+    def __init__(self):
+        super().__init__("fake", batch_size=8, cache_size=10)
+        self.calls = []
+
+    def _predict(self, pairs):
+        self.calls.append(pairs)
+        return [float(len(content)) for _, content in pairs]
+
+async def test_rerank_orders_by_score_and_caches():
+    docs = [Document(id=i, content="x" * n, source="s", embedding=[0.0]) for i, n in enumerate([1, 5, 3])]
+    reranker = FakeReranker()
+    top = await reranker.rerank("Query", docs, top_k=2)
+    assert [doc.id for doc in top] == [1, 2]
+
+    await reranker.rerank(" query ", docs, top_k=2)
+    assert len(reranker.calls) == 1
+    assert reranker.stats()["hits"] == 3
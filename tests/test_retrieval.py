@@ -0,0 +1,10 @@
+from app.retrieval import fuse_rrf
+
+def test_rrf_rewards_agreement():
+    fused = fuse_rrf([[1, 2, 3], [3, 4]], [1.0, 1.0])
+    assert fused[0] == 3
+    assert set(fused) == {1, 2, 3, 4}
+
+def test_rrf_weights():
+    assert fuse_rrf([[1], [2]], [1.0, 2.0])[0] == 2
+    assert fuse_rrf([[1], [2]], [1.0, 0.0]) == [1, 2]
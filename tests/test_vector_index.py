@@ -0,0 +1,80 @@
+from app import vector_index
+from app.models import Document
+from app.schemas import SearchOptions
+from app.settings import settings
+
+def test_hnsw_ddl_uses_metric_opclass(monkeypatch):
+    monkeypatch.setattr(settings, "HNSW_M", 24)
+    ddl = vector_index.index_ddl("hnsw", "cosine")
+    assert "USING hnsw (embedding vector_cosine_ops)" in ddl
+    assert "m = 24" in ddl
+
+def test_no_index():
+    assert vector_index.index_ddl("none", "l2") is None
+
+def test_distance_matches_metric():
+    expr = vector_index.distance(Document.embedding, [0.0] * 384, "ip")
+    assert "<#>" in str(expr)
+
+def test_quantized_ddl_indexes_expression():
+    assert "((embedding::halfvec(384)) halfvec_cosine_ops)" in vector_index.index_ddl("hnsw", "cosine", "halfvec")
+    assert "bit_hamming_ops" in vector_index.index_ddl("ivfflat", "l2", "binary")
+
+def test_quantized_search_rescores_shortlist(monkeypatch):
+    monkeypatch.setattr(settings, "RESCORE_FACTOR", 5)
+    sql = str(vector_index.nearest([0.0] * 384, 3, Document.id, storage="binary"))
+    assert "binary_quantize" in sql and "<~>" in sql
+    assert "<->" in sql
+
+def test_search_is_scoped_to_collections():
+    sql = str(vector_index.nearest([0.0] * 384, 3, Document.id, collections=["docs", "wiki"]))
+    assert "document.collection IN" in sql
+
+async def test_search_params_stay_within_pgvector_limits(monkeypatch):
+    statements = []
+
+    class FakeSession:
+        async def execute(self, statement):
+            statements.append(str(statement))
+
+    # The widest request SearchOptions accepts: hybrid candidates=1000 on a quantized index.
+    options = SearchOptions(mode="hybrid", candidates=1000, rerank=True, rerank_candidates=500)
+    monkeypatch.setattr(settings, "VECTOR_INDEX", "hnsw")
+    monkeypatch.setattr(settings, "VECTOR_STORAGE", "halfvec")
+    await vector_index.apply_search_params(FakeSession(), limit=max(options.candidates, options.rerank_candidates))
+    assert statements[-1] == f"SET LOCAL hnsw.ef_search = {vector_index.MAX_EF_SEARCH}"
+
+    monkeypatch.setattr(settings, "VECTOR_INDEX", "ivfflat")
+    monkeypatch.setattr(settings, "IVFFLAT_LISTS", 100)
+    await vector_index.apply_search_params(FakeSession(), probes=500, limit=options.candidates)
+    assert statements[-1] == "SET LOCAL ivfflat.probes = 100"
+
+def test_index_built_with_other_parameters_does_not_match(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_INDEX", "hnsw")
+    monkeypatch.setattr(settings, "VECTOR_STORAGE", "full")
+    monkeypatch.setattr(settings, "VECTOR_METRIC", "l2")
+    indexdef = "CREATE INDEX document_embedding_idx ON ONLY public.document USING hnsw (embedding vector_l2_ops) WITH (m='16', ef_construction='64')"
+    assert vector_index.index_params(indexdef) == {"m": 16, "ef_construction": 64}
+    monkeypatch.setattr(settings, "HNSW_M", 16)
+    monkeypatch.setattr(settings, "HNSW_EF_CONSTRUCTION", 64)
+    assert vector_index._matches_settings(indexdef)
+    monkeypatch.setattr(settings, "HNSW_M", 32)
+    assert not vector_index._matches_settings(indexdef)
+
+async def test_probes_are_clamped_to_the_lists_the_index_was_built_with(monkeypatch, capsys):
+    statements = []
+
+    class FakeConnection:
+        async def execute(self, statement, params=None):
+            statements.append(str(statement))
+            return type("Result", (), {"scalar": lambda self: "CREATE INDEX document_embedding_idx ON ONLY public.document USING ivfflat (embedding vector_l2_ops) WITH (lists='50')"})()
+
+    monkeypatch.setattr(settings, "VECTOR_INDEX", "ivfflat")
+    monkeypatch.setattr(settings, "VECTOR_STORAGE", "full")
+    monkeypatch.setattr(settings, "VECTOR_METRIC", "l2")
+    monkeypatch.setattr(settings, "IVFFLAT_LISTS", 200)
+    monkeypatch.setattr(vector_index, "_index_lists", None)
+    await vector_index.ensure_index(FakeConnection())
+    assert "does not match settings" in capsys.readouterr().out
+    await vector_index.apply_search_params(FakeConnection(), probes=150)
+    assert statements[-1] == "SET LOCAL ivfflat.probes = 50"
@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+
+import pytest
+from celery.exceptions import Retry
+
+from app import worker
+from app.models import Source
+from app.worker import Chunk
+
+
+class FakeResult(list):
+    def all(self):
+        return list(self)
+
+    def scalar_one_or_none(self):
+        return self[0] if self else None
+
+
+class FakeSession:
+    """Records executed statements; each execute returns the next queued result."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+        self.commits = 0
+
+    def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+        return FakeResult(self.results.pop(0) if self.results else [])
+
+    def commit(self):
+        self.commits += 1
+
+    def executed(self, kind: str) -> list:
+        return [(statement, params) for statement, params in self.statements if getattr(statement, f"is_{kind}")]
+
+
+def source(**values):
+    return Source(id=7, url="https://example.com/page", collection="default", **values)
+
+
+def stored(id, text, ordinal, start):
+    return SimpleNamespace(id=id, content_hash=worker.content_hash(text), ordinal=ordinal, start_offset=start)
+
+
+def test_diff_keeps_unchanged_chunks_and_moves_shifted_ones():
+    batch = [Chunk("same", 0, 0, 4), Chunk("shifted", 1, 10, 17), Chunk("new", 2, 20, 23), Chunk("same", 3, 30, 34)]
+    session = FakeSession([stored(1, "same", 0, 0), stored(2, "shifted", 5, 50)])
+    seen = set()
+
+    new, unchanged = worker.diff_chunks(session, source(), batch, seen)
+
+    assert [chunk.text for chunk in new] == ["new"]
+    assert unchanged == 2
+    # A repeated chunk is kept once.
+    assert seen == {worker.content_hash(text) for text in ("same", "shifted", "new")}
+    # Only the chunk whose position changed is updated, in place.
+    [(_, moved)] = session.executed("update")
+    assert moved == [{"id": 2, "collection": "default", "ordinal": 1, "start_offset": 10, "end_offset": 17}]
+
+
+def test_stale_chunks_are_removed_and_counted_out_of_the_source():
+    session = FakeSession([(3, 100), (4, 20)])
+    removed = worker.remove_stale_chunks(session, source(), {worker.content_hash("kept")})
+
+    assert removed == [3, 4]
+    [(delete, _)] = session.executed("delete")
+    assert worker.content_hash("kept") in str(delete.compile(compile_kwargs={"literal_binds": True}))
+    [(stats, _)] = session.executed("update")
+    params = stats.compile().params
+    assert (params["chunk_count_1"], params["bytes_1"], params["status"]) == (-2, -120, "ACTIVE")
+    assert session.commits == 1
+
+
+def test_conditional_headers_come_from_the_stored_validators():
+    validators = source(etag='"v1"', last_modified="Wed, 21 Oct 2015 07:28:00 GMT")
+    assert worker.conditional_headers(FakeSession([validators]), validators.url) == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+    assert worker.conditional_headers(FakeSession([source()]), "https://example.com/page") == {}
+    assert worker.conditional_headers(FakeSession(), "https://example.com/new") == {}
+
+
+def test_validators_are_saved_from_the_response_headers():
+    session = FakeSession()
+    worker.save_validators(session, source(), {"ETag": '"v2"', "Last-Modified": "Thu, 22 Oct 2015 07:28:00 GMT"})
+    [(update, _)] = session.executed("update")
+    params = update.compile().params
+    assert (params["etag"], params["last_modified"]) == ('"v2"', "Thu, 22 Oct 2015 07:28:00 GMT")
+
+
+def test_not_modified_response_completes_without_parsing(monkeypatch):
+    completed = []
+    monkeypatch.setattr(worker, "get_or_create_source", lambda session, url, collection: source())
+    monkeypatch.setattr(worker, "complete_document", lambda doc, ok, summary: completed.append((ok, summary)))
+    monkeypatch.setattr(worker.pipeline, "start", lambda doc: pytest.fail("a 304 must not enter the pipeline"))
+    session = FakeSession()
+    response = SimpleNamespace(status_code=304, headers={})
+
+    worker.start_document(session, {"url": source().url, "collection": "default"}, response, iter([b"unused"]))
+
+    assert completed == [(True, "Not modified")]
+    [(update, _)] = session.executed("update")
+    assert "last_fetched_at" in update.compile().params
+
+
+def test_chunk_stats_are_updated_in_the_insert_transaction():
+    session = FakeSession()
+    worker.write_chunks(session, [Chunk("abc"), Chunk("zażółć")], [[0.0], [1.0]], source())
+
+    [(update, _)] = session.executed("update")
+    params = update.compile().params
+    # Bytes are counted in UTF-8, like octet_length() in the backfill.
+    assert (params["chunk_count_1"], params["bytes_1"]) == (2, 3 + len("zażółć".encode("utf-8")))
+    assert "source.chunk_count + " in str(update)
+    assert session.commits == 1
+
+
+def test_uploads_wait_for_room_in_the_pipeline(monkeypatch):
+    monkeypatch.setattr(worker.pipeline, "has_room", lambda: False)
+    monkeypatch.setattr(worker, "reap_claims", lambda: None)
+    monkeypatch.setattr(worker.pipeline, "start", lambda doc: pytest.fail("a full pipeline must not take the upload"))
+    with pytest.raises(Retry):
+        worker.ingest_file("job", "uploads/page.html", "upload://page.html", "html")